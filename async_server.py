@@ -0,0 +1,1063 @@
+"""
+async_server.py
+
+asyncio server mode: handshakes, matchmaking, turns and spectator pushes are
+all driven from a single event loop instead of one blocking thread per role.
+
+The game flow mirrors game_logic.py message for message, so the same
+client.py works against either mode. Run it with:
+
+    python server.py --mode async
+"""
+
+import asyncio
+import time
+import traceback
+import uuid
+
+import journal
+import keepalive as heartbeat
+import metrics
+import tracing
+from battleship import Board, parse_coordinate, DEFAULT_RULES
+from bot import DensityBot, BotConnection
+from game_logic import board_rows, board_payload, coordinate_range
+from waiting_queue import WaitingQueue
+from session_store import SessionStore
+from utils import (
+    encode_packet,
+    decode_packet,
+    encode_for,
+    parse_id_line,
+    proto_ack,
+    frame_intact,
+    header_intact,
+    RetransmitBuffer,
+    SequenceChecker,
+    FLUSH_BYTES,
+    V2_HEADER,
+    V2_MAX_PAYLOAD,
+    V2_SEQ,
+    FLAG_SEQ,
+    DEFAULT_INTEGRITY,
+    INTEGRITY_ARQ,
+    NAK_RETRY,
+    encode_frame,
+    encode_delta,
+    VIEW_SELF,
+    VIEW_OPPONENT,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    PACKET_TYPE_MESSAGE, #1
+    PACKET_TYPE_COMMAND, #2
+    PACKET_TYPE_RESULT,  #3
+    PACKET_TYPE_CONTROL, #4
+    PACKET_TYPE_BOARD,   #5
+    PACKET_TYPE_DELTA,   #6
+    PACKET_TYPE_NAK      #7
+)
+
+HANDSHAKE_TIMEOUT = 10
+TURN_TIMEOUT = 15
+SETUP_TIMEOUT = 30
+RECONNECT_TIMEOUT = 60
+# How long a second connection for a player in a game waits for the first one's end of stream
+TAKEOVER_GRACE = 0.5
+QUEUE_NOTIFY_INTERVAL = 0.5
+# Spectators whose socket buffer grows past this many bytes are dropped
+SPECTATOR_BUFFER_LIMIT = 256 * 1024
+# Clients with this many packets the game has not read yet are dropped
+INBOX_LIMIT = 256
+
+
+class AsyncGameServer:
+    """
+    Holds all server state for the asyncio mode:
+      - ready_queue: WaitingQueue of player dicts waiting for an opponent
+      - spectators: lobby spectators (StreamWriters) not attached to a game
+      - games: {game_id: {'players': (id1, id2), 'spectators': [writer, ...], 'rules': {'size', 'fleet'}}}
+      - rules: board size and fleet for new games (--board-size / --fleet)
+      - bot_wait: seconds a lone player waits before playing a bot (--bot-wait), or None
+      - player_session: SessionStore of {player_id: {'reader', 'writer', 'status', 'last_seen', 'reconnected'}}
+      - shard: sharding.ShardContext when running as one of several --workers
+      - journal / restored: journal.GameJournal and journal.RestoredGames with --journal
+      - connections: every open client StreamWriter, for the keepalive task
+      - keepalive: keepalive.Keepalive, or None with heartbeats off
+      - tasks: every task started with spawn() that has not finished (the
+        event loop itself only keeps weak references to them)
+    Each connection's packets are read by its own pump task into writer.inbox.
+    """
+
+    def __init__(self, max_games, shard=None, keepalive=None, tcp_keepalive=False, rules=DEFAULT_RULES,
+                 bot_wait=None):
+        self.max_games = max_games
+        self.rules = rules
+        self.bot_wait = bot_wait
+        self.shard = shard
+        self.keepalive = keepalive
+        self.tcp_keepalive = tcp_keepalive
+        self.connections = set()
+        self.tasks = set()
+        self.journal = None
+        self.restored = None
+        self.promoting = 0  # promotions waiting for the spectator's ID
+        self.ready_queue = WaitingQueue()
+        self.spectators = []
+        self.games = {}
+        self.player_session = SessionStore(on_evict=self._on_session_evicted)
+        self._next_game_id = 1
+        self._queue_changed = asyncio.Condition()
+
+    def spawn(self, coro):
+        """Run coro in a task the server holds on to until it ends; an exception it ends with is logged."""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            print(f"[ERROR] Task {task.get_coro().__qualname__} failed: {error!r}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    # ------------------------------------------------------------------
+    # I/O helpers
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def proto(writer):
+        """Protocol version negotiated for this connection (set in open_client)."""
+        return getattr(writer, 'proto', PROTOCOL_V1)
+
+    def write(self, writer, data, frames=1):
+        """
+        Queue bytes (`frames` packets) for a connection. Everything queued for
+        it during one pass of the event loop (until the game next waits for
+        input) goes out in a single write, or sooner once FLUSH_BYTES are waiting.
+        """
+        metrics.FRAMES_OUT[self.proto(writer)].inc(frames)
+        outbox = getattr(writer, 'outbox', None)
+        if outbox is None:
+            writer.outbox = outbox = []
+            writer.outbox_size = 0
+            asyncio.get_running_loop().call_soon(self.flush, writer)
+        outbox.append(data)
+        writer.outbox_size += len(data)
+        if writer.outbox_size >= FLUSH_BYTES:
+            self.flush(writer)
+
+    def flush(self, writer):
+        outbox = getattr(writer, 'outbox', None)
+        writer.outbox = None
+        if outbox and not writer.is_closing():
+            writer.write(b"".join(outbox))
+
+    def encode(self, writer, pkt_type, payload):
+        """One packet in the connection's protocol and integrity mode (arq packets are numbered)."""
+        sent = getattr(writer, 'sent', None)
+        if sent is not None:
+            return sent.frame(pkt_type, payload)
+        return encode_for(self.proto(writer), pkt_type, payload, getattr(writer, 'integrity', DEFAULT_INTEGRITY))
+
+    async def send(self, writer, pkt_type, payload):
+        self.write(writer, self.encode(writer, pkt_type, payload))
+        await writer.drain()
+
+    def retransmit(self, writer, seq):
+        """Answer an arq NAK (see utils.PacketWriter.retransmit)."""
+        frames = writer.sent.since(seq) if getattr(writer, 'sent', None) is not None else None
+        if frames is None:
+            raise ConnectionError(f"cannot resend frame {seq}: no longer buffered")
+        writer.outbox = None  # queued frames are resent below, in order
+        metrics.RETRANSMITS.inc(len(frames))
+        metrics.FRAMES_OUT[PROTOCOL_V2].inc(len(frames))
+        if not writer.is_closing():
+            writer.write(b"".join(frames))
+
+    def push(self, writer, pkt_type, payload):
+        """
+        Fire-and-forget write used for spectators: never waits on the peer,
+        and drops the spectator once its unsent backlog gets too large.
+        """
+        return self.push_frame(writer, encode_for(self.proto(writer), pkt_type, payload))
+
+    def push_frame(self, writer, frame):
+        if writer.is_closing():
+            return False
+        if writer.transport.get_write_buffer_size() > SPECTATOR_BUFFER_LIMIT:
+            writer.close()
+            return False
+        self.write(writer, frame)
+        return True
+
+    def deliver(self, writer, payload):
+        if writer.inbox.qsize() >= INBOX_LIMIT:
+            writer.close()
+            raise ConnectionError("too much unread input")
+        writer.inbox.put_nowait(payload)
+
+    def pong(self, writer, data):
+        if self.keepalive is not None:
+            self.keepalive.pong(writer, data.decode(errors='replace'))
+
+    async def pump(self, reader, writer):
+        """
+        The connection's only reader, from open_client until end of stream:
+        payloads go to writer.inbox for read_payload, while NAKs and
+        keepalive PONGs are answered here, so they are handled even when the
+        game is not waiting for this client. None in the inbox marks the end.
+        """
+        try:
+            if self.proto(writer) == PROTOCOL_V2:
+                await self.pump_frames(reader, writer)
+            else:
+                await self.pump_lines(reader, writer)
+        except asyncio.IncompleteReadError:
+            pass
+        except (ConnectionError, ValueError) as e:
+            print(f"[DEBUG] read error: {e}")
+        finally:
+            self.connections.discard(writer)
+            writer.inbox.put_nowait(None)
+
+    async def pump_lines(self, reader, writer):
+        """Protocol v1: one packet per line; undecodable lines are passed on stripped (legacy input)."""
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode(errors='replace')
+            if line.startswith("ID "):  # a promoted spectator's ID
+                self.deliver(writer, line)
+                continue
+            metrics.FRAMES_IN[PROTOCOL_V1].inc()
+            pkt_type, checksum, payload = decode_packet(line)
+            if pkt_type is None:
+                payload = line.strip()  # fallback for legacy
+            elif pkt_type == PACKET_TYPE_CONTROL and payload.startswith("PONG"):
+                self.pong(writer, payload.encode())
+                continue
+            self.deliver(writer, payload)
+
+    async def pump_frames(self, reader, writer):
+        """
+        Protocol v2. With arq, frames after a corrupted one are skipped (and
+        NAKed) until the resend arrives, and a NAK whose resend is overdue is
+        repeated. A corrupted frame without arq is passed on as "" (an
+        invalid command). After a corrupted header the stream is read one
+        byte at a time until the next intact header.
+        """
+        arq = getattr(writer, 'integrity', None) == INTEGRITY_ARQ
+        while True:
+            first = await self.next_byte(reader, writer, arq)
+            if first[0] >= 0x20:  # frames start with their type; this is a text line (a promoted spectator's ID)
+                self.deliver(writer, (first + await reader.readline()).decode(errors='replace'))
+                continue
+            header = bytearray(first + await reader.readexactly(V2_HEADER.size - 1))
+            if not header_intact(header):
+                metrics.FRAMES_IN[PROTOCOL_V2].inc()
+                metrics.CHECKSUM_FAILURES[PROTOCOL_V2].inc()
+                if arq:
+                    nak = writer.sequence.lost()
+                    if nak is not None:
+                        self.write(writer, encode_frame(PACKET_TYPE_NAK, str(nak)))
+                else:
+                    self.deliver(writer, "")
+                while not header_intact(header):
+                    del header[0]
+                    header += await self.next_byte(reader, writer, arq)
+            pkt_type, flags, length, _, _ = V2_HEADER.unpack(header)
+            if length > V2_MAX_PAYLOAD:
+                raise ConnectionError(f"v2 frame too large ({length} bytes)")
+            prefix = await reader.readexactly(V2_SEQ.size) if flags & FLAG_SEQ else b""
+            data = await reader.readexactly(length)
+            intact = frame_intact(header, prefix, data)
+            metrics.FRAMES_IN[PROTOCOL_V2].inc()
+            if not intact:
+                metrics.CHECKSUM_FAILURES[PROTOCOL_V2].inc()
+            if flags & FLAG_SEQ:
+                deliver, nak = writer.sequence.check(V2_SEQ.unpack(prefix)[0], intact)
+                if nak is not None:
+                    self.write(writer, encode_frame(PACKET_TYPE_NAK, str(nak)))
+                if not deliver:
+                    continue
+            elif not intact:
+                self.deliver(writer, "")
+                continue
+            if pkt_type == PACKET_TYPE_NAK:
+                self.retransmit(writer, int(data))
+            elif pkt_type == PACKET_TYPE_CONTROL and data.startswith(b"PONG"):
+                self.pong(writer, data)
+            else:
+                self.deliver(writer, data.decode(errors='replace'))
+
+    async def next_byte(self, reader, writer, arq):
+        """Read one byte; with arq, repeat an overdue NAK while waiting for it."""
+        while arq:
+            try:
+                return await asyncio.wait_for(reader.readexactly(1), NAK_RETRY)
+            except asyncio.TimeoutError:
+                nak = writer.sequence.overdue()
+                if nak is not None:
+                    self.write(writer, encode_frame(PACKET_TYPE_NAK, str(nak)))
+        return await reader.readexactly(1)
+
+    async def read_payload(self, player, timeout_seconds):
+        """
+        Wait up to timeout_seconds for the player's next packet. Returns
+        (status, payload) with status "ok", "timeout" or "closed".
+        """
+        inbox = player['writer'].inbox
+        try:
+            payload = await asyncio.wait_for(inbox.get(), timeout_seconds)
+        except asyncio.TimeoutError:
+            metrics.TIMEOUTS.inc()
+            return "timeout", None
+        if payload is None:
+            inbox.put_nowait(None)  # the stream stays closed for the next read
+            return "closed", None
+        return "ok", payload
+
+    def broadcast_to_spectators(self, spectators, message):
+        # Encode once per protocol version; every spectator transport gets the same bytes
+        frames = {}
+        for writer in list(spectators):
+            proto = self.proto(writer)
+            if proto not in frames:
+                frames[proto] = encode_for(proto, PACKET_TYPE_MESSAGE, f"[Spectator] {message}")
+            if not self.push_frame(writer, frames[proto]):
+                spectators.remove(writer)
+
+    async def send_board(self, writer, board, own=False):
+        proto = self.proto(writer)
+        if proto == PROTOCOL_V2:
+            await self.send(writer, PACKET_TYPE_BOARD, board_payload(VIEW_SELF if own else VIEW_OPPONENT, board, own))
+            return
+        title, marker = (" Your board:", "GRID_SELF") if own else (" Opponent's board:", "GRID_OPPONENT")
+        lines = [title, marker] + board_rows(board, own) + [" End of board"]
+        self.write(writer, b"".join(encode_for(proto, PACKET_TYPE_MESSAGE, l) for l in lines), len(lines))
+        await writer.drain()
+
+    # ------------------------------------------------------------------
+    # Handshake and matchmaking
+    # ------------------------------------------------------------------
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        accepted = tracing.now()
+        metrics.CONNECTIONS.inc()
+        print(f"[INFO] New client from {addr}")
+        try:
+            id_line = await asyncio.wait_for(reader.readline(), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            id_line = b""
+        id_line = id_line.decode(errors='replace')
+        if not id_line.startswith("ID "):
+            print("[WARN] Invalid or missing ID line.")
+            writer.close()
+            return
+
+        player_id, proto, integrity = parse_id_line(id_line)
+        print(f"[INFO] Received player ID: {player_id}")
+
+        # Sharded mode: a player whose game lives on another worker is routed there
+        if self.shard is not None and player_id not in self.player_session:
+            owner = self.shard.owner(player_id)
+            if owner is None and not self.ready_queue:
+                owner = self.shard.lobby_owner()  # pair with a lone player on another worker
+            if owner is not None and self.shard.forward(writer.get_extra_info('socket'), id_line, owner):
+                writer.close()
+                return
+
+        await self.open_client(reader, writer, player_id, proto, integrity, accepted)
+
+    async def adopt_forwarded_client(self, conn, id_line):
+        """Handle a client socket handed over by another worker process."""
+        reader, writer = await asyncio.open_connection(sock=conn)
+        await self.open_client(reader, writer, *parse_id_line(id_line))
+
+    async def open_client(self, reader, writer, player_id, proto, integrity, accepted=None):
+        """
+        Acknowledge protocol v2 (and the integrity mode) if the client asked
+        for it, start reading the connection, then register.
+        """
+        if self.tcp_keepalive:
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                heartbeat.enable_tcp_keepalive(sock)
+        if proto == PROTOCOL_V2:
+            writer.proto = PROTOCOL_V2
+            writer.integrity = integrity
+            writer.sequence = SequenceChecker()
+            if integrity == INTEGRITY_ARQ:
+                writer.sent = RetransmitBuffer()
+            writer.write(f"{proto_ack(integrity)}\n".encode())
+        writer.peer_name = player_id
+        writer.inbox = asyncio.Queue()
+        self.connections.add(writer)
+        writer.pumped = self.spawn(self.pump(reader, writer))
+        await self.register(reader, writer, player_id, accepted)
+
+    def new_session(self, reader, writer, accepted=None):
+        return {
+            'reader': reader,
+            'writer': writer,
+            'status': 'connected',
+            'last_seen': time.time(),
+            'reconnected': asyncio.Event(),
+            # Lifecycle timestamps for the game's trace; see tracing.record_arrival
+            'accepted_at': accepted,
+            'registered_at': tracing.now(),
+        }
+
+    async def register(self, reader, writer, player_id, accepted=None):
+        session = self.player_session.get(player_id)
+        if session and session.get('in_game') and session['status'] != 'disconnected':
+            # A reconnecting client's old stream may not have reached its end yet
+            if not session['writer'].pumped.done():
+                await asyncio.wait({session['writer'].pumped}, timeout=TAKEOVER_GRACE)
+            session = self.player_session.get(player_id)
+        # Only a player in a running game whose connection is gone takes it over
+        if session and session.get('in_game'):
+            if session['status'] != 'disconnected' and not session['writer'].pumped.done():
+                print(f"[WARN] Refused a second connection for {player_id}: already in a game.")
+                self.push(writer, PACKET_TYPE_MESSAGE, f"MESSAGE ID {player_id} is already playing a game. Connect with another ID.")
+                self.flush(writer)
+                writer.close()
+                return
+            old_writer = session['writer']
+            session.update(reader=reader, writer=writer, status='reconnected')
+            self.player_session.touch(player_id)
+            if old_writer is not writer:
+                old_writer.close()  # wake a game still reading the old stream
+            session['reconnected'].set()
+            metrics.RECONNECTS.inc()
+            print(f"[INFO] Player {player_id} reconnected.")
+            return
+
+        self.player_session[player_id] = self.new_session(reader, writer, accepted)
+        if self.shard is not None:
+            self.shard.claim(player_id)
+        try:
+            # A player whose game was running when the server went down rejoins it
+            if self.restored is not None and player_id in self.restored:
+                await self.send(writer, PACKET_TYPE_MESSAGE, "MESSAGE Restoring your game after a server restart. Waiting for your opponent...")
+                game = self.restored.arrive(player_id, {'reader': reader, 'writer': writer, 'player_id': player_id})
+                if game is not None:
+                    p1, p2 = (game['present'][pid] for pid in game['players'])
+                    print(f"[INFO] Resuming game {game['game_id']} from the journal.")
+                    self.start_game(p1, p2, resume=game)
+                return
+            if len(self.ready_queue) < 2 * self.free_slots():
+                await self.send(writer, PACKET_TYPE_MESSAGE, "MESSAGE Connected as player. Waiting for a match...")
+                await self.enqueue({'reader': reader, 'writer': writer, 'player_id': player_id})
+            else:
+                await self.send(writer, PACKET_TYPE_MESSAGE, "MESSAGE Spectator mode. Waiting for a match...")
+                self.add_spectator(reader, writer)
+        except ConnectionError as e:
+            print(f"[ERROR] Failed to register client: {e}")
+            writer.close()
+
+    def free_slots(self):
+        return max(0, self.max_games - len(self.games))
+
+    def spectator_count(self):
+        return len(self.spectators) + sum(len(game['spectators']) for game in list(self.games.values()))
+
+    def add_spectator(self, reader, writer):
+        writer.spectator_reader = reader
+        if self.games:
+            game = min(self.games.values(), key=lambda g: len(g['spectators']))
+            game['spectators'].append(writer)
+        else:
+            self.spectators.append(writer)
+
+    async def enqueue(self, player, front=False):
+        session = self.player_session.get(player['player_id'])
+        if session is not None:
+            session['queued_at'] = tracing.now()
+        if front:
+            self.ready_queue.push_front(player['player_id'], player)
+        else:
+            self.ready_queue.push(player['player_id'], player)
+        if self.shard is not None:
+            self.shard.advertise_waiting(len(self.ready_queue) == 1)
+        async with self._queue_changed:
+            self._queue_changed.notify_all()
+
+    async def matchmaker(self):
+        while True:
+            async with self._queue_changed:
+                await self._queue_changed.wait_for(
+                    lambda: len(self.ready_queue) >= 2 and self.free_slots() > 0)
+            p1, p2 = self.ready_queue.pop_pair()
+            paired = tracing.now()
+            for p in (p1, p2):
+                session = self.player_session.get(p['player_id'])
+                if session is not None:
+                    session['paired_at'] = paired
+            if self.shard is not None:
+                self.shard.advertise_waiting(len(self.ready_queue) == 1)
+            self.start_game(p1, p2)
+
+    async def bot_matchmaker(self):
+        """Seat a bot (bot.DensityBot) with a player who has waited alone for bot_wait seconds."""
+        while True:
+            async with self._queue_changed:
+                await self._queue_changed.wait_for(
+                    lambda: self.ready_queue.lone_wait(self.bot_wait) is not None and self.free_slots() > 0)
+            left = self.ready_queue.lone_wait(self.bot_wait)
+            if left is None:
+                continue
+            if left > 0:
+                await asyncio.sleep(left)  # then check again: someone may have joined meanwhile
+                continue
+            player = self.ready_queue.pop()
+            session = self.player_session.get(player['player_id'])
+            if session is not None:
+                session['paired_at'] = tracing.now()
+            if self.shard is not None:
+                self.shard.advertise_waiting(False)
+            bot = DensityBot()
+            if not self.push(player['writer'], PACKET_TYPE_MESSAGE,
+                             f"MESSAGE No opponent found. You will play the computer ({bot.player_id})."):
+                continue
+            print(f"[INFO] {player['player_id']} waited {self.bot_wait:g}s alone; seating {bot.player_id} against them.")
+            self.start_game(player, {'player_id': bot.player_id, 'reader': None, 'writer': BotConnection(bot), 'bot': bot})
+
+    def start_game(self, p1, p2, resume=None):
+        game_id = self._next_game_id
+        self._next_game_id += 1
+        game = {'players': (p1['player_id'], p2['player_id']), 'spectators': self.spectators,
+                'rules': resume['rules'] if resume is not None else self.rules}
+        self.spectators = []
+        self.games[game_id] = game
+        print(f"[INFO] Game #{game_id} started: {p1['player_id']} vs {p2['player_id']} "
+              f"({len(self.games)}/{self.max_games} games running)")
+        self.spawn(self.run_game(game_id, game, p1, p2, resume))
+
+    def open_journal(self, path):
+        """Recover unfinished games from the journal, then keep recording to it."""
+        games = journal.load_unfinished_games(path)
+        self.journal = journal.GameJournal(path)
+        self.journal.seed(games)
+        self.restored = journal.RestoredGames(games)
+        if games:
+            print(f"[INFO] Recovered {len(games)} unfinished game(s) from {path}")
+            if self.shard is not None:
+                for game in games.values():
+                    for player_id in game['players']:
+                        self.shard.claim(player_id)
+        asyncio.get_running_loop().call_later(
+            journal.RECOVERY_TTL, lambda: self.spawn(self.release_restored_players()))
+
+    async def release_restored_players(self):
+        stranded, dropped = self.restored.release()
+        for game_id in dropped:
+            self.journal.game_ended(game_id)
+        if dropped:
+            print(f"[INFO] Dropped {len(dropped)} recovered game(s) whose players did not both come back.")
+        for player in stranded:
+            if self.push(player['writer'], PACKET_TYPE_MESSAGE, "MESSAGE Your opponent did not come back. Waiting for a new match..."):
+                await self.enqueue(player)
+
+    async def queue_notifier(self):
+        while True:
+            await asyncio.sleep(QUEUE_NOTIFY_INTERVAL)
+            # Only clients whose position moved since the last round are told
+            for player_id, player, position in self.ready_queue.collect_changes():
+                if not self.push(player['writer'], PACKET_TYPE_MESSAGE, f"MESSAGE Waiting in queue... you are #{position}"):
+                    self.ready_queue.remove(player_id)
+            self.player_session.sweep()
+
+    def _on_session_evicted(self, player_id, session):
+        if session.get('status') == 'disconnected':
+            session['writer'].close()
+        if self.shard is not None:
+            self.shard.release(player_id)
+        print(f"[INFO] Session for {player_id} expired ({session.get('status')}).")
+
+    async def run_game(self, game_id, game, p1, p2, resume=None):
+        trace = tracing.TRACER.start_trace("game", game_id=game_id, players=[p1['player_id'], p2['player_id']])
+        # Sessions of long-queued players may have expired; players in a game need one
+        for p in (p1, p2):
+            if 'bot' in p:
+                continue
+            if p['player_id'] in self.player_session:
+                self.player_session.touch(p['player_id'])
+                tracing.record_arrival(trace, p['player_id'], self.player_session[p['player_id']])
+            else:
+                self.player_session[p['player_id']] = self.new_session(p['reader'], p['writer'])
+        if resume is not None:
+            p1['board'], p2['board'] = resume['boards']
+        survivor = None
+        try:
+            survivor = await self.run_two_player_session(p1, p2, game['spectators'], resume, trace, game['rules'])
+        except Exception as e:
+            print(f"[ERROR] Game #{game_id} crashed: {e}")
+        finally:
+            self.games.pop(game_id, None)
+            self.spectators.extend(game['spectators'])
+            trace.end()
+
+        # A player who reconnected while the game could not adopt it (setup, play again, game over)
+        for p in self.collect_reconnections((p1, p2)):
+            if p is not survivor:
+                self.push(p['writer'], PACKET_TYPE_MESSAGE, "Your game has ended. Waiting for a new opponent...")
+                await self.enqueue(p)
+        if survivor and 'bot' not in survivor:
+            self.push(survivor['writer'], PACKET_TYPE_MESSAGE, "Waiting for a new opponent...")
+            await self.enqueue(survivor)
+        await self.promote_spectators()
+        async with self._queue_changed:
+            self._queue_changed.notify_all()
+        print(f"[INFO] Game #{game_id} cleaned up. Slot released.")
+
+    async def promote_spectators(self):
+        """
+        Promote lobby spectators while there are free slots the ready queue
+        cannot fill. Each promotion waits for its ID in its own task, so a
+        silent spectator does not hold up the game that just ended.
+        """
+        while len(self.ready_queue) + self.promoting < 2 * self.free_slots() and self.spectators:
+            writer = self.spectators.pop(0)
+            if writer.is_closing():
+                print("[SKIP] Spectator connection dead, skipping.")
+                continue
+            self.promoting += 1
+            self.spawn(self.promote(writer))
+
+    async def promote(self, writer):
+        reader = writer.spectator_reader
+        try:
+            await self.send(writer, PACKET_TYPE_MESSAGE, "You are being promoted to a player. Send your ID again.")
+            await self.send(writer, PACKET_TYPE_COMMAND, "SEND-ID")
+            id_line = await asyncio.wait_for(writer.inbox.get(), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            print(f"[ERROR] Failed to promote spectator: {e}")
+            id_line = ""
+        self.promoting -= 1
+        if not id_line or not id_line.startswith("ID "):
+            print("[WARN] Spectator failed to send ID.")
+            writer.close()
+            await self.promote_spectators()  # offer the slot to the next spectator
+            return
+        new_id = parse_id_line(id_line)[0]  # the connection keeps the protocol it already speaks
+        print(f"[INFO] Promoted spectator with ID: {new_id}")
+        writer.peer_name = new_id
+        self.player_session[new_id] = self.new_session(reader, writer)
+        if self.shard is not None:
+            self.shard.claim(new_id)
+        await self.enqueue({'reader': reader, 'writer': writer, 'player_id': new_id})
+
+    async def keepalive_loop(self):
+        """Ping every connection each interval; close the ones that stopped answering (see keepalive.py)."""
+        keepalive = self.keepalive
+        while True:
+            await asyncio.sleep(keepalive.interval)
+            ping = keepalive.next_ping()
+            for writer in list(self.connections):
+                if keepalive.pinged(writer, writer.peer_name):
+                    keepalive.evicted(writer.peer_name)
+                    writer.transport.abort()  # its pump ends, and whoever reads it sees "closed"
+                elif not writer.is_closing():
+                    self.write(writer, self.encode(writer, PACKET_TYPE_CONTROL, ping))
+            keepalive.retain(self.connections)
+
+    # ------------------------------------------------------------------
+    # Game flow (mirrors game_logic.py)
+    # ------------------------------------------------------------------
+
+    async def run_two_player_session(self, p1, p2, spectators, resume=None, trace=tracing.NO_SPAN, rules=DEFAULT_RULES):
+        # While the session runs, a new connection with either player's ID is a reconnection
+        sessions = [self.player_session.get(p['player_id']) for p in (p1, p2)]
+        for session in sessions:
+            if session:
+                session['in_game'] = True
+        try:
+            return await self._run_two_player_session(p1, p2, spectators, resume, trace, rules)
+        finally:
+            for session in sessions:
+                if session:
+                    session['in_game'] = False
+
+    async def _run_two_player_session(self, p1, p2, spectators, resume=None, trace=tracing.NO_SPAN, rules=DEFAULT_RULES):
+        while True:
+            if resume is None:
+                p1.pop("board", None)
+                p2.pop("board", None)
+                game_id = uuid.uuid4().hex
+            else:
+                game_id = resume['game_id']
+            self.broadcast_to_spectators(spectators, "A new round is starting...")
+            try:
+                with trace.child("round", round_id=game_id) as round_span:
+                    success = await self.run_single_game(p1, p2, spectators, game_id, resume, round_span, rules)
+            finally:
+                if self.journal:
+                    self.journal.game_ended(game_id)
+            resume = None
+            if not success:
+                return None
+            for p in (p1, p2):
+                await self.send(p['writer'], PACKET_TYPE_MESSAGE, " Game over. Waiting for the other player to decide...")
+            again1 = await self.ask_play_again(p1)
+            again2 = await self.ask_play_again(p2)
+
+            if again1 and again2:
+                continue
+
+            if again1 != again2:
+                survivor = p1 if again1 else p2
+                await self.send(survivor['writer'], PACKET_TYPE_MESSAGE, " Opponent declined to continue. You will be returned to the waiting queue.")
+                await self.send(survivor['writer'], PACKET_TYPE_MESSAGE, " Session ended.")
+                return survivor
+
+            for p in (p1, p2):
+                await self.send(p['writer'], PACKET_TYPE_MESSAGE, " Both players declined. Session ended.")
+            return None
+
+    async def forfeit(self, winner, message):
+        try:
+            await self.send(winner['writer'], PACKET_TYPE_MESSAGE, message)
+            await self.send(winner['writer'], PACKET_TYPE_RESULT, "WIN")
+        except ConnectionError:
+            pass
+
+    async def wait_for_reconnect(self, current, opponent):
+        """
+        Park the game until the disconnected player's new connection is
+        registered by handle_client, or the reconnect window expires.
+        """
+        player_id = current['player_id']
+        session = self.player_session[player_id]
+        if not session['reconnected'].is_set():
+            self.player_session.mark_disconnected(player_id)
+        try:
+            await asyncio.wait_for(session['reconnected'].wait(), RECONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        self.adopt_reconnection(current, session)
+        print(f"[INFO] Player {player_id} reconnected within {RECONNECT_TIMEOUT}s.")
+        return True
+
+    def collect_reconnections(self, players):
+        """Switch players over to reconnections their game ended without adopting; returns them."""
+        adopted = []
+        for player in players:
+            session = self.player_session.get(player['player_id'])
+            if 'bot' not in player and session is not None and session['reconnected'].is_set():
+                self.adopt_reconnection(player, session)
+                adopted.append(player)
+        return adopted
+
+    def adopt_reconnection(self, player, session):
+        """Switch a player over to the connection registered in their session."""
+        session['reconnected'].clear()
+        player['reader'] = session['reader']
+        player['writer'] = session['writer']
+        session['status'] = 'connected'
+        self.player_session.touch(player['player_id'])
+
+    async def sync_boards(self, player, opponent):
+        """Both boards in full for v2 clients; v1 clients get their own (see game_logic.sync_boards)."""
+        await self.send_board(player['writer'], player['board'], own=True)
+        if self.proto(player['writer']) == PROTOCOL_V2:
+            await self.send_board(player['writer'], opponent['board'])
+
+    async def send_move_result(self, players, turn, row, col, spectators):
+        """Mirrors game_logic.send_move_result: deltas for v2 clients, the full board for v1."""
+        current, opponent = players[turn], players[1 - turn]
+        board = opponent['board']
+        if self.proto(current['writer']) == PROTOCOL_V2:
+            await self.send(current['writer'], PACKET_TYPE_DELTA,
+                            encode_delta(VIEW_OPPONENT, [(row, col, board.display_grid[row][col])]))
+        else:
+            await self.send_board(current['writer'], board)
+        if self.proto(opponent['writer']) == PROTOCOL_V2:
+            await self.send(opponent['writer'], PACKET_TYPE_DELTA,
+                            encode_delta(VIEW_SELF, [(row, col, board.hidden_grid[row][col])]))
+        # Board snapshot for v2 spectators
+        frame = encode_frame(PACKET_TYPE_BOARD, board_payload(f"player{2 - turn}", board))
+        for writer in list(spectators):
+            if self.proto(writer) == PROTOCOL_V2 and not self.push_frame(writer, frame):
+                spectators.remove(writer)
+
+    async def notify_reconnected(self, player, opponent):
+        await self.send(player['writer'], PACKET_TYPE_MESSAGE, " You have reconnected successfully. Resuming game...")
+        if self.proto(player['writer']) == PROTOCOL_V2 and 'board' in player:
+            await self.sync_boards(player, opponent)
+        await self.send(opponent['writer'], PACKET_TYPE_MESSAGE, " Opponent has reconnected. Game will resume.")
+
+    async def resume_single_game(self, p1, p2, spectators, turn):
+        for idx, p in enumerate((p1, p2)):
+            await self.send(p['writer'], PACKET_TYPE_MESSAGE, " Your game was interrupted by a server restart. Resuming...")
+            await self.sync_boards(p, (p1, p2)[1 - idx])
+            await self.send(p['writer'], PACKET_TYPE_MESSAGE, f" You are Player {idx + 1}.")
+        self.broadcast_to_spectators(spectators, f"Resumed game: {p1['player_id']} vs {p2['player_id']}")
+        waiting = (p1, p2)[1 - turn]
+        await self.send(waiting['writer'], PACKET_TYPE_MESSAGE, f" Waiting for Player {turn + 1} to make their move...")
+
+    async def run_single_game(self, p1, p2, spectators, game_id=None, resume=None, trace=tracing.NO_SPAN,
+                              rules=DEFAULT_RULES):
+        players = [p1, p2]
+        if resume is not None:
+            try:
+                await self.resume_single_game(p1, p2, spectators, resume['turn'])
+            except ConnectionError:
+                return False
+            return await self.play_turns(players, resume['turn'], spectators, game_id, trace)
+
+        try:
+            for p in players:
+                await self.send(p['writer'], PACKET_TYPE_MESSAGE, " Waiting for opponent to connect...")
+            for p, other in ((p1, p2), (p2, p1)):
+                with trace.child("setup_board", player=p['player_id']):
+                    ready = await self.setup_player_board(p, other, rules)
+                if not ready:
+                    p1['writer'].close()
+                    p2['writer'].close()
+                    return False
+
+            await self.sync_boards(p1, p2)
+            await self.sync_boards(p2, p1)
+            self.broadcast_to_spectators(spectators, f"New game: {p1['player_id']} vs {p2['player_id']}")
+            for idx, p in enumerate(players):
+                await self.send(p['writer'], PACKET_TYPE_MESSAGE, " Both players have placed their ships. Game starting...")
+                await self.send(p['writer'], PACKET_TYPE_MESSAGE, f" Game started! You are Player {idx + 1}.")
+            await self.send(p1['writer'], PACKET_TYPE_MESSAGE, " You go first.")
+            await self.send(p2['writer'], PACKET_TYPE_MESSAGE, " Waiting for Player 1 to make their move...")
+        except ConnectionError:
+            return False
+        if self.journal:
+            self.journal.game_started(game_id, p1, p2)
+        return await self.play_turns(players, 0, spectators, game_id, trace)
+
+    async def play_turns(self, players, turn, spectators, game_id=None, trace=tracing.NO_SPAN):
+        """Turn loop; traced like game_logic.play_turns."""
+        turns = 0
+        while True:
+            current = players[turn]
+            opponent = players[1 - turn]
+            turns += 1
+            turn_span = trace.child("turn", turn=turns, player=current['player_id'])
+            try:
+                # A player may reconnect while it is not their turn
+                for idx, p in enumerate(players):
+                    session = self.player_session.get(p['player_id'])
+                    if session and session['reconnected'].is_set():
+                        self.adopt_reconnection(p, session)
+                        await self.notify_reconnected(p, players[1 - idx])
+                with turn_span.child("prompt"):
+                    if self.proto(current['writer']) != PROTOCOL_V2:
+                        await self.send_board(current['writer'], opponent['board'])
+                    await self.send(current['writer'], PACKET_TYPE_MESSAGE, " Your turn! Enter command (e.g. FIRE B5):")
+                turn_started = time.monotonic()
+                with turn_span.child("read_input"):
+                    if 'bot' in current:
+                        status, payload = "ok", current['bot'].command()
+                    else:
+                        status, payload = await self.read_payload(current, TURN_TIMEOUT)
+                turn_span.set(outcome=status)
+
+                if status == "closed":
+                    if current['player_id'] not in self.player_session:
+                        await self.forfeit(opponent, " Opponent ID missing. Ending game.")
+                        return False
+                    await self.send(opponent['writer'], PACKET_TYPE_MESSAGE, " Opponent disconnected. Waiting for reconnection (60s)...")
+                    if not await self.wait_for_reconnect(current, opponent):
+                        await self.forfeit(opponent, " Opponent did not reconnect in time. Ending game.")
+                        return False
+                    if opponent['writer'].is_closing():
+                        print("[INFO] Opponent also disconnected. Ending game.")
+                        return False
+                    await self.notify_reconnected(current, opponent)
+                    continue
+                elif status == "timeout":
+                    await self.send(current['writer'], PACKET_TYPE_MESSAGE, " Timeout occurred. Your turn was skipped.")
+                    await self.send(opponent['writer'], PACKET_TYPE_MESSAGE, " Opponent timed out. Their turn was skipped.")
+                    if self.journal:
+                        self.journal.skipped(game_id, turn)
+                    turn = 1 - turn
+                    continue
+
+                if payload.lower() == 'quit':
+                    raise ConnectionResetError("Player quit")
+
+                parts = payload.split()
+                if len(parts) != 2 or parts[0].upper() != "FIRE":
+                    await self.send(current['writer'], PACKET_TYPE_MESSAGE, " Invalid command. Use 'FIRE <coordinate>' (e.g. FIRE B2).")
+                    continue
+                self.broadcast_to_spectators(spectators, f"Player {turn + 1} fired at {parts[1]}")
+
+                size = opponent['board'].size
+                try:
+                    row, col = parse_coordinate(parts[1])
+                except Exception:
+                    await self.send(current['writer'], PACKET_TYPE_MESSAGE, f" Invalid coordinate format. Use {coordinate_range(size)}.")
+                    await self.send(current['writer'], PACKET_TYPE_RESULT, "INVALID")
+                    continue
+
+                if not (0 <= row < size and 0 <= col < size):
+                    await self.send(current['writer'], PACKET_TYPE_MESSAGE, f" Coordinate out of bounds. Use {coordinate_range(size)}.")
+                    await self.send(current['writer'], PACKET_TYPE_RESULT, "INVALID")
+                    continue
+
+                with turn_span.child("fire"):
+                    result, sunk = opponent['board'].fire_at(row, col)
+                if 'bot' in current:
+                    current['bot'].observe(row, col, result, sunk)
+                metrics.TURN_SECONDS.observe(time.monotonic() - turn_started)
+                turn_span.set(outcome=result)
+                if self.journal:
+                    self.journal.fired(game_id, turn, row, col, result, sunk)
+                send_span = turn_span.child("send_board")
+
+                if result == 'hit':
+                    self.broadcast_to_spectators(spectators, "It was a HIT!")
+                    if sunk:
+                        await self.send(current['writer'], PACKET_TYPE_RESULT, f" You sank a {sunk.upper()}!")
+                        self.broadcast_to_spectators(spectators, f"They sank a {sunk.upper()}!")
+                    else:
+                        await self.send(current['writer'], PACKET_TYPE_RESULT, " You hit!")
+                    if opponent['board'].all_ships_sunk():
+                        await self.send(current['writer'], PACKET_TYPE_RESULT, " You won the game!")
+                        await self.send(opponent['writer'], PACKET_TYPE_RESULT, " You lost the game.")
+                        self.broadcast_to_spectators(spectators, f"Player {turn + 1} won the game!")
+                        send_span.end()
+                        return True
+                elif result == 'miss':
+                    self.broadcast_to_spectators(spectators, "It was a MISS!")
+                    await self.send(current['writer'], PACKET_TYPE_RESULT, " You missed.")
+                elif result == 'already_shot':
+                    self.broadcast_to_spectators(spectators, "They fired at an already hit position.")
+                    await self.send(current['writer'], PACKET_TYPE_RESULT, " You already shot there.")
+
+                await self.send_move_result(players, turn, row, col, spectators)
+                send_span.end()
+                turn = 1 - turn
+
+            except ConnectionError:
+                await self.forfeit(opponent, " Opponent disconnected unexpectedly")
+                return False
+            finally:
+                turn_span.end()
+
+    async def setup_player_board(self, player, opponent, rules=DEFAULT_RULES):
+        if 'bot' in player:
+            player['board'] = player['bot'].new_round(rules)
+            return True
+        writer = player['writer']
+        try:
+            await self.send(writer, PACKET_TYPE_MESSAGE, " Setting up your board...")
+            await self.send(writer, PACKET_TYPE_MESSAGE, "Place ships manually (M) or randomly (R)? [M/R]  (timeout in 15s):")
+            status, choice = await self.read_payload(player, TURN_TIMEOUT)
+            if status != "ok":
+                await self.forfeit(opponent, " Opponent disconnected during setup (timeout or quit)")
+                return False
+
+            board = Board(rules['size'])
+            if choice.strip().upper() == 'M':
+                for ship_name, ship_size in rules['fleet']:
+                    while True:
+                        await self.send(writer, PACKET_TYPE_MESSAGE, f" Placing {ship_name} (size {ship_size})")
+                        await self.send(writer, PACKET_TYPE_MESSAGE, f" Enter starting coordinate ({coordinate_range(board.size)}):")
+                        status, coord_str = await self.read_payload(player, SETUP_TIMEOUT)
+                        if status != "ok":
+                            await self.forfeit(opponent, " Opponent disconnected during setup")
+                            return False
+                        await self.send(writer, PACKET_TYPE_MESSAGE, " Enter orientation (H for horizontal, V for vertical):")
+                        status, orientation_str = await self.read_payload(player, SETUP_TIMEOUT)
+                        if status != "ok":
+                            await self.forfeit(opponent, " Opponent disconnected during setup")
+                            return False
+                        orientation_str = orientation_str.strip().upper()
+                        try:
+                            row, col = parse_coordinate(coord_str.strip())
+                        except Exception:
+                            await self.send(writer, PACKET_TYPE_MESSAGE, " Error: Invalid input. Please try again.")
+                            continue
+                        orientation = 0 if orientation_str == 'H' else 1 if orientation_str == 'V' else -1
+                        if orientation == -1:
+                            await self.send(writer, PACKET_TYPE_MESSAGE, " Invalid orientation. Please enter H or V.")
+                            continue
+                        if (0 <= row < board.size and 0 <= col < board.size
+                                and board.place_ship(ship_name, row, col, ship_size, orientation)):
+                            break
+                        await self.send(writer, PACKET_TYPE_MESSAGE, " Invalid position. Try again.")
+            else:
+                board.place_ships_randomly(rules['fleet'])
+                await self.send(writer, PACKET_TYPE_MESSAGE, " Ships placed randomly.")
+
+            player['board'] = board
+            return True
+        except ConnectionError:
+            await self.forfeit(opponent, " Opponent disconnected unexpectedly during setup")
+            return False
+
+    async def ask_play_again(self, player):
+        if 'bot' in player:
+            return True
+        try:
+            while True:
+                await self.send(player['writer'], PACKET_TYPE_MESSAGE, " Play again? (Y/N)")
+                status, payload = await self.read_payload(player, SETUP_TIMEOUT)
+                if status == "timeout":
+                    await self.send(player['writer'], PACKET_TYPE_MESSAGE, " Timeout. Assuming No.")
+                    return False
+                if status != "ok":
+                    return False
+                response = payload.strip().lower()
+                if response in ('y', 'n'):
+                    return response == 'y'
+                await self.send(player['writer'], PACKET_TYPE_MESSAGE, " Invalid response. Please enter Y or N.")
+        except ConnectionError as e:
+            print(f"[WARN] ask_play_again failed: {e}")
+            return False
+
+
+async def serve(host, port, max_games, shard=None, journal_path=None, metrics_port=None,
+                keepalive_interval=heartbeat.KEEPALIVE_INTERVAL, keepalive_misses=heartbeat.KEEPALIVE_MISSES,
+                tcp_keepalive=False, rules=DEFAULT_RULES, bot_wait=None):
+    keepalive = None
+    if keepalive_interval > 0:
+        keepalive = heartbeat.Keepalive(keepalive_interval, max(1, keepalive_misses))
+    game_server = AsyncGameServer(max_games, shard, keepalive, tcp_keepalive, rules, bot_wait)
+    if journal_path:
+        game_server.open_journal(journal_path)
+    if metrics_port:
+        # Read from the HTTP thread; len() of the loop's containers is safe under the GIL
+        metrics.ACTIVE_GAMES.set_function(lambda: len(game_server.games))
+        metrics.QUEUE_LENGTH.set_function(lambda: len(game_server.ready_queue))
+        metrics.SPECTATORS.set_function(game_server.spectator_count)
+        metrics.serve_http(metrics_port)
+    server = await asyncio.start_server(game_server.handle_client, host, port,
+                                        reuse_port=shard is not None)
+    if shard is not None:
+        loop = asyncio.get_running_loop()
+        shard.start_handoff_listener(
+            lambda conn, id_line: loop.call_soon_threadsafe(
+                lambda: game_server.spawn(game_server.adopt_forwarded_client(conn, id_line))))
+        print(f"[INFO] Worker {shard.index} async server listening on {host}:{port}")
+    else:
+        print(f"[INFO] Async server listening on {host}:{port} (max {max_games} concurrent games)")
+    game_server.spawn(game_server.matchmaker())
+    game_server.spawn(game_server.queue_notifier())
+    if bot_wait is not None:
+        game_server.spawn(game_server.bot_matchmaker())
+    if keepalive is not None:
+        game_server.spawn(game_server.keepalive_loop())
+    async with server:
+        await server.serve_forever()
+
+
+def main(host, port, max_games, shard=None, journal_path=None, metrics_port=None,
+         keepalive_interval=heartbeat.KEEPALIVE_INTERVAL, keepalive_misses=heartbeat.KEEPALIVE_MISSES,
+         tcp_keepalive=False, rules=DEFAULT_RULES, bot_wait=None):
+    try:
+        asyncio.run(serve(host, port, max_games, shard, journal_path, metrics_port,
+                          keepalive_interval, keepalive_misses, tcp_keepalive, rules, bot_wait))
+    except KeyboardInterrupt:
+        print("\n[INFO] Server shutting down.")
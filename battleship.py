@@ -3,14 +3,21 @@ battleship.py
 
 Contains core data structures and logic for Battleship, including:
  - Board class for storing ship positions, hits, misses
- - Utility function parse_coordinate for translating e.g. 'B5' -> (row, col)
+ - BitBoard, the same board kept in integer bitmasks for bots and simulations
+ - plan_fleet(), random fleet placement that backtracks and reports fleets that cannot fit
+ - Utility function parse_coordinate for translating e.g. 'B5' -> (row, col); rows past Z
+   are labelled like spreadsheet columns (AA, AB, ...) for boards up to MAX_BOARD_SIZE
+ - parse_fleet() for fleet specs such as "classic" or "Carrier:5,Destroyer:2", and
+   game_rules() for the board size and fleet a game is played with
  - A test harness run_single_player_game() to demonstrate the logic in a local, single-player mode
 
 """
 
 import random
+from functools import lru_cache
 
 BOARD_SIZE = 10
+MAX_BOARD_SIZE = 100
 SHIPS = [
     ("Test Ship 1", 1)
     #("Carrier", 5),
@@ -19,6 +26,25 @@ SHIPS = [
     #("Submarine", 3),
     #("Destroyer", 2)
 ]
+CLASSIC_SHIPS = [
+    ("Carrier", 5),
+    ("Battleship", 4),
+    ("Cruiser", 3),
+    ("Submarine", 3),
+    ("Destroyer", 2)
+]
+
+FLEETS = {"test": SHIPS, "classic": CLASSIC_SHIPS}
+
+# Board size and fleet of a game (see game_rules)
+DEFAULT_RULES = {'size': BOARD_SIZE, 'fleet': SHIPS}
+
+# Ships tried (placed and undone) before plan_fleet gives up on a fleet
+PLACEMENT_STEPS = 100_000
+
+
+class PlacementError(ValueError):
+    """The fleet cannot be placed on the board."""
 
 
 class Board:
@@ -33,6 +59,9 @@ class Board:
              'positions': set of (r, c),
           }
         used to determine when a specific ship has been fully sunk.
+      - self.changes: every (r, c) whose cell changed, in order, so renderers
+        can redo only what changed since they last looked (see self.views)
+      - self.views: renderings of this board kept by other modules
 
     In a full 2-player networked game:
       - Each player has their own Board instance.
@@ -47,28 +76,22 @@ class Board:
         # display_grid is what the player or an observer sees (no 'S')
         self.display_grid = [['.' for _ in range(size)] for _ in range(size)]
         self.placed_ships = []  # e.g. [{'name': 'Destroyer', 'positions': {(r, c), ...}}, ...]
+        self.changes = []
+        self.views = {}
 
-    def place_ships_randomly(self, ships=SHIPS):
+    def place_ships_randomly(self, ships=SHIPS, rng=random):
         """
         Randomly place each ship in 'ships' on the hidden_grid, storing positions for each ship.
+        The layout comes from plan_fleet(), around any ships already on the board;
+        raises PlacementError if the fleet does not fit.
         In a networked version, you might parse explicit placements from a player's commands
         (e.g. "PLACE A1 H BATTLESHIP") or prompt the user for board coordinates and placement orientations; 
         the self.place_ships_manually() can be used as a guide.
         """
-        for ship_name, ship_size in ships:
-            placed = False
-            while not placed:
-                orientation = random.randint(0, 1)  # 0 => horizontal, 1 => vertical
-                row = random.randint(0, self.size - 1)
-                col = random.randint(0, self.size - 1)
-
-                if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
-                    placed = True
+        # Ships already on the board (e.g. placed by hand) stay where they are
+        occupied = [cell for ship in self.placed_ships for cell in ship['positions']]
+        for ship_name, row, col, ship_size, orientation in plan_fleet(self.size, ships, occupied, rng):
+            self.place_ship(ship_name, row, col, ship_size, orientation)
 
 
     def place_ships_manually(self, ships=SHIPS):
@@ -100,12 +123,7 @@ class Board:
                     continue
 
                 # Check if we can place the ship
-                if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
-                    self.placed_ships.append({
-                        'name': ship_name,
-                        'positions': occupied_positions
-                    })
+                if self.place_ship(ship_name, row, col, ship_size, orientation):
                     break
                 else:
                     print(f"  [!] Cannot place {ship_name} at {coord_str} (orientation={orientation_str}). Try again.")
@@ -131,6 +149,25 @@ class Board:
                     return False
         return True
 
+    def place_ship(self, ship_name, row, col, ship_size, orientation):
+        """
+        Place a named ship if it fits (see can_place_ship). Returns True if it was placed.
+        """
+        if not self.can_place_ship(row, col, ship_size, orientation):
+            return False
+        self.add_ship(ship_name, self.do_place_ship(row, col, ship_size, orientation))
+        return True
+
+    def add_ship(self, ship_name, positions):
+        """
+        Record a ship on the given cells (e.g. read back from the journal) so fire_at can sink it.
+        """
+        positions = set(positions)
+        for r, c in positions:
+            self.hidden_grid[r][c] = 'S'
+        self.changes.extend(positions)
+        self.placed_ships.append({'name': ship_name, 'positions': positions})
+
     def do_place_ship(self, row, col, ship_size, orientation):
         """
         Place the ship on hidden_grid by marking 'S', and return the set of occupied positions.
@@ -144,6 +181,7 @@ class Board:
             for r in range(row, row + ship_size):
                 self.hidden_grid[r][col] = 'S'
                 occupied.add((r, col))
+        self.changes.extend(occupied)
         return occupied
 
     def fire_at(self, row, col):
@@ -162,6 +200,7 @@ class Board:
             # Mark a hit
             self.hidden_grid[row][col] = 'X'
             self.display_grid[row][col] = 'X'
+            self.changes.append((row, col))
             # Check if that hit sank a ship
             sunk_ship_name = self._mark_hit_and_check_sunk(row, col)
             if sunk_ship_name:
@@ -172,6 +211,7 @@ class Board:
             # Mark a miss
             self.hidden_grid[row][col] = 'o'
             self.display_grid[row][col] = 'o'
+            self.changes.append((row, col))
             return ('miss', None)
         elif cell == 'X' or cell == 'o':
             return ('already_shot', None)
@@ -221,30 +261,544 @@ class Board:
         grid_to_print = self.hidden_grid if show_hidden_board else self.display_grid
 
         # Column headers (1 .. N)
-        print("  " + "".join(str(i + 1).rjust(2) for i in range(self.size)))
-        # Each row labeled with A, B, C, ...
+        print(render_header(self.size))
+        # Each row labeled with A, B, C, ..., Z, AA, AB, ...
         for r in range(self.size):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(grid_to_print[r][c] for c in range(self.size))
-            print(f"{row_label:2} {row_str}")
+            print(render_row(self.size, r, grid_to_print[r]))
+
+
+class BitBoard(Board):
+    """
+    A Board kept in integer bitmasks (bit row * size + col per cell)
+    instead of grids of characters, for bots and simulations that fire
+    millions of shots:
+      - self.ships: cells with a ship; self.shot: cells fired at
+        (hits and misses are derived from the two)
+      - self.ship_at: cell index -> index of the ship on it (-1 for water)
+      - self.ship_names / self.ships_left: name and unhit cells per ship
+      - self.cells_left: unhit ship cells on the whole board
+    so a shot updates one mask and a counter, and fire_at, sunk detection,
+    all_ships_sunk and can_place_ship never scan ships or cells.
+
+    The public API is Board's. hidden_grid and display_grid are built
+    from the masks when read (and cached until the board changes), so
+    they are read-only; placed_ships lists each ship's unhit cells, like
+    Board's.
+    """
+
+    def __init__(self, size=BOARD_SIZE):
+        self.size = size
+        self.ships = 0
+        self.shot = 0
+        self.ship_at = [-1] * (size * size)
+        self.ship_names = []
+        self.ship_masks = []
+        self.ships_left = []
+        self.cells_left = 0
+        self.changes = []
+        self.views = {}
+        # One bit per row in the first column; shifted, it is a vertical ship's mask
+        self._column = sum(1 << (r * size) for r in range(size))
+        self._grids = (None, None, {})
+
+    @property
+    def hits(self):
+        return self.shot & self.ships
+
+    @property
+    def misses(self):
+        return self.shot & ~self.ships
+
+    def _line_mask(self, row, col, ship_size, orientation):
+        if orientation == 0:  # Horizontal
+            return ((1 << ship_size) - 1) << (row * self.size + col)
+        return (self._column & ((1 << (ship_size * self.size)) - 1)) << (row * self.size + col)
+
+    def can_place_ship(self, row, col, ship_size, orientation):
+        if (col if orientation == 0 else row) + ship_size > self.size:
+            return False
+        return not self.ships & self._line_mask(row, col, ship_size, orientation)
+
+    def do_place_ship(self, row, col, ship_size, orientation):
+        """
+        Mark the cells as ship and return them as a set. On its own this
+        leaves an unnamed ship that fire_at cannot sink; use place_ship.
+        """
+        self.ships |= self._line_mask(row, col, ship_size, orientation)
+        if orientation == 0:
+            occupied = {(row, c) for c in range(col, col + ship_size)}
+        else:
+            occupied = {(r, col) for r in range(row, row + ship_size)}
+        self.changes.extend(occupied)
+        return occupied
+
+    def add_ship(self, ship_name, positions):
+        index = len(self.ship_names)
+        mask = 0
+        positions = set(positions)
+        self.changes.extend(positions)
+        for r, c in positions:
+            cell = r * self.size + c
+            self.ship_at[cell] = index
+            mask |= 1 << cell
+        self.ships |= mask
+        self.ship_names.append(ship_name)
+        self.ship_masks.append(mask)
+        left = bin(mask & ~self.shot).count('1')
+        self.ships_left.append(left)
+        self.cells_left += left
+
+    def fire_at(self, row, col):
+        cell = row * self.size + col
+        bit = 1 << cell
+        shot = self.shot
+        if shot & bit:
+            return ('already_shot', None)
+        self.shot = shot | bit
+        self.changes.append((row, col))
+        if not self.ships & bit:
+            return ('miss', None)
+        index = self.ship_at[cell]
+        if index < 0:
+            return ('hit', None)  # placed with do_place_ship alone
+        self.cells_left -= 1
+        left = self.ships_left[index] = self.ships_left[index] - 1
+        return ('hit', None if left else self.ship_names[index])
+
+    def all_ships_sunk(self):
+        return self.cells_left == 0
+
+    @property
+    def placed_ships(self):
+        size = self.size
+        return [{'name': name,
+                 'positions': {divmod(cell, size) for cell in range(size * size)
+                               if (mask & ~self.shot) >> cell & 1}}
+                for name, mask in zip(self.ship_names, self.ship_masks)]
+
+    def _grid(self, hidden):
+        ships, shot, grids = self._grids
+        if ships != self.ships or shot != self.shot:
+            ships, shot, grids = self._grids = (self.ships, self.shot, {})
+        grid = grids.get(hidden)
+        if grid is None:
+            size = self.size
+            symbols = ('.', 'o', 'S' if hidden else '.', 'X')  # by (ship << 1) | shot
+            grid = grids[hidden] = [
+                [symbols[(ships >> cell & 1) << 1 | (shot >> cell & 1)] for cell in range(r * size, (r + 1) * size)]
+                for r in range(size)
+            ]
+        return grid
+
+    @property
+    def hidden_grid(self):
+        return self._grid(True)
+
+    @property
+    def display_grid(self):
+        return self._grid(False)
+
+
+@lru_cache(maxsize=64)
+def _placements(size, length):
+    """
+    Every placement of a ship of `length` on a size x size board:
+    (origins, cells, covering) with origins[cand] = (row, col, orientation),
+    cells[cand] = the cell indices (row * size + col) it covers, and
+    covering[cell] = the candidates over that cell.
+    """
+    origins, cells = [], []
+    covering = [[] for _ in range(size * size)]
+    for orientation in ((0, 1) if length > 1 else (0,)):
+        step = 1 if orientation == 0 else size
+        for row in range(size if orientation == 0 else size - length + 1):
+            for col in range(size - length + 1 if orientation == 0 else size):
+                start = row * size + col
+                covered = tuple(range(start, start + step * length, step))
+                for cell in covered:
+                    covering[cell].append(len(cells))
+                origins.append((row, col, orientation))
+                cells.append(covered)
+    return origins, cells, covering
+
+
+class _Coverage:
+    """
+    How many legal placements cover each cell, and how many cells none do.
+    by_count[n] holds the cells n placements cover, and no covered cell
+    has fewer than `low`, so the most constrained cell is found without
+    looking at every cell.
+    """
+
+    __slots__ = ("counts", "uncovered", "by_count", "low")
+
+    def __init__(self, cells):
+        self.counts = [0] * cells
+        self.uncovered = cells
+        self.by_count = [set(range(cells))]
+        self.low = 1
+
+    def most_constrained(self):
+        """A cell with the fewest placements over it (at least one), or None."""
+        by_count = self.by_count
+        while self.low < len(by_count) and not by_count[self.low]:
+            self.low += 1
+        if self.low == len(by_count):
+            return None
+        return next(iter(by_count[self.low]))
+
+
+class _CandidatePool:
+    """
+    The legal placements of one ship length: a list for uniform choice,
+    with each candidate's slot in it so removal is a swap with the last.
+    A candidate leaves the pool while blocked[cand] > 0 (counting placed
+    ships that overlap it, the search having ruled it out, and every ship
+    of this length being placed already), and while it is out it does not
+    count towards coverage of its cells.
+    """
+
+    def __init__(self, cells, coverage):
+        self.cells = cells
+        self.coverage = coverage
+        self.items = []
+        self.slot = [0] * len(cells)
+        self.blocked = [1] * len(cells)
+        for cand in range(len(cells)):
+            self.unblock(cand)
+
+    def block(self, cand):
+        self.blocked[cand] += 1
+        if self.blocked[cand] == 1:
+            slot, last = self.slot[cand], self.items[-1]
+            self.items[slot] = last
+            self.slot[last] = slot
+            self.items.pop()
+            coverage = self.coverage
+            counts, by_count = coverage.counts, coverage.by_count
+            for cell in self.cells[cand]:
+                n = counts[cell]
+                by_count[n].remove(cell)
+                n -= 1
+                counts[cell] = n
+                by_count[n].add(cell)
+                if n == 0:
+                    coverage.uncovered += 1
+                elif n < coverage.low:
+                    coverage.low = n
+
+    def unblock(self, cand):
+        self.blocked[cand] -= 1
+        if self.blocked[cand] == 0:
+            self.slot[cand] = len(self.items)
+            self.items.append(cand)
+            coverage = self.coverage
+            counts, by_count = coverage.counts, coverage.by_count
+            for cell in self.cells[cand]:
+                n = counts[cell]
+                by_count[n].remove(cell)
+                n += 1
+                counts[cell] = n
+                if n == len(by_count):
+                    by_count.append(set())
+                by_count[n].add(cell)
+                if n == 1:
+                    coverage.uncovered -= 1
+                    coverage.low = 1
+
+
+def _sample_fleet(size, ships, occupied, rng, attempts):
+    """
+    Rejection sampling, as place_ships_randomly used to do, but giving up
+    after `attempts` tries per ship. Each ship lands uniformly among its
+    legal placements, as with the pools. Returns the layout or None.
+    """
+    taken = set(occupied)
+    layout = []
+    for name, length in ships:
+        for _ in range(attempts):
+            orientation = rng.randint(0, 1)
+            row, col = rng.randint(0, size - 1), rng.randint(0, size - 1)
+            if (col if orientation == 0 else row) + length > size:
+                continue
+            step = 1 if orientation == 0 else size
+            covered = range(row * size + col, row * size + col + step * length, step)
+            if taken.isdisjoint(covered):
+                taken.update(covered)
+                layout.append((name, row, col, length, orientation))
+                break
+        else:
+            return None
+    return layout
+
+
+def plan_fleet(size, ships, occupied=(), rng=random, max_steps=PLACEMENT_STEPS):
+    """
+    Choose a random layout for `ships` ([(name, length), ...]) on a
+    size x size board whose `occupied` cells ((row, col)) are taken.
+    Returns [(name, row, col, length, orientation), ...] in fleet order.
+
+    Uncrowded boards are first tried with a few rounds of rejection
+    sampling. Otherwise every placement of each ship length is
+    enumerated (cached per board size) and indexed by the cells it
+    covers; placing a ship takes the candidates it overlaps out of their
+    pools, so the next ship is drawn uniformly from the placements still
+    legal. Longest ships go first. Once the free cells left over are
+    fewer than the ships still need, it switches to the free cell with
+    the fewest placements over it: cover it with one of them, or leave
+    it empty. When a ship has nowhere left to go the search backs up. It
+    backs up early when a length still needed has no placement left, or
+    when more free cells can no longer be covered than the fleet can
+    leave empty. A placement that failed is not retried for another ship
+    of the same length in that branch, because the two are
+    interchangeable.
+
+    Raises PlacementError if the fleet cannot fit, or if no layout
+    turned up within max_steps placements.
+    """
+    if any(length < 1 for _, length in ships):
+        raise PlacementError("ships must be at least one cell long")
+    occupied = {r * size + c for r, c in occupied}
+    needed = sum(length for _, length in ships)
+    free = size * size - len(occupied)
+    if needed > free:
+        raise PlacementError(f"the fleet needs {needed} cells; the {size}x{size} board has {free} free")
+    if needed * 2 <= free:
+        layout = _sample_fleet(size, ships, occupied, rng, attempts=10 * size)
+        if layout is not None:
+            return layout
+
+    coverage = _Coverage(size * size)
+    left = {}  # ships of each length still to place, longest first
+    for length in sorted((length for _, length in ships), reverse=True):
+        left[length] = left.get(length, 0) + 1
+    pools, covering = {}, {}
+    for length in left:
+        _, cells, covering[length] = _placements(size, length)
+        pools[length] = _CandidatePool(cells, coverage)
+    chosen = {length: [] for length in left}
+
+    def block_cells(covered, undo=False):
+        for length, pool in pools.items():
+            change = pool.unblock if undo else pool.block
+            for cell in covered:
+                for cand in covering[length][cell]:
+                    change(cand)
+
+    def place(length, cand, undo=False):
+        pool = pools[length]
+        if undo:
+            if not left[length]:
+                for other in range(len(pool.cells)):
+                    pool.unblock(other)
+            left[length] += 1
+            block_cells(pool.cells[cand], undo=True)
+            return
+        block_cells(pool.cells[cand])
+        left[length] -= 1
+        if not left[length]:
+            # No more ships of this length: its placements no longer cover anything
+            for other in range(len(pool.cells)):
+                pool.block(other)
+
+    def branch(free, needed):
+        """
+        The search step for a board with `needed` ship cells still to
+        place and `free` free cells: True when done, False for a dead end,
+        otherwise [free, needed, choices, placed, ruled_out, may_leave_empty].
+        choices is None to draw the longest length from its pool, or the
+        (length, candidate) pairs over the cell to cover.
+        """
+        if not needed:
+            return True
+        # Cells no placement covers any more; placed and occupied cells are among them
+        stranded = coverage.uncovered - (size * size - free)
+        spare = free - needed - stranded
+        if spare < 0 or not all(pools[n].items for n in left if left[n]):
+            return False
+        if spare >= needed:
+            return [free, needed, None, None, [], False]
+        cell = coverage.most_constrained()
+        choices = [(n, cand) for n in left for cand in covering[n][cell] if not pools[n].blocked[cand]]
+        rng.shuffle(choices)
+        return [free, needed, choices, None, [], True]
+
+    def search(free, needed):
+        """Depth-first over branch() steps, with an explicit stack (fleets can be long)."""
+        steps = 0
+        stack = []
+        result = branch(free, needed)
+        if result is not True and result is not False:
+            stack.append(result)
+            result = None
+        while stack:
+            frame = stack[-1]
+            free, needed, choices, placed, ruled_out, may_leave_empty = frame
+            if result is not None:
+                if placed is not None:
+                    frame[3] = None
+                    if result:
+                        chosen[placed[0]].append(placed[1])
+                    else:
+                        place(*placed, undo=True)
+                        pools[placed[0]].block(placed[1])
+                        ruled_out.append(placed)
+                if result or placed is None:
+                    # Solved, or the leave-it-empty branch was the last one
+                    stack.pop()
+                    for length, cand in ruled_out:
+                        pools[length].unblock(cand)
+                    continue
+                result = None
+            if choices is None:
+                length = next(n for n in left if left[n])
+                pool = pools[length]
+                following = (length, pool.items[rng.randrange(len(pool.items))]) if pool.items else None
+            else:
+                following = choices.pop() if choices else None
+            if following is not None:
+                steps += 1
+                if steps > max_steps:
+                    raise PlacementError(f"no layout found for the fleet on a {size}x{size} board "
+                                         f"after {max_steps} placements")
+                frame[3] = following
+                place(*following)
+                result = branch(free - following[0], needed - following[0])
+            elif may_leave_empty:
+                # Every placement over the cell is ruled out now: it stays empty
+                frame[5] = False
+                result = branch(free, needed)
+            else:
+                stack.pop()
+                for length, cand in ruled_out:
+                    pools[length].unblock(cand)
+                result = False
+                continue
+            if result is not True and result is not False:
+                stack.append(result)
+                result = None
+        return result
+
+    block_cells(occupied)
+    if not search(free, needed):
+        raise PlacementError(f"the fleet cannot be placed on a {size}x{size} board")
+    layout = []
+    for name, length in ships:
+        origins = _placements(size, length)[0]
+        row, col, orientation = origins[chosen[length].pop()]
+        layout.append((name, row, col, length, orientation))
+    return layout
+
+
+def row_label(row):
+    """
+    Letters for a zero-based row, spreadsheet style: 0 => 'A', 25 => 'Z',
+    26 => 'AA', 27 => 'AB', ...
+    """
+    label = ""
+    row += 1
+    while row:
+        row, letter = divmod(row - 1, 26)
+        label = chr(ord('A') + letter) + label
+    return label
+
+
+def render_header(size):
+    """
+    Column numbers for a text board. Columns are two characters wide, or
+    wide enough for the largest number past 10 columns, so that each
+    number sits above its column in render_row().
+    """
+    width = 2 if size <= 10 else len(str(size)) + 1
+    return " " * max(2, len(row_label(size - 1))) + "".join(str(c + 1).rjust(width) for c in range(size))
+
+
+def render_row(size, row, cells):
+    """One labelled text row of a board, e.g. "B  . X o . ."."""
+    width = 2 if size <= 10 else len(str(size)) + 1
+    row_str = " ".join(cell.rjust(width - 1) for cell in cells)
+    return f"{row_label(row):{max(2, len(row_label(size - 1)))}} {row_str}"
+
+
+def render_board_rows(grid, size):
+    """
+    Build the text rows for a board grid: a column header followed by one
+    labelled line per row. Shared by the servers and the clients.
+    """
+    return [render_header(size)] + [render_row(size, r, grid[r]) for r in range(size)]
+
+
+def format_coordinate(row, col):
+    """The inverse of parse_coordinate: (2, 9) => 'C10', (26, 0) => 'AA1'."""
+    return f"{row_label(row)}{col + 1}"
 
 
 def parse_coordinate(coord_str):
     """
     Convert something like 'B5' into zero-based (row, col).
-    Example: 'A1' => (0, 0), 'C10' => (2, 9)
-    HINT: you might want to add additional input validation here...
+    Example: 'A1' => (0, 0), 'C10' => (2, 9), 'AB3' => (27, 2)
+    Raises ValueError for anything that is not letters followed by a
+    number; the caller checks the result against its board's size.
     """
     coord_str = coord_str.strip().upper()
-    row_letter = coord_str[0]
-    col_digits = coord_str[1:]
-
-    row = ord(row_letter) - ord('A')
+    letters = len(coord_str) - len(coord_str.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    row_letters, col_digits = coord_str[:letters], coord_str[letters:]
+    if not row_letters or not col_digits.isdigit():
+        raise ValueError(f"expected a row letter and a column number, got {coord_str!r}")
+
+    row = 0
+    for letter in row_letters:
+        row = row * 26 + ord(letter) - ord('A') + 1
+    row -= 1
     col = int(col_digits) - 1  # zero-based
 
     return (row, col)
 
 
+def game_rules(size=BOARD_SIZE, fleet=SHIPS):
+    """
+    The rules a game is played with: {'size': <board size>, 'fleet': [(name, length), ...]}.
+    Raises ValueError (PlacementError for a fleet) if the size is outside
+    1..MAX_BOARD_SIZE or the fleet cannot be placed on the board.
+    """
+    if not 1 <= size <= MAX_BOARD_SIZE:
+        raise ValueError(f"board size must be between 1 and {MAX_BOARD_SIZE}, got {size}")
+    if not fleet:
+        raise ValueError("the fleet needs at least one ship")
+    plan_fleet(size, fleet)
+    return {'size': size, 'fleet': list(fleet)}
+
+
+def parse_fleet(spec):
+    """
+    A fleet from a name in FLEETS ("test", "classic") or a list such as
+    "Carrier:5,Destroyer:2" (a ":<n>" repeat count may follow: "Destroyer:2:4"
+    is four destroyers). Raises ValueError for a malformed spec.
+    """
+    if spec in FLEETS:
+        return list(FLEETS[spec])
+    fleet = []
+    for item in spec.split(","):
+        parts = item.strip().split(":")
+        if len(parts) not in (2, 3) or not parts[0]:
+            raise ValueError(f"fleet entries look like Name:length[:count], got {item.strip()!r}")
+        name, length, count = parts[0], int(parts[1]), int(parts[2]) if len(parts) == 3 else 1
+        if length < 1 or count < 1:
+            raise ValueError(f"ship length and count must be positive in {item.strip()!r}")
+        fleet += [(name if count == 1 else f"{name} {n + 1}", length) for n in range(count)]
+    return fleet
+
+
+def scaled_fleet(size, fleet=CLASSIC_SHIPS):
+    """
+    fleet repeated so a size x size board keeps a 10x10 board's share of
+    ship cells (what the benchmarks play larger boards with). Copies are
+    numbered like parse_fleet's: "Carrier 1", "Carrier 2", ...
+    """
+    copies = max(1, size * size // 100)
+    return [(f"{name} {n + 1}" if copies > 1 else name, length) for n in range(copies) for name, length in fleet]
+
+
 def run_single_player_game_locally():
     """
     A test harness for local single-player mode, demonstrating two approaches:
@@ -314,9 +868,8 @@ def run_single_player_game_online(rfile, wfile):
         wfile.write("GRID\n")
         wfile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)) + '\n')
         for r in range(board.size):
-            row_label = chr(ord('A') + r)
             row_str = " ".join(board.display_grid[r][c] for c in range(board.size))
-            wfile.write(f"{row_label:2} {row_str}\n")
+            wfile.write(f"{row_label(r):2} {row_str}\n")
         wfile.write('\n')
         wfile.flush()
 
@@ -0,0 +1,83 @@
+"""
+bench_board.py
+
+Compares Board (grids of characters) with BitBoard (integer bitmasks) on
+what bots and simulations do most: placing a fleet at random and firing
+at every cell in random order until all ships are sunk.
+
+Larger boards get proportionally more ships (battleship.scaled_fleet()).
+Both boards get the same placements and shots, and every fire_at result
+is compared, so the run also checks that BitBoard behaves like Board.
+Prints shots/sec per board and board size.
+
+Usage:
+    python bench_board.py [--games 2000] [--sizes 10,20]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import Board, BitBoard, scaled_fleet
+
+
+def layouts(games, size, seed):
+    """(placements, shots) per game; placements are (name, row, col, length, orientation)."""
+    rng = random.Random(seed)
+    ships = scaled_fleet(size)
+    result = []
+    for _ in range(games):
+        board = Board(size)
+        placements = []
+        for name, length in ships:
+            while True:
+                orientation = rng.randint(0, 1)
+                row, col = rng.randrange(size), rng.randrange(size)
+                if board.place_ship(name, row, col, length, orientation):
+                    placements.append((name, row, col, length, orientation))
+                    break
+        shots = [(r, c) for r in range(size) for c in range(size)]
+        rng.shuffle(shots)
+        result.append((placements, shots))
+    return result
+
+
+def play(cls, games, size):
+    """Play every game on a fresh cls board; returns (shots, seconds, outcomes)."""
+    shots_fired = 0
+    outcomes = []
+    start = time.perf_counter()
+    for placements, shots in games:
+        board = cls(size)
+        for placement in placements:
+            board.place_ship(*placement)
+        for row, col in shots:
+            outcomes.append(board.fire_at(row, col))
+            shots_fired += 1
+            if board.all_ships_sunk():
+                break
+    return shots_fired, time.perf_counter() - start, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Board against BitBoard")
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--sizes", default="10,20", help="comma-separated board sizes")
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        games = layouts(args.games, size, seed=size)
+        rates = {}
+        results = {}
+        for cls in (Board, BitBoard):
+            shots, seconds, results[cls] = play(cls, games, size)
+            rates[cls] = shots / seconds
+        if results[Board] != results[BitBoard]:
+            raise SystemExit(f"[ERROR] BitBoard and Board disagree on a {size}x{size} board")
+        print(f"{size}x{size}, {len(scaled_fleet(size))} ships, {args.games} games, {shots} shots:")
+        print(f"  Board:    {rates[Board]:12.0f} shots/s")
+        print(f"  BitBoard: {rates[BitBoard]:12.0f} shots/s  ({rates[BitBoard] / rates[Board]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
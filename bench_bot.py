@@ -0,0 +1,70 @@
+"""
+bench_bot.py
+
+Plays DensityBot (bot.py) against randomly placed fleets, the way the
+server runs it: command() for the move, Board.fire_at on the target
+board, observe() with the result. Reports the time per move (command()
+plus observe(), p50/p99/max in microseconds) and the shots a bot needs to
+sink the fleet, per board size. A bot that fires at a cell twice fails
+the run.
+
+For comparison, random firing needs about 95 shots on the classic 10x10
+fleet and hunt/target about 62 (python simulate.py --strategy ...).
+
+Usage:
+    python bench_bot.py [--games 500] [--sizes 10,26,50]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import Board, parse_coordinate, scaled_fleet
+from bot import DensityBot
+
+
+def play(bot, size, ships, rng, move_times):
+    """One game; returns the shots the bot needed."""
+    rules = {'size': size, 'fleet': ships}
+    bot.new_round(rules)
+    target = Board(size)
+    target.place_ships_randomly(ships, rng)
+    shots = 0
+    while not target.all_ships_sunk():
+        start = time.perf_counter()
+        row, col = parse_coordinate(bot.command().split()[1])
+        result, sunk = target.fire_at(row, col)
+        bot.observe(row, col, result, sunk)
+        move_times.append(time.perf_counter() - start)
+        if result == 'already_shot':
+            raise SystemExit(f"[ERROR] The bot fired at {row},{col} twice")
+        shots += 1
+    return shots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the density-map bot")
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--sizes", default="10,26,50", help="comma-separated board sizes")
+    args = parser.parse_args()
+
+    print(f"{'board':<8} {'ships':>5} {'games':>6} {'shots mean':>10} {'max':>5} "
+          f"{'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        rng = random.Random(size)
+        bot = DensityBot(rng)
+        ships = scaled_fleet(size)
+        # Bigger boards take far more moves per game
+        games = max(1, args.games * 100 // (size * size))
+        move_times, shots = [], []
+        for _ in range(games):
+            shots.append(play(bot, size, ships, rng, move_times))
+        move_times.sort()
+        p50 = move_times[len(move_times) // 2] * 1e6
+        p99 = move_times[min(len(move_times) - 1, int(len(move_times) * 0.99))] * 1e6
+        print(f"{size}x{size:<5} {len(ships):>5} {games:>6} {sum(shots) / games:>10.1f} {max(shots):>5} "
+              f"{p50:>8.1f} {p99:>8.1f} {move_times[-1] * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
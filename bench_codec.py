@@ -0,0 +1,146 @@
+"""
+bench_codec.py
+
+Compares the per-frame cost of the two wire formats:
+  - v1: "<type>|<crc hex>|<payload>\\n" text lines
+  - v2: struct header + binary payload
+
+The sample traffic is one turn's worth of what the server sends: a result,
+the board header and rows, and a prompt. Both directions run over an
+in-memory stream so only the codec is measured.
+
+Decoding is timed for the text-file reader (makefile('r') + decode_packet,
+one line at a time) and for the streaming PacketReader in both versions
+(a batch of frames per read_packets()). "scratch B/frame" is
+the average peak of temporary memory while a frame is decoded (tracemalloc),
+a proxy for the per-frame allocations each reader makes.
+
+Usage:
+    python bench_codec.py [--frames 200000]
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+from battleship import Board, SHIPS
+from game_logic import render_board_rows
+from utils import (
+    encode_for,
+    recv_packet,
+    PacketReader,
+    PACKET_TYPE_MESSAGE,
+    PACKET_TYPE_RESULT,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+)
+
+
+class _BytesSocket:
+    """Just enough of a socket for PacketReader: recv_into() from a bytes buffer."""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def recv_into(self, buffer):
+        return self.stream.readinto(buffer)
+
+
+def sample_turn():
+    board = Board()
+    board.place_ships_randomly(SHIPS)
+    board.fire_at(0, 0)
+    packets = [(PACKET_TYPE_RESULT, " You missed."),
+               (PACKET_TYPE_MESSAGE, " Opponent's board:"),
+               (PACKET_TYPE_MESSAGE, "GRID_OPPONENT")]
+    packets += [(PACKET_TYPE_MESSAGE, row) for row in render_board_rows(board.display_grid, board.size)]
+    packets += [(PACKET_TYPE_MESSAGE, " End of board"),
+                (PACKET_TYPE_MESSAGE, " Your turn! Enter command (e.g. FIRE B5):")]
+    return packets
+
+
+def text_reader(data):
+    return io.TextIOWrapper(io.BytesIO(data))
+
+
+def stream_reader(proto):
+    return lambda data: PacketReader(_BytesSocket(data), proto)
+
+
+def encode(packets, rounds, proto):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        wire = b"".join(encode_for(proto, t, p) for t, p in packets)
+    return time.perf_counter() - start, wire
+
+
+def decode(wire, rounds, make_reader, repeat=5):
+    """Best of `repeat` timings: this runs on shared machines."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            reader = make_reader(wire)
+            if isinstance(reader, PacketReader):
+                while reader.read_packets() is not None:
+                    pass
+            else:
+                while recv_packet(reader) is not None:
+                    pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scratch_per_frame(wire, make_reader, frames):
+    """Average tracemalloc peak above the baseline while each frame is decoded."""
+    reader = make_reader(wire)
+    total = 0
+    tracemalloc.start()
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        packet = recv_packet(reader)
+        total += tracemalloc.get_traced_memory()[1] - base
+        del packet
+    tracemalloc.stop()
+    return total / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the v1 and v2 packet codecs")
+    parser.add_argument("--frames", type=int, default=200000, help="approximate frames per codec")
+    args = parser.parse_args()
+
+    packets = sample_turn()
+    rounds = max(1, args.frames // len(packets))
+    frames = rounds * len(packets)
+    encoders = {PROTOCOL_V1: encode(packets, rounds, PROTOCOL_V1), PROTOCOL_V2: encode(packets, rounds, PROTOCOL_V2)}
+    readers = [
+        ("v1 text", PROTOCOL_V1, text_reader),
+        ("v1 stream", PROTOCOL_V1, stream_reader(PROTOCOL_V1)),
+        ("v2 stream", PROTOCOL_V2, stream_reader(PROTOCOL_V2)),
+    ]
+    results = {}
+    for name, proto, make_reader in readers:
+        encode_time, wire = encoders[proto]
+        # Enough turns back to back that the readers work through several buffers
+        batch = wire * 64
+        results[name] = (encode_time, decode(batch, max(1, rounds // 64), make_reader),
+                         len(wire), scratch_per_frame(batch, make_reader, len(packets) * 64))
+
+    decoded = max(1, rounds // 64) * 64 * len(packets)
+    print(f"{frames} frames ({len(packets)} per turn)")
+    print(f"{'':10} {'encode us/frame':>16} {'decode us/frame':>16} {'bytes/frame':>12} {'scratch B/frame':>16}")
+    for name, (encode_time, decode_time, size, scratch) in results.items():
+        print(f"{name:10} {encode_time / frames * 1e6:16.3f} {decode_time / decoded * 1e6:16.3f} "
+              f"{size / len(packets):12.1f} {scratch:16.0f}")
+    old, new = results["v1 text"], results["v1 stream"]
+    print(f"v1 stream vs text: decode time {new[1] / old[1] - 1:+.0%}, scratch {new[3] / old[3] - 1:+.0%}")
+    v1, v2 = results["v1 text"], results["v2 stream"]
+    print(f"v2 vs v1: encode time {v2[0] / v1[0] - 1:+.0%}, decode time {v2[1] / v1[1] - 1:+.0%}, "
+          f"bytes {v2[2] / v1[2] - 1:+.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+bench_integrity.py
+
+Compares the three protocol v2 integrity modes:
+  - none:  no payload checksum is computed or checked
+  - crc32: corrupted frames are detected and dropped (the default)
+  - arq:   crc32 plus sequence numbers; corrupted frames are NAKed and resent
+
+First the CPU cost per frame of encoding (PacketWriter) and decoding
+(PacketReader) one turn's worth of server traffic, over in-memory streams.
+Then every mode sends the same messages over a socketpair whose sending
+side corrupts one byte of a frame with probability --loss (resends
+included), and the receiver reports how many arrived intact, how many were
+handed over garbled, and how many were lost (dropped as corrupted). The
+sender stays within half the resend window of the receiver, as a game's
+turns do. Like the server, the receiver repeats a NAK whose resend is
+overdue while it waits.
+
+Usage:
+    python bench_integrity.py [--frames 100000] [--messages 5000] [--loss 0.01]
+"""
+
+import argparse
+import io
+import random
+import socket
+import threading
+import time
+
+from bench_codec import sample_turn, _BytesSocket
+from utils import (
+    PacketReader,
+    PacketWriter,
+    V2_HEADER,
+    V2_SEQ,
+    FLAG_SEQ,
+    INTEGRITY_MODES,
+    RETRANSMIT_WINDOW,
+    NAK_RETRY,
+    PACKET_TYPE_MESSAGE,
+    PROTOCOL_V2,
+)
+
+
+class _SinkSocket:
+    """Collects whatever a PacketWriter sends."""
+
+    def __init__(self):
+        self.stream = io.BytesIO()
+
+    def sendall(self, data):
+        self.stream.write(data)
+
+
+class _CorruptingSocket:
+    """Passes frames on to sock, flipping one byte in a frame with probability loss."""
+
+    def __init__(self, sock, loss, seed):
+        self.sock = sock
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.corrupted = 0
+
+    def sendall(self, data):
+        data = bytearray(data)
+        pos = 0
+        while pos < len(data):
+            _, flags, length, _, _ = V2_HEADER.unpack_from(data, pos)
+            size = V2_HEADER.size + (V2_SEQ.size if flags & FLAG_SEQ else 0) + length
+            if self.random.random() < self.loss:
+                # Anywhere in the frame, the length included
+                data[pos + self.random.randrange(size)] ^= 0xFF
+                self.corrupted += 1
+            pos += size
+        self.sock.sendall(data)
+
+
+def cpu_per_frame(packets, rounds, integrity):
+    sink = _SinkSocket()
+    writer = PacketWriter(sink, PROTOCOL_V2, integrity)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for pkt_type, payload in packets:
+            writer.send_packet(pkt_type, payload)
+    encode_time = time.perf_counter() - start
+
+    wire = sink.stream.getvalue()
+    start = time.perf_counter()
+    reader = PacketReader(_BytesSocket(wire), PROTOCOL_V2)
+    while reader.read_packets() is not None:
+        pass
+    decode_time = time.perf_counter() - start
+    frames = rounds * len(packets)
+    return encode_time / frames, decode_time / frames, len(wire) / frames
+
+
+def lossy_link(integrity, messages, loss, seed=1):
+    sender_sock, receiver_sock = socket.socketpair()
+    link = _CorruptingSocket(sender_sock, loss, seed)
+    sender = PacketWriter(link, PROTOCOL_V2, integrity)
+    receiver_sock.settimeout(NAK_RETRY)
+    receiver = PacketReader(receiver_sock, PROTOCOL_V2, writer=PacketWriter(receiver_sock, PROTOCOL_V2, integrity))
+    in_flight = threading.Semaphore(RETRANSMIT_WINDOW // 2)
+
+    def answer_naks():
+        # NAKs come back on the sender's socket; reading them triggers the resends
+        naks = PacketReader(sender_sock, PROTOCOL_V2, writer=sender)
+        try:
+            while naks.read_packet() is not None:
+                pass
+        except OSError:
+            pass
+
+    def send():
+        for i in range(messages):
+            in_flight.acquire()
+            sender.send_packet(PACKET_TYPE_MESSAGE, f"message {i}")
+
+    threads = [threading.Thread(target=answer_naks, daemon=True), threading.Thread(target=send, daemon=True)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    intact = garbled = lost = 0
+    while intact + garbled + lost < messages:
+        try:
+            pkt_type, payload = receiver.read_packet()
+        except socket.timeout:
+            receiver.nak_overdue()
+            continue
+        if pkt_type is None:
+            lost += 1
+        elif payload == f"message {intact + garbled + lost}":
+            intact += 1
+        else:
+            garbled += 1
+        in_flight.release()
+    elapsed = time.perf_counter() - start
+    threads[1].join()
+    receiver_sock.close()
+    sender_sock.close()
+    return {'intact': intact, 'garbled': garbled, 'lost': lost, 'corrupted': link.corrupted,
+            'resent': sender.resends, 'naks': receiver.sequence.naks, 'seconds': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the protocol v2 integrity modes")
+    parser.add_argument("--frames", type=int, default=100000, help="approximate frames for the CPU test")
+    parser.add_argument("--messages", type=int, default=5000, help="messages sent over the lossy link")
+    parser.add_argument("--loss", type=float, default=0.01, help="probability that a frame is corrupted")
+    args = parser.parse_args()
+
+    packets = sample_turn()
+    rounds = max(1, args.frames // len(packets))
+    print(f"CPU per frame ({rounds * len(packets)} frames)")
+    print(f"{'':6} {'encode us':>10} {'decode us':>10} {'bytes':>7}")
+    for mode in INTEGRITY_MODES:
+        encode_time, decode_time, size = cpu_per_frame(packets, rounds, mode)
+        print(f"{mode:6} {encode_time * 1e6:10.3f} {decode_time * 1e6:10.3f} {size:7.1f}")
+
+    print(f"\n{args.messages} messages, {args.loss:.1%} of frames corrupted")
+    print(f"{'':6} {'intact':>7} {'garbled':>8} {'lost':>6} {'corrupted':>10} {'resent':>7} {'NAKs':>5} {'ms':>8}")
+    for mode in INTEGRITY_MODES:
+        r = lossy_link(mode, args.messages, args.loss)
+        print(f"{mode:6} {r['intact']:7} {r['garbled']:8} {r['lost']:6} {r['corrupted']:10} "
+              f"{r['resent']:7} {r['naks']:5} {r['seconds'] * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
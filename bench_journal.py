@@ -0,0 +1,120 @@
+"""
+bench_journal.py
+
+Measures what the game journal costs in move throughput.
+
+Several game threads play moves as fast as they can (fire_at plus the
+packets the server sends for a move, over a local socket pair), once
+without a journal and once with journal.GameJournal writing to a real file.
+Prints moves/sec for both, the overhead, and how many fsyncs the group
+commit needed.
+
+Usage:
+    python bench_journal.py [--games 8] [--seconds 2] [--rounds 3] [--dir /tmp]
+"""
+
+import argparse
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+from battleship import Board, SHIPS
+from game_logic import render_board_rows
+from journal import GameJournal
+from utils import send_packet_message, PACKET_TYPE_MESSAGE, PACKET_TYPE_RESULT
+
+
+def discard(sock):
+    while sock.recv(65536):
+        pass
+
+
+def play(journal, game_no, stop, counts):
+    """Play back-to-back games until stop is set, counting moves."""
+    moves = 0
+    ours, theirs = socket.socketpair()
+    threading.Thread(target=discard, args=(theirs,), daemon=True).start()
+    sink = ours.makefile('w')
+    rng = random.Random(game_no)
+    while not stop.is_set():
+        p1 = {'player_id': f"bench{game_no}a", 'board': Board()}
+        p2 = {'player_id': f"bench{game_no}b", 'board': Board()}
+        for p in (p1, p2):
+            p['board'].place_ships_randomly(SHIPS)
+        game_id = f"{game_no}-{moves}"
+        if journal:
+            journal.game_started(game_id, p1, p2)
+        cells = [[(r, c) for r in range(10) for c in range(10)] for _ in range(2)]
+        for shots in cells:
+            rng.shuffle(shots)
+        turn = 0
+        while not stop.is_set():
+            board = (p2, p1)[turn]['board']
+            row, col = cells[turn].pop()
+            result, sunk = board.fire_at(row, col)
+            if journal:
+                journal.fired(game_id, turn, row, col, result, sunk)
+            # What the server sends for one move
+            send_packet_message(sink, PACKET_TYPE_RESULT, " You hit!" if result == 'hit' else " You missed.")
+            for line in render_board_rows(board.display_grid, board.size):
+                send_packet_message(sink, PACKET_TYPE_MESSAGE, line)
+            moves += 1
+            if board.all_ships_sunk():
+                break
+            turn = 1 - turn
+        if journal:
+            journal.game_ended(game_id)
+    counts[game_no] = moves
+    ours.close()
+
+
+def run(games, seconds, journal=None):
+    stop = threading.Event()
+    counts = {}
+    threads = [threading.Thread(target=play, args=(journal, i, stop, counts)) for i in range(games)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counts.values()) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game journal")
+    parser.add_argument("--games", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="alternating runs with and without the journal; medians are reported")
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="directory for the journal file")
+    args = parser.parse_args()
+
+    path = os.path.join(args.dir, f"bench-journal-{os.getpid()}.log")
+    journal = GameJournal(path)
+    baseline, journaled = [], []
+    try:
+        for _ in range(args.rounds):
+            baseline.append(run(args.games, args.seconds))
+            journaled.append(run(args.games, args.seconds, journal))
+            journal.flush()
+    finally:
+        os.remove(path)
+
+    baseline = statistics.median(baseline)
+    journaled = statistics.median(journaled)
+    overhead = (baseline - journaled) / baseline * 100
+    print(f"games: {args.games}, {args.rounds} x {args.seconds:.1f}s per mode")
+    print(f"no journal:   {baseline:10.0f} moves/s")
+    print(f"with journal: {journaled:10.0f} moves/s  ({overhead:+.1f}% overhead)")
+    print(f"records: {journal.records}, fsyncs: {journal.commits} "
+          f"({journal.records / max(1, journal.commits):.0f} records per fsync)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+bench_placement.py
+
+Times random fleet setup: the old rejection sampling (random row, col and
+orientation until can_place_ship says yes) against plan_fleet(), which
+draws from the placements still legal and backtracks.
+
+Cases run from the classic fleet on 10x10 to crowded and large boards.
+Rejection sampling has no way to back out of a dead end, so it gets
+--give-up attempts per board before it counts as stuck. An unplaceable
+fleet shows how long plan_fleet takes to report it.
+
+Prints p50/p99/max setup time in milliseconds per case.
+
+Usage:
+    python bench_placement.py [--boards 200] [--give-up 100000]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import Board, CLASSIC_SHIPS, PlacementError, plan_fleet
+
+CASES = [
+    ("classic 10x10", 10, CLASSIC_SHIPS),
+    ("2x classic 10x10", 10, CLASSIC_SHIPS * 2),
+    ("4x classic 10x10", 10, CLASSIC_SHIPS * 4),
+    ("24 x 4 on 10x10", 10, [("Battleship", 4)] * 24),
+    ("50 x 2 on 10x10 (full)", 10, [("Destroyer", 2)] * 50),
+    ("classic 26x26", 26, CLASSIC_SHIPS),
+    ("40x classic 40x40", 40, CLASSIC_SHIPS * 40),
+    ("25 x 4 on 10x10 (impossible)", 10, [("Battleship", 4)] * 25),
+]
+
+
+def rejection(size, ships, rng, give_up):
+    """The old place_ships_randomly; returns False if it was still trying after give_up attempts."""
+    board = Board(size)
+    attempts = 0
+    for name, length in ships:
+        while True:
+            attempts += 1
+            if attempts > give_up:
+                return False
+            orientation = rng.randint(0, 1)
+            row, col = rng.randint(0, size - 1), rng.randint(0, size - 1)
+            if board.place_ship(name, row, col, length, orientation):
+                break
+    return True
+
+
+def engine(size, ships, rng, give_up):
+    try:
+        plan_fleet(size, ships, rng=rng)
+        return True
+    except PlacementError:
+        return False
+
+
+def percentiles(times):
+    times = sorted(times)
+    return (times[len(times) // 2] * 1e3, times[min(len(times) - 1, int(len(times) * 0.99))] * 1e3,
+            times[-1] * 1e3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark random fleet placement")
+    parser.add_argument("--boards", type=int, default=200)
+    parser.add_argument("--give-up", type=int, default=100_000,
+                        help="rejection-sampling attempts per board before it counts as stuck")
+    args = parser.parse_args()
+
+    print(f"{'case':<30} {'method':<10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  failed")
+    for label, size, ships in CASES:
+        for method, place in (("rejection", rejection), ("engine", engine)):
+            rng = random.Random(size)
+            times, failed = [], 0
+            # Rejection sampling on a dead end costs the whole give-up budget; a few boards show that
+            boards = args.boards if method == "engine" else max(1, args.boards // 20)
+            for _ in range(boards):
+                start = time.perf_counter()
+                if not place(size, ships, rng, args.give_up):
+                    failed += 1
+                times.append(time.perf_counter() - start)
+            p50, p99, worst = percentiles(times)
+            print(f"{label:<30} {method:<10} {p50:9.2f} {p99:9.2f} {worst:9.2f}  {failed}/{boards}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+bench_render.py
+
+Measures the server's per-turn board work as boards grow: fire_at plus
+what send_move_result builds for one shot, i.e. the v2 snapshot frame for
+spectators and, for a v1 shooter, the text rows of the opponent's board.
+
+Two ways of building them are compared:
+  - full:   encode_board() / render_board_rows() over the whole grid
+  - cached: board_payload() / board_rows(), which redo only the cells and
+            rows changed since the previous turn (board.changes)
+Prints microseconds per turn for each board size; the cached v2 column
+should stay roughly flat while the full one grows with size x size.
+
+Usage:
+    python bench_render.py [--sizes 10,26,50,100] [--turns 2000]
+"""
+
+import argparse
+import random
+import time
+
+from battleship import Board, scaled_fleet
+from game_logic import board_payload, board_rows, render_board_rows
+from utils import encode_board
+
+
+def per_turn(size, turns, snapshot, text):
+    """Microseconds per turn for `turns` shots at a fresh board, building what the flags ask for."""
+    rng = random.Random(size)
+    board = Board(size)
+    board.place_ships_randomly(scaled_fleet(size), rng)
+    shots = [(r, c) for r in range(size) for c in range(size)]
+    rng.shuffle(shots)
+    shots = shots[:turns]
+    start = time.perf_counter()
+    for row, col in shots:
+        board.fire_at(row, col)
+        if snapshot:
+            snapshot(board)
+        if text:
+            text(board)
+    return (time.perf_counter() - start) / len(shots) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-turn board rendering by board size")
+    parser.add_argument("--sizes", default="10,26,50,100", help="comma-separated board sizes")
+    parser.add_argument("--turns", type=int, default=2000, help="shots per size (at most size x size)")
+    args = parser.parse_args()
+
+    modes = {
+        "v2 full": (lambda b: encode_board("player1", b.display_grid, b.size), None),
+        "v2 cached": (lambda b: board_payload("player1", b), None),
+        "v1 full": (None, lambda b: render_board_rows(b.display_grid, b.size)),
+        "v1 cached": (None, lambda b: board_rows(b)),
+    }
+    print(f"{'size':>5} " + " ".join(f"{name + ' us':>14}" for name in modes))
+    for size in (int(s) for s in args.sizes.split(",")):
+        times = [per_turn(size, args.turns, *builders) for builders in modes.values()]
+        print(f"{size:>5} " + " ".join(f"{t:14.1f}" for t in times))
+
+
+if __name__ == "__main__":
+    main()
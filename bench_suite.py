@@ -0,0 +1,352 @@
+"""
+bench_suite.py
+
+Microbenchmarks for the hot paths, one number per operation:
+  - utils.encode_packet / decode_packet on a board row
+  - send_packet_message into an in-memory writer (v1 text file, v2 PacketWriter)
+  - Board.fire_at, Board.place_ships_randomly, Board.can_place_ship
+  - parse_coordinate
+  - game_logic.send_board / send_own_board for both protocol versions
+
+Each benchmark is timed like timeit/pyperf: the number of operations per
+sample is calibrated so a sample takes about --min-time seconds, the
+garbage collector is off while a sample runs, and the median of --repeat
+samples is reported (with the fastest and the spread). Setup work, such as
+building the boards fire_at shoots at, is done before a sample starts.
+
+send_board is timed as the server uses it every turn: one cell changed
+since the last call, so only its row (v1) or cell (v2) is redone.
+send_own_board is timed from scratch (as for sync_boards on reconnect).
+
+Boards carry the classic five-ship fleet (FLEET), the one real games use.
+
+--save writes the results as JSON, with the fleet; --compare reads such a
+file and flags every benchmark whose median is more than --threshold
+slower than there, and whose fastest sample is slower than that median
+too (the exit status is 1 if any is). A baseline saved with another fleet
+is refused. Compare runs from the same machine and Python.
+
+Usage:
+    python bench_suite.py [--save results.json] [--compare baseline.json] [--threshold 0.10]
+                          [--filter board] [--min-time 0.1] [--repeat 7] [--list]
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import metrics
+from battleship import Board, CLASSIC_SHIPS, format_coordinate, parse_coordinate
+from game_logic import render_board_rows, send_board, send_own_board
+from utils import (
+    count_with,
+    decode_packet,
+    encode_packet,
+    send_packet_message,
+    PacketWriter,
+    PACKET_TYPE_MESSAGE,
+    PROTOCOL_V2,
+)
+
+DEFAULT_THRESHOLD = 0.10
+FLEET = CLASSIC_SHIPS
+
+
+class _NullSocket:
+    """The in-memory end of a PacketWriter: sendall() just counts the bytes."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+
+class _NullTextFile:
+    """A v1 wfile that keeps nothing, so long samples do not pile up output."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text)
+
+    def flush(self):
+        pass
+
+
+def _board(seed=0, shots=0):
+    """A 10x10 board with FLEET, placed with a fixed seed, after `shots` random shots."""
+    rng = random.Random(seed)
+    board = Board()
+    board.place_ships_randomly(FLEET, rng)
+    cells = [(r, c) for r in range(board.size) for c in range(board.size)]
+    rng.shuffle(cells)
+    for row, col in cells[:shots]:
+        board.fire_at(row, col)
+    return board
+
+
+def _sample_row():
+    return render_board_rows(_board(shots=40).display_grid, 10)[5]
+
+
+def _writer(proto):
+    return _NullTextFile() if proto == 1 else PacketWriter(_NullSocket(), PROTOCOL_V2)
+
+
+# ----------------------------------------------------------------------
+# Benchmarks: prepare(loops) does the setup and returns a function that
+# performs `loops` operations, which is what gets timed.
+# ----------------------------------------------------------------------
+
+def bench_encode_packet(loops):
+    row = _sample_row()
+
+    def run():
+        for _ in range(loops):
+            encode_packet(PACKET_TYPE_MESSAGE, row)
+    return run
+
+
+def bench_decode_packet(loops):
+    line = encode_packet(PACKET_TYPE_MESSAGE, _sample_row()) + "\n"
+
+    def run():
+        for _ in range(loops):
+            decode_packet(line)
+    return run
+
+
+def _bench_send_packet_message(proto):
+    def prepare(loops):
+        row = _sample_row()
+        wfile = _writer(proto)
+
+        def run():
+            for _ in range(loops):
+                send_packet_message(wfile, PACKET_TYPE_MESSAGE, row)
+        return run
+    return prepare
+
+
+def bench_fire_at(loops):
+    # Every cell of as many boards as it takes, in random order
+    rng = random.Random(1)
+    shots = []
+    for n in range(loops // 100 + 1):
+        board = _board(seed=n)
+        cells = [(r, c) for r in range(10) for c in range(10)]
+        rng.shuffle(cells)
+        shots += [(board.fire_at, r, c) for r, c in cells]
+    shots = shots[:loops]
+
+    def run():
+        for fire_at, row, col in shots:
+            fire_at(row, col)
+    return run
+
+
+def bench_place_ships_randomly(loops):
+    boards = [Board() for _ in range(loops)]
+    rng = random.Random(2)
+
+    def run():
+        for board in boards:
+            board.place_ships_randomly(FLEET, rng)
+    return run
+
+
+def bench_can_place_ship(loops):
+    board = _board()
+    rng = random.Random(3)
+    checks = [(rng.randrange(10), rng.randrange(10), rng.randint(2, 5), rng.randint(0, 1)) for _ in range(1024)]
+    checks = (checks * (loops // len(checks) + 1))[:loops]
+    can_place_ship = board.can_place_ship
+
+    def run():
+        for row, col, length, orientation in checks:
+            can_place_ship(row, col, length, orientation)
+    return run
+
+
+def bench_parse_coordinate(loops):
+    coords = [format_coordinate(r, c) for r in range(10) for c in range(10)]
+    coords = (coords * (loops // len(coords) + 1))[:loops]
+
+    def run():
+        for coord in coords:
+            parse_coordinate(coord)
+    return run
+
+
+def _bench_send_board(proto):
+    def prepare(loops):
+        board = _board(shots=40)
+        wfile = _writer(proto)
+        send_board(wfile, board)
+        # Mark one cell changed before each send, as a shot would
+        cells = [(r, c) for r in range(10) for c in range(10)]
+        cells = (cells * (loops // len(cells) + 1))[:loops]
+        changes = board.changes
+
+        def run():
+            for cell in cells:
+                changes.append(cell)
+                send_board(wfile, board)
+        return run
+    return prepare
+
+
+def _bench_send_own_board(proto):
+    def prepare(loops):
+        board = _board(shots=40)
+        wfile = _writer(proto)
+        views = board.views
+
+        def run():
+            for _ in range(loops):
+                views.clear()
+                send_own_board(wfile, board)
+        return run
+    return prepare
+
+
+BENCHMARKS = {
+    "utils.encode_packet": bench_encode_packet,
+    "utils.decode_packet": bench_decode_packet,
+    "utils.send_packet_message[v1]": _bench_send_packet_message(1),
+    "utils.send_packet_message[v2]": _bench_send_packet_message(2),
+    "battleship.Board.fire_at": bench_fire_at,
+    "battleship.Board.place_ships_randomly": bench_place_ships_randomly,
+    "battleship.Board.can_place_ship": bench_can_place_ship,
+    "battleship.parse_coordinate": bench_parse_coordinate,
+    "game_logic.send_board[v1]": _bench_send_board(1),
+    "game_logic.send_board[v2]": _bench_send_board(2),
+    "game_logic.send_own_board[v1]": _bench_send_own_board(1),
+    "game_logic.send_own_board[v2]": _bench_send_own_board(2),
+}
+
+
+def time_loops(prepare, loops):
+    run = prepare(loops)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        run()
+        return time.perf_counter() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure(prepare, min_time, repeat):
+    """Seconds per operation of each of `repeat` samples, and the operations per sample."""
+    loops = 1
+    while True:
+        elapsed = time_loops(prepare, loops)
+        if elapsed >= min_time:
+            break
+        # Aim a little past min_time so the next try usually settles it
+        loops = max(loops * 2, int(loops * min_time * 1.2 / max(elapsed, 1e-9)))
+    samples = [elapsed / loops] + [time_loops(prepare, loops) / loops for _ in range(repeat - 1)]
+    return samples, loops
+
+
+def run_suite(names, min_time, repeat):
+    results = {}
+    print(f"{'benchmark':<40} {'median':>10} {'min':>10} {'spread':>8} {'loops':>9}")
+    for name in names:
+        samples, loops = measure(BENCHMARKS[name], min_time, repeat)
+        median = statistics.median(samples)
+        results[name] = {'median': median, 'min': min(samples), 'stdev': statistics.pstdev(samples),
+                         'loops': loops, 'samples': samples}
+        print(f"{name:<40} {fmt(median):>10} {fmt(min(samples)):>10} "
+              f"{results[name]['stdev'] / median * 100:>7.1f}% {loops:>9}")
+    return results
+
+
+def fmt(seconds):
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f} ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def compare(results, baseline, threshold):
+    """Print each benchmark's change from the baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<40} {'-':>10} {fmt(result['median']):>10}   (new)")
+            continue
+        before = baseline[name]['median']
+        change = result['median'] / before - 1
+        flag = ""
+        # Noise guard: even the fastest sample must be slower than the baseline's median
+        if change > threshold and result['min'] > before:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<40} {fmt(before):>10} {fmt(result['median']):>10} {change * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the server's hot paths")
+    parser.add_argument("--save", metavar="PATH", help="write the results to PATH as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown of the median that counts as a regression (0.10 = 10%%)")
+    parser.add_argument("--filter", default="", metavar="TEXT", help="only run benchmarks whose name contains TEXT")
+    parser.add_argument("--min-time", type=float, default=0.1, metavar="SECONDS", help="target length of a sample")
+    parser.add_argument("--repeat", type=int, default=7, help="samples per benchmark")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    # Time the codec and writers with the counters the server records into
+    count_with(metrics)
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        return
+    if not names:
+        parser.error(f"no benchmark matches {args.filter!r}")
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, encoding='utf-8') as f:
+                saved = json.load(f)
+            baseline = saved['benchmarks']
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"cannot read baseline {args.compare}: {e}")
+        # Files from before the fleet was saved were timed with the one-cell test ship
+        saved_fleet = [tuple(ship) for ship in saved.get('fleet', [("Test Ship 1", 1)])]
+        if saved_fleet != FLEET:
+            parser.error(f"baseline {args.compare} was run with fleet {saved_fleet}, not {FLEET}")
+
+    results = run_suite(names, args.min_time, max(1, args.repeat))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'fleet': FLEET,
+                       'benchmarks': results}, f, indent=2)
+        print(f"[INFO] Results written to {args.save}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"[WARN] {len(regressions)} benchmark(s) more than {args.threshold:.0%} slower than {args.compare}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
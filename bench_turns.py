@@ -0,0 +1,145 @@
+"""
+bench_turns.py
+
+Measures what write coalescing saves per turn.
+
+Each game is the real game_logic.run_single_game between two bot clients
+over loopback TCP. Bots place ships randomly and fire at every cell in a
+random order. Two configurations are compared:
+  - before: every packet is its own send() (FLUSH_BYTES = 0), Nagle left on
+  - after:  corked writers flushed at prompt/turn boundaries, TCP_NODELAY
+Prints server send() calls per turn and the p50/p99 turn latency, measured
+at the shooter from sending FIRE to having the updated board (or the win).
+
+Usage:
+    python bench_turns.py [--games 4] [--rounds 3] [--proto 2]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import socket
+import statistics
+import threading
+import time
+
+import utils
+from fanout import SpectatorHub
+from game_logic import run_single_game
+from utils import (
+    send_packet_message,
+    recv_packet,
+    PacketReader,
+    PacketWriter,
+    PACKET_TYPE_COMMAND,
+    PACKET_TYPE_RESULT,
+    PACKET_TYPE_DELTA,
+)
+
+
+def bot(sock, proto, seed, latencies):
+    """Answer prompts like a player would; record FIRE -> board latencies."""
+    rfile, wfile = PacketReader(sock, proto), PacketWriter(sock, proto)
+    shots = [f"{chr(ord('A') + r)}{c + 1}" for r in range(10) for c in range(10)]
+    random.Random(seed).shuffle(shots)
+    fired_at = None
+    while True:
+        packet = recv_packet(rfile)
+        if packet is None:
+            return
+        pkt_type, payload = packet
+        if "[M/R]" in payload:
+            send_packet_message(wfile, PACKET_TYPE_COMMAND, "R")
+        elif "Your turn!" in payload:
+            fired_at = time.perf_counter()
+            send_packet_message(wfile, PACKET_TYPE_COMMAND, f"FIRE {shots.pop()}")
+        elif fired_at is not None and (
+                (pkt_type == PACKET_TYPE_DELTA and payload.startswith("opponent"))
+                or payload == " End of board"
+                or (pkt_type == PACKET_TYPE_RESULT and "won the game" in payload)):
+            latencies.append(time.perf_counter() - fired_at)
+            fired_at = None
+
+
+DEFAULT_FLUSH_BYTES = utils.FLUSH_BYTES
+
+
+def connect_players(listener, proto, nodelay, seed, latencies):
+    """Two server-side player dicts, each with a bot thread (not started) on the other end."""
+    players, bots = [], []
+    for idx in range(2):
+        client = socket.create_connection(listener.getsockname())
+        conn, _ = listener.accept()
+        for s in (client, conn):
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+        players.append({'conn': conn, 'rfile': PacketReader(conn, proto), 'wfile': PacketWriter(conn, proto),
+                        'player_id': f"bench{seed}-{idx}", 'client': client})
+        bots.append(threading.Thread(target=bot, args=(client, proto, seed * 2 + idx, latencies)))
+    return players, bots
+
+
+def play_game(players, bots, sends):
+    for t in bots:
+        t.start()
+    run_single_game(players[0], players[1], SpectatorHub(), {})
+    sends.append(sum(p['wfile'].sends for p in players))
+    for p, t in zip(players, bots):
+        p['conn'].close()
+        t.join()
+        p['client'].close()
+
+
+def run(games, proto, coalesce):
+    utils.FLUSH_BYTES = DEFAULT_FLUSH_BYTES if coalesce else 0
+    latencies, sends = [], []
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(2 * games)
+        threads = [threading.Thread(target=play_game,
+                                    args=(*connect_players(listener, proto, coalesce, seed, latencies), sends))
+                   for seed in range(games)]
+        # The game code logs every read; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+    latencies.sort()
+    return {
+        'sends_per_turn': sum(sends) / len(latencies),
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'turns': len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark send() calls and latency per turn")
+    parser.add_argument("--games", type=int, default=4, help="games played at the same time")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="alternating runs of each configuration; medians are reported")
+    parser.add_argument("--proto", type=int, choices=(1, 2), default=2, help="wire protocol of the bots")
+    args = parser.parse_args()
+
+    results = {"before": [], "after": []}
+    for _ in range(args.rounds):
+        results["before"].append(run(args.games, args.proto, coalesce=False))
+        results["after"].append(run(args.games, args.proto, coalesce=True))
+
+    print(f"protocol v{args.proto}, {args.games} concurrent games, {args.rounds} rounds "
+          f"({results['after'][0]['turns']} turns per round)")
+    print(f"{'':7} {'sends/turn':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    summary = {}
+    for name, runs in results.items():
+        summary[name] = {key: statistics.median(r[key] for r in runs)
+                         for key in ('sends_per_turn', 'p50_ms', 'p99_ms')}
+        s = summary[name]
+        print(f"{name:7} {s['sends_per_turn']:11.1f} {s['p50_ms']:8.3f} {s['p99_ms']:8.3f}")
+    before, after = summary["before"], summary["after"]
+    print(f"after vs before: sends/turn {after['sends_per_turn'] / before['sends_per_turn'] - 1:+.0%}, "
+          f"p99 {after['p99_ms'] / before['p99_ms'] - 1:+.0%}")
+
+
+if __name__ == "__main__":
+    main()
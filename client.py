@@ -15,14 +15,32 @@ from utils import (
     encode_packet,
     decode_packet,
     send_packet_message,
+    recv_packet,
+    recv_line,
+    send_id_line,
+    PacketReader,
+    PacketWriter,
     PACKET_TYPE_MESSAGE,
     PACKET_TYPE_COMMAND,
     PACKET_TYPE_RESULT,
-    PACKET_TYPE_CONTROL
+    PACKET_TYPE_CONTROL,
+    PACKET_TYPE_BOARD,
+    PACKET_TYPE_DELTA,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    INTEGRITY_CRC32,
+    parse_proto_ack,
+    decode_board,
+    apply_delta
 )
+from battleship import render_board_rows
 
 HOST = '127.0.0.1'
 PORT = 5000
+# Wire format to ask the server for: PROTOCOL_V2 (binary frames) or PROTOCOL_V1 (text lines)
+PROTOCOL = PROTOCOL_V2
+# v2 integrity mode: INTEGRITY_NONE, INTEGRITY_CRC32 or INTEGRITY_ARQ (resend corrupted frames)
+INTEGRITY = INTEGRITY_CRC32
 # Koda: A global variable to control the running state of the threads
 running = True
 is_spectator = False
@@ -37,50 +55,68 @@ is_spectator = False
 #
 # import threading
 
+BOARD_TITLES = {"self": "[Your Board]", "opponent": "[Opponent's Board]"}
+
+
+def print_board(view, grid):
+    print("\n" + BOARD_TITLES.get(view, f"[{view.capitalize()}'s Board]"))
+    for row in render_board_rows(grid, len(grid)):
+        print(row)
+    print(flush=True)
+
+
 def receive_messages(rfile, wfile, player_id):
     global is_spectator
+    # Local copies of the boards (protocol v2): full BOARD packets replace
+    # them, DELTA packets update single cells
+    boards = {}
     while running:
         try:
-            line = rfile.readline()
-            if not line:
+            packet = recv_packet(rfile)
+            if packet is None:
                 print("[INFO] Server disconnected.")
                 break
 
-            pkt_type, checksum, payload = decode_packet(line)
+            pkt_type, payload = packet
             if pkt_type is None:
-                payload = line.strip()
                 pkt_type = 1  # fallback to message
 
             # special commands
             if payload == "SEND-ID":
-                wfile.write(f"ID {player_id}\n")
-                wfile.flush()
+                send_id_line(wfile, player_id)
+                continue
+
+            if pkt_type == PACKET_TYPE_BOARD:
+                view, grid = decode_board(payload)
+                boards[view] = grid
+                print_board(view, grid)
+                continue
+            if pkt_type == PACKET_TYPE_DELTA:
+                try:
+                    view = apply_delta(boards, payload)
+                except (KeyError, ValueError, IndexError):
+                    continue  # delta for a board we never received
+                print_board(view, boards[view])
                 continue
 
             # Board: opponent's perspective
             if payload == "GRID_OPPONENT":
                 print("\n[Opponent's Board]")
                 while True:
-                    board_line = rfile.readline()
-                    if not board_line.strip():
+                    board_packet = recv_packet(rfile)
+                    if board_packet is None or not board_packet[1].strip():
                         break 
-                    pkt_type, _, board_payload = decode_packet(board_line)
-                    if pkt_type is None:
-                        board_payload = board_line.strip()
-                    print(board_payload)
+                    print(board_packet[1])
                 continue
 
             # Board: your perspective
             if payload == "GRID_SELF":
                 print("\n[Your Board]")
                 while True:
-                    board_line = rfile.readline()
-                    if not board_line.strip():
+                    board_packet = recv_packet(rfile)
+                    if board_packet is None or not board_packet[1].strip():
                         break
-                    pkt_type, _, board_payload = decode_packet(board_line)
-                    if pkt_type is None:
-                        board_payload = board_line.strip()
-                    print(board_payload)
+                    print(board_packet[1])
                 continue
 
             # Spectator mode
@@ -90,10 +126,8 @@ def receive_messages(rfile, wfile, player_id):
                 print(">> Spectator mode. No input required.", flush=True)
                 continue
             elif "You are being promoted to a player" in payload:
+                # The ID itself is sent when the server follows up with SEND-ID
                 print(payload)
-                print("[INFO] Sending player ID again...")
-                wfile.write(f"ID {player_id}\n")
-                wfile.flush()
                 is_spectator = False
                 continue
 
@@ -103,8 +137,9 @@ def receive_messages(rfile, wfile, player_id):
             elif pkt_type == 3:  # RESULT
                 print("[Result]", payload, flush=True)
             elif pkt_type == 4:  # PING
-                # Heartbeat ping - no output
-                pass
+                # Heartbeat ping - no output, but answered so the server can time it
+                if payload.startswith("PING"):
+                    send_packet_message(wfile, PACKET_TYPE_CONTROL, "PONG" + payload[4:])
             else:
                 print(payload, flush=True)  # fallback 
 
@@ -114,6 +149,29 @@ def receive_messages(rfile, wfile, player_id):
 
 
 
+def open_streams(s, player_id):
+    """
+    Send our ID and agree on a wire format. Asking for v2 is answered with
+    "PROTO 2" (plus the integrity mode, if not crc32); anything else means
+    the server only speaks v1.
+    """
+    if PROTOCOL == PROTOCOL_V2:
+        option = f" integrity={INTEGRITY}" if INTEGRITY != INTEGRITY_CRC32 else ""
+        s.sendall(f"ID {player_id} proto={PROTOCOL_V2}{option}\n".encode())
+        reply = recv_line(s)
+        integrity = parse_proto_ack(reply)
+        if integrity is not None:
+            wfile = PacketWriter(s, PROTOCOL_V2, integrity)
+            return PacketReader(s, PROTOCOL_V2, writer=wfile), wfile
+        # Older server: the reply was already its first (v1) message
+        pkt_type, _, payload = decode_packet(reply)
+        print(payload if pkt_type is not None else reply.strip(), flush=True)
+        return PacketReader(s, PROTOCOL_V1), PacketWriter(s, PROTOCOL_V1)
+
+    s.sendall(f"ID {player_id}\n".encode())
+    return PacketReader(s, PROTOCOL_V1), PacketWriter(s, PROTOCOL_V1)
+
+
 def main():
     global running
     global is_spectator
@@ -123,11 +181,8 @@ def main():
     
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.connect((HOST, PORT))
-        rfile = s.makefile('r')
-        wfile = s.makefile('w')
-
-        wfile.write(f"ID {player_id}\n")
-        wfile.flush()
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        rfile, wfile = open_streams(s, player_id)
 
 
         threading.Thread(target=receive_messages, args=(rfile, wfile, player_id), daemon=True).start()
@@ -141,9 +196,7 @@ def main():
 
                 user_input = input(">> ").strip()
                 if user_input.lower() == "quit":
-                    pkt = encode_packet(2, "quit")  # type 2 means command
-                    wfile.write(pkt + '\n')
-                    wfile.flush()
+                    send_packet_message(wfile, PACKET_TYPE_COMMAND, "quit")
                     print("[INFO] Quitting game. Closing connection.")
                     running = False
                     wfile.close()
@@ -152,9 +205,7 @@ def main():
                     s.close()
                     break
 
-                pkt = encode_packet(2, user_input)
-                wfile.write(pkt + '\n')
-                wfile.flush()
+                send_packet_message(wfile, PACKET_TYPE_COMMAND, user_input)
 
 
         except KeyboardInterrupt:
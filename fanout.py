@@ -0,0 +1,348 @@
+"""
+fanout.py
+
+Spectator fan-out for the threaded server.
+
+Each game owns a SpectatorHub. Publishing an event encodes it once (per
+protocol version) into a shared frame log and returns immediately; a single background drainer
+thread pushes the frames to every spectator socket with non-blocking sends.
+Every spectator has its own read cursor into the log, which acts as its
+bounded outbound buffer: when a spectator falls more than max_frames behind,
+the hub's slow-consumer policy decides what happens:
+
+  - "drop_oldest": skip the oldest frames so only the last max_frames remain
+  - "conflate":    jump straight to the most recent snapshot frame (frames
+                   published with snapshot=True, e.g. a full board), falling
+                   back to drop_oldest if there is none in the window
+  - "disconnect":  close the spectator's connection
+
+The game thread never touches spectator sockets, so move latency does not
+depend on how many spectators there are or how slow they are.
+"""
+
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+import metrics
+from utils import encode_for, PROTOCOL_V1, PROTOCOL_V2
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_CONFLATE = "conflate"
+POLICY_DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (POLICY_DROP_OLDEST, POLICY_CONFLATE, POLICY_DISCONNECT)
+
+DEFAULT_POLICY = POLICY_DROP_OLDEST
+DEFAULT_MAX_FRAMES = 256
+# Seconds the drainer waits after a wake-up so bursts of events are sent together
+BATCH_WINDOW = 0.005
+
+_SEND_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class _Channel:
+    """One spectator: its (conn, rfile, wfile) entry and position in the frame log."""
+
+    def __init__(self, entry, cursor):
+        self.entry = entry
+        self.conn = entry[0]
+        # Index into each logged frame's (v1, v2) encodings
+        self.encoding = 1 if getattr(entry[2], 'proto', PROTOCOL_V1) == PROTOCOL_V2 else 0
+        self.cursor = cursor    # seq of the next frame to send
+        self.partial = None     # memoryview of a frame that was only partly sent
+        self.blocked = False    # socket buffer full; waiting for writability
+        self.dead = False
+        if not _SEND_FLAGS:
+            self.conn.setblocking(False)
+
+    def detach(self):
+        if not _SEND_FLAGS and not self.dead:
+            self.conn.setblocking(True)
+
+
+class SpectatorHub:
+    """
+    Spectators of one game. Supports the list operations the server uses
+    (append, len, iteration over (conn, rfile, wfile) entries) plus
+    publish() for encode-once broadcasting.
+    """
+
+    def __init__(self, policy=DEFAULT_POLICY, max_frames=DEFAULT_MAX_FRAMES):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow-consumer policy: {policy}")
+        self.policy = policy
+        self.max_frames = max_frames
+        self.lock = threading.Lock()
+        self.caught_up = threading.Condition(self.lock)
+        self.channels = []
+        self.frames = deque()   # (v1 bytes, v2 bytes) per event; frames[0] has seq base_seq
+        self.base_seq = 0
+        self.next_seq = 0
+        self.last_snapshot_seq = None
+        self.dropped_frames = 0
+        self.disconnected = 0
+        self.closed = False
+        self._draining = False  # the drainer is sending for this hub
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __iter__(self):
+        with self.lock:
+            return iter([ch.entry for ch in self.channels if not ch.dead])
+
+    def append(self, entry):
+        with self.lock:
+            self.channels.append(_Channel(entry, self.next_seq))
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def publish(self, pkt_type, payload, snapshot=False):
+        """Encode one packet and queue it for every spectator. O(1) for the caller."""
+        self.publish_frame(
+            (encode_for(PROTOCOL_V1, pkt_type, payload), encode_for(PROTOCOL_V2, pkt_type, payload)),
+            snapshot,
+        )
+
+    def publish_frame(self, data, snapshot=False):
+        """Queue an already encoded (v1 bytes, v2 bytes) pair."""
+        with self.lock:
+            if self.closed:
+                return
+            if not self.channels:
+                return  # nobody is watching; nothing to keep
+            if snapshot:
+                self.last_snapshot_seq = self.next_seq
+            self.frames.append(data)
+            self.next_seq += 1
+        _drainer.schedule(self)
+
+    def close(self, timeout=1.0):
+        """
+        Stop fan-out for this game. Waits up to `timeout` seconds for queued
+        frames to reach spectators, then returns the live (conn, rfile, wfile)
+        entries so they can be reused (lobby, promotion, next game).
+
+        A spectator left in the middle of a frame gets up to `timeout` more
+        (shared by all such spectators) to take the rest of it; one that
+        does not is disconnected, since a torn frame would corrupt its
+        stream wherever the connection went next.
+        """
+        with self.lock:
+            self.caught_up.wait_for(self._all_caught_up, timeout)
+            self.closed = True
+            # A send in progress must finish first, so ch.partial is final and nothing goes out twice
+            self.caught_up.wait_for(lambda: not self._draining)
+            channels, self.channels = self.channels, []
+            self.frames.clear()
+        _drainer.forget(self)
+        deadline = time.monotonic() + timeout
+        entries = []
+        for ch in channels:
+            ch.detach()
+            if not ch.dead and ch.partial is not None and not self._finish_frame(ch, deadline):
+                ch.dead = True
+            if not ch.dead:
+                entries.append(ch.entry)
+        return entries
+
+    def _finish_frame(self, ch, deadline):
+        """Send the rest of ch's partly sent frame, blocking until deadline at most; False if it did not all go."""
+        try:
+            ch.conn.settimeout(max(0.0, deadline - time.monotonic()))
+            ch.conn.sendall(ch.partial)
+            ch.conn.settimeout(None)
+            ch.partial = None
+            return True
+        except OSError:  # socket.timeout included
+            self.disconnected += 1
+            try:
+                ch.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            ch.conn.close()
+            return False
+
+    # ------------------------------------------------------------------
+    # Drainer side
+    # ------------------------------------------------------------------
+
+    def _all_caught_up(self):
+        return all(ch.dead or (ch.cursor == self.next_seq and ch.partial is None) for ch in self.channels)
+
+    def _apply_policy(self, ch):
+        """Called with the lock held when ch lags more than max_frames behind."""
+        if self.policy == POLICY_DISCONNECT:
+            ch.dead = True
+            self.disconnected += 1
+            try:
+                ch.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        target = self.next_seq - self.max_frames
+        if self.policy == POLICY_CONFLATE and self.last_snapshot_seq is not None and self.last_snapshot_seq >= ch.cursor:
+            target = self.last_snapshot_seq
+        self.dropped_frames += target - ch.cursor
+        ch.cursor = target
+
+    def _next_chunk(self, ch):
+        """
+        Data to send next for ch, or None if it is caught up. Lock held.
+        All frames queued for ch are joined into one buffer so a burst of
+        events costs a single send() per spectator.
+        """
+        if ch.partial is None:
+            if ch.cursor >= self.next_seq:
+                return None
+            if self.next_seq - ch.cursor > self.max_frames:
+                self._apply_policy(ch)
+                if ch.dead:
+                    return None
+            start = ch.cursor - self.base_seq
+            end = self.next_seq - self.base_seq
+            data = b"".join(f[ch.encoding] for f in islice(self.frames, start, end))
+            metrics.FRAMES_OUT[PROTOCOL_V2 if ch.encoding else PROTOCOL_V1].inc(end - start)
+            ch.cursor = self.next_seq
+            if not data:
+                return None  # only frames this spectator's protocol does not carry
+            ch.partial = memoryview(data)
+        return ch.partial
+
+    def drain(self):
+        """
+        Push as much as possible to every spectator that is not known to be
+        blocked, without blocking. Returns the channels that just became
+        blocked; the drainer watches them for writability.
+        """
+        newly_blocked = []
+        with self.lock:
+            if self.closed:
+                return newly_blocked
+            self._draining = True
+            channels = [ch for ch in self.channels if not ch.blocked]
+        try:
+            for ch in channels:
+                while not ch.dead:
+                    with self.lock:
+                        chunk = None if self.closed else self._next_chunk(ch)
+                    if chunk is None:
+                        break
+                    try:
+                        sent = ch.conn.send(chunk, _SEND_FLAGS)
+                    except (BlockingIOError, InterruptedError):
+                        ch.blocked = True
+                        newly_blocked.append(ch)
+                        break
+                    except OSError:
+                        ch.dead = True
+                        break
+                    with self.lock:
+                        ch.partial = chunk[sent:] if sent < len(chunk) else None
+        finally:
+            with self.lock:
+                self._draining = False
+                self.caught_up.notify_all()
+        self._release_frames()
+        return newly_blocked
+
+    def _release_frames(self):
+        with self.lock:
+            if self.closed:
+                return  # close() took the channels and the frames
+            if any(ch.dead for ch in self.channels):
+                self.channels = [ch for ch in self.channels if not ch.dead]
+            if len(self.frames) > self.max_frames:
+                # Blocked spectators that fell too far behind get the policy applied now
+                for ch in self.channels:
+                    if self.next_seq - ch.cursor > self.max_frames:
+                        self._apply_policy(ch)
+                self.channels = [ch for ch in self.channels if not ch.dead]
+            # Frames every spectator has sent can be released
+            low = min((ch.cursor for ch in self.channels), default=self.next_seq)
+            while self.base_seq < low:
+                self.frames.popleft()
+                self.base_seq += 1
+            self.caught_up.notify_all()
+
+
+class _Drainer:
+    """
+    Single background thread that drains every hub with pending frames.
+    Spectators whose socket buffer is full are parked in a selector and
+    skipped until the kernel reports them writable again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hubs = set()
+        self.thread = None
+        self.selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def schedule(self, hub):
+        with self.lock:
+            self.hubs.add(hub)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="spectator-fanout", daemon=True)
+                self.thread.start()
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wake-up is already pending
+
+    def forget(self, hub):
+        with self.lock:
+            self.hubs.discard(hub)
+
+    def _watch(self, hub, ch):
+        try:
+            self.selector.register(ch.conn, selectors.EVENT_WRITE, (hub, ch))
+        except KeyError:
+            # fd number reused after an old socket was closed without unregistering
+            self.selector.unregister(ch.conn)
+            self.selector.register(ch.conn, selectors.EVENT_WRITE, (hub, ch))
+        except (ValueError, OSError):
+            ch.dead = True
+
+    def _run(self):
+        while True:
+            # Let the game thread finish its burst of events first: they go
+            # out together, and the GIL stays free while players are served
+            time.sleep(BATCH_WINDOW)
+            with self.lock:
+                hubs = list(self.hubs)
+            for hub in hubs:
+                for ch in hub.drain():
+                    self._watch(hub, ch)
+                with self.lock, hub.lock:
+                    if hub.closed or all(ch.blocked or ch.cursor == hub.next_seq for ch in hub.channels):
+                        self.hubs.discard(hub)
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                hub, ch = key.data
+                try:
+                    self.selector.unregister(key.fileobj)
+                except (KeyError, ValueError, OSError):
+                    pass
+                ch.blocked = False
+                if not hub.closed:
+                    with self.lock:
+                        self.hubs.add(hub)
+
+
+_drainer = _Drainer()
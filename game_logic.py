@@ -1,34 +1,84 @@
-from battleship import Board, parse_coordinate, SHIPS
-import select
+from battleship import Board, parse_coordinate, format_coordinate, render_board_rows, render_row, DEFAULT_RULES
+import contextlib
+import selectors
 import time
 import traceback
+import uuid
+import metrics
+import tracing
 from utils import (
     encode_packet,
     decode_packet,
     send_packet_message,
+    recv_packet,
+    PacketReader,
+    corked,
+    NAK_RETRY,
+    encode_frame,
+    encode_packed_board,
+    pack_cell,
+    encode_delta,
+    speaks_v2,
+    VIEW_SELF,
+    VIEW_OPPONENT,
     PACKET_TYPE_MESSAGE, #1
     PACKET_TYPE_COMMAND, #2
     PACKET_TYPE_RESULT,  #3
-    PACKET_TYPE_CONTROL  #4
+    PACKET_TYPE_CONTROL, #4
+    PACKET_TYPE_BOARD,   #5
+    PACKET_TYPE_DELTA    #6
 )
 
+RECONNECT_TIMEOUT = 60
+
 def broadcast_to_spectators(spectators, message):
     """
     Send a message to all currently connected spectators.
-    Spectators are (conn, rfile, wfile) tuples.
+    `spectators` is the game's fanout.SpectatorHub: the message is encoded
+    once and delivered in the background, so this never blocks on a socket.
     """
-    for conn, rfile, wfile in spectators:
-        try:
-            send_packet_message(wfile, PACKET_TYPE_MESSAGE, f"[Spectator] {message}")
-        except Exception:
-            continue  # ignore disconnected spectators
+    spectators.publish(PACKET_TYPE_MESSAGE, f"[Spectator] {message}")
+
+def run_two_player_session(p1, p2, spectators, player_session, journal=None, resume=None, trace=tracing.NO_SPAN,
+                           rules=DEFAULT_RULES):
+    """
+    Play rounds until the players stop. With a journal.GameJournal every
+    round is recorded; `resume` ({'game_id', 'turn'}, boards already set on
+    p1/p2) continues a round recovered from the journal instead of starting one.
+    `trace` is the game's tracing span; rounds, setup and turns are traced under it.
+    `rules` ({'size', 'fleet'}, see battleship.game_rules) is the game's board size and fleet.
+    """
+    # While the session runs, a new connection with either player's ID is a reconnection
+    for p in (p1, p2):
+        if p['player_id'] in player_session:
+            player_session[p['player_id']]['in_game'] = True
+    try:
+        return _run_two_player_session(p1, p2, spectators, player_session, journal, resume, trace, rules)
+    finally:
+        for p in (p1, p2):
+            if p['player_id'] in player_session:
+                player_session[p['player_id']]['in_game'] = False
+
 
-def run_two_player_session(p1, p2, spectators, player_session):
+def _run_two_player_session(p1, p2, spectators, player_session, journal=None, resume=None, trace=tracing.NO_SPAN,
+                            rules=DEFAULT_RULES):
     while True:
-        p1.pop("board", None)
-        p2.pop("board", None)
+        if resume is None:
+            p1.pop("board", None)
+            p2.pop("board", None)
+            game_id = uuid.uuid4().hex
+        else:
+            game_id = resume['game_id']
         broadcast_to_spectators(spectators, "A new round is starting...")
-        success = run_single_game(p1, p2, spectators, player_session)
+        try:
+            with trace.child("round", round_id=game_id) as round_span:
+                success = run_single_game(p1, p2, spectators, player_session, journal, game_id, resume, round_span,
+                                          rules)
+        finally:
+            # Only a crash of the whole server leaves a round unfinished in the journal
+            if journal:
+                journal.game_ended(game_id)
+        resume = None
         if not success:
             print("[DEBUG] run_single_game returned False. Exiting session.")
             return None
@@ -59,71 +109,200 @@ def run_two_player_session(p1, p2, spectators, player_session):
 
 
 
-def safe_readline_with_timeout(player, timeout_seconds):
+def safe_read_payload_with_timeout(player, timeout_seconds):
+    """
+    Wait up to timeout_seconds for the player's next packet, in whichever
+    protocol version their connection speaks. Returns (status, payload) with
+    status "ok", "timeout" or "closed"; undecodable v1 lines come back as
+    their stripped text (legacy input).
+    """
     print(f"[DEBUG] reading from conn = {player['conn'].fileno()}")
 
+    rfile = player['rfile']
+    deadline = time.time() + timeout_seconds
+    # While we wait, this thread is the connection's reader; the keepalive thread leaves it alone
+    reading = rfile.lock if isinstance(rfile, PacketReader) else contextlib.nullcontext()
     try:
-        ready, _, _ = select.select([player['conn']], [], [], timeout_seconds)
-        if ready:
-            line = player['rfile'].readline()
-            if line == '':
+        with reading, selectors.DefaultSelector() as selector:
+            # End of a prompt: whatever is still buffered for the player goes out before we wait
+            player['wfile'].flush()
+            selector.register(player['conn'], selectors.EVENT_READ)
+            # Data arriving is not always a packet for us (e.g. an arq NAK), so keep waiting until one is
+            while not (isinstance(rfile, PacketReader) and rfile.buffered()):
+                remaining = max(0, deadline - time.time())
+                ready = selector.select(min(remaining, NAK_RETRY))
+                if not ready:
+                    if remaining <= NAK_RETRY:
+                        metrics.TIMEOUTS.inc()
+                        return "timeout", None
+                    if isinstance(rfile, PacketReader):
+                        rfile.nak_overdue()  # an arq resend that never arrived is asked for again
+                    continue
+                if not isinstance(rfile, PacketReader):
+                    break
+                if not rfile.receive():
+                    return "closed", None
+            packet = recv_packet(rfile)
+            if packet is None:
                 return "closed", None
-            return "ok", line
-        return "timeout", None
+            return "ok", packet[1]
     except Exception as e:
-        print(f"[DEBUG] select/readline error: {e}")
+        print(f"[DEBUG] select/read error: {e}")
         return "closed", None
 
 
 
 def check_alive(p, opponent):
+    # Heartbeats are the keepalive scheduler's job (server.py); here the rest
+    # of the last turn goes out, and the write fails if the socket is dead
     try:
-        send_packet_message(p['wfile'], PACKET_TYPE_CONTROL, "PING")  # heartbeat check packet send
+        p['wfile'].flush()
         return True
     except:
-        send_packet_message(opponent, PACKET_TYPE_MESSAGE, " Opponent disconnected unexpectedly")
-        send_packet_message(opponent, PACKET_TYPE_RESULT, "WIN")
+        try:
+            send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected unexpectedly")
+            send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, "WIN")
+        except Exception:
+            pass
         return False
 
-def run_single_game(p1, p2, spectators, player_session):
+
+def wait_for_reconnect(player, player_session):
+    """
+    Block until the server registers a new connection for this player (it
+    sets the session's 'reconnected' event) or RECONNECT_TIMEOUT expires.
+    On success the player's conn/rfile/wfile are switched to the new socket.
+    """
+    player_id = player['player_id']
+    session = player_session[player_id]
+    if not session['reconnected'].is_set():
+        player_session.mark_disconnected(player_id)
+
+    if not session['reconnected'].wait(RECONNECT_TIMEOUT):
+        print(f"[INFO] Player {player_id} did not reconnect within {RECONNECT_TIMEOUT}s.")
+        return False
+    adopt_reconnection(player, player_session)
+    print(f"[INFO] Player {player_id} reconnected within {RECONNECT_TIMEOUT}s.")
+    return True
+
+
+def adopt_reconnection(player, player_session):
+    """Switch a player over to the connection registered in their session."""
+    session = player_session[player['player_id']]
+    session['reconnected'].clear()
+    player['conn'] = session['conn']
+    player['rfile'] = session['rfile']
+    player['wfile'] = session['wfile']
+    session['status'] = 'connected'
+    player_session.touch(player['player_id'])
+
+
+def notify_reconnected(player, opponent):
     try:
-        p1.pop("board", None)
-        p2.pop("board", None)
+        send_packet_message(player['wfile'], PACKET_TYPE_MESSAGE, " You have reconnected successfully. Resuming game...")
+        # A new connection means a fresh client with no board state
+        if speaks_v2(player['wfile']) and 'board' in player:
+            sync_boards(player, opponent)
+    except:
+        print(f"[WARN] Failed to notify reconnected player {player['player_id']}")
+
+    try:
+        send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent has reconnected. Game will resume.")
+    except:
+        print("[WARN] Failed to notify opponent about reconnection.")
 
+
+def adopt_pending_reconnections(players, player_session):
+    """
+    A player may reconnect while it is not their turn; pick up the new
+    socket at the next turn boundary instead of writing to the dead one.
+    """
+    for idx, p in enumerate(players):
+        session = player_session.get(p['player_id'])
+        if session and session['reconnected'].is_set():
+            adopt_reconnection(p, player_session)
+            notify_reconnected(p, players[1 - idx])
+
+def resume_single_game(p1, p2, spectators, turn):
+    """Tell both players (and spectators) that a recovered round continues."""
+    for idx, p in enumerate((p1, p2)):
+        send_packet_message(p['wfile'], PACKET_TYPE_MESSAGE, " Your game was interrupted by a server restart. Resuming...")
+        sync_boards(p, (p1, p2)[1 - idx])
+        send_packet_message(p['wfile'], PACKET_TYPE_MESSAGE, f" You are Player {idx + 1}.")
+    broadcast_to_spectators(spectators, f"Resumed game: {p1['player_id']} vs {p2['player_id']}")
+    waiting = (p1, p2)[1 - turn]
+    send_packet_message(waiting['wfile'], PACKET_TYPE_MESSAGE, f" Waiting for Player {turn + 1} to make their move...")
+
+
+def run_single_game(p1, p2, spectators, player_session, journal=None, game_id=None, resume=None, trace=tracing.NO_SPAN,
+                    rules=DEFAULT_RULES):
+    # Coalesce each player's messages into one send per turn or prompt (see utils.PacketWriter)
+    with corked(p1['wfile'], p2['wfile']):
+        return _run_single_game(p1, p2, spectators, player_session, journal, game_id, resume, trace, rules)
+
+
+def _run_single_game(p1, p2, spectators, player_session, journal=None, game_id=None, resume=None, trace=tracing.NO_SPAN,
+                     rules=DEFAULT_RULES):
+    try:
         print("[DEBUG] p1:", p1)
         print("[DEBUG] p2:", p2)
 
         players = [p1, p2]
+        if resume is not None:
+            turn = resume['turn']
+            resume_single_game(p1, p2, spectators, turn)
+            return play_turns(players, turn, spectators, player_session, journal, game_id, trace)
+
+        p1.pop("board", None)
+        p2.pop("board", None)
         turn = 0
         send_packet_message(p1['wfile'], PACKET_TYPE_MESSAGE, " Waiting for opponent to connect...")
         send_packet_message(p2['wfile'], PACKET_TYPE_MESSAGE, " Waiting for opponent to connect...")
-        if not setup_player_board(p1, p2):
+        with trace.child("setup_board", player=p1['player_id']):
+            ready = setup_player_board(p1, p2, rules)
+        if not ready:
             p1['conn'].close()
             p2['conn'].close()
             return False
 
-        if not setup_player_board(p2, p1):
+        with trace.child("setup_board", player=p2['player_id']):
+            ready = setup_player_board(p2, p1, rules)
+        if not ready:
             p1['conn'].close()
             p2['conn'].close()
             return False
 
-        send_own_board(p1['wfile'], p1['board'])
-        send_own_board(p2['wfile'], p2['board'])
+        sync_boards(p1, p2)
+        sync_boards(p2, p1)
 
         player1_id = p1['player_id']
         player2_id = p2['player_id']
-        for idx, (conn, rfile, wfile) in enumerate(spectators):
-            try:
-                send_packet_message(wfile, PACKET_TYPE_MESSAGE, f" [Spectator #{idx+1}] New game: {player1_id} vs {player2_id}")
-            except:
-                continue
+        broadcast_to_spectators(spectators, f"New game: {player1_id} vs {player2_id}")
         send_packet_message(p1['wfile'], PACKET_TYPE_MESSAGE, " Both players have placed their ships. Game starting...")
         send_packet_message(p2['wfile'], PACKET_TYPE_MESSAGE, " Both players have placed their ships. Game starting...")
         send_packet_message(p1['wfile'], PACKET_TYPE_MESSAGE, " Game started! You are Player 1.")
         send_packet_message(p2['wfile'], PACKET_TYPE_MESSAGE, " Game started! You are Player 2.")
         send_packet_message(p1['wfile'], PACKET_TYPE_MESSAGE, " You go first.")
         send_packet_message(p2['wfile'], PACKET_TYPE_MESSAGE, " Waiting for Player 1 to make their move...")
+        if journal:
+            journal.game_started(game_id, p1, p2)
+        return play_turns(players, turn, spectators, player_session, journal, game_id, trace)
+    except Exception as e:
+        print("[CRITICAL] run_single_game failed:", e)
+        traceback.print_exc()
+        return False
+
+
+def play_turns(players, turn, spectators, player_session, journal=None, game_id=None, trace=tracing.NO_SPAN):
+    """
+    The turn loop of a round, from `turn` until someone wins or leaves.
+    Each turn is a "turn" span under `trace`, split into prompt, read_input,
+    fire and send_board.
+    """
+    turns = 0
+    try:
         while True:
+            adopt_pending_reconnections(players, player_session)
             # Check both players are alive before each turn
             if not check_alive(players[0], players[1]) or not check_alive(players[1], players[0]):
                 return False
@@ -131,12 +310,21 @@ def run_single_game(p1, p2, spectators, player_session):
             current = players[turn]
             opponent = players[1 - turn]
 
-            send_board(current['wfile'], opponent['board'])
-            send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Your turn! Enter command (e.g. FIRE B5):")
+            turns += 1
+            turn_span = trace.child("turn", turn=turns, player=current['player_id'])
+            with turn_span.child("prompt"):
+                send_turn_board(current['wfile'], opponent['board'])
+                send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Your turn! Enter command (e.g. FIRE B5):")
+            turn_started = time.monotonic()
 
             try:
-                status, line = safe_readline_with_timeout(current, 15)
-                print(f"[DEBUG] readline status = {status}")
+                with turn_span.child("read_input"):
+                    if 'bot' in current:
+                        status, payload = "ok", current['bot'].command()
+                    else:
+                        status, payload = safe_read_payload_with_timeout(current, 15)
+                print(f"[DEBUG] read status = {status}")
+                turn_span.set(outcome=status)
 
                 if status == "closed":
                     print("[DEBUG] Entered status == closed")
@@ -147,45 +335,15 @@ def run_single_game(p1, p2, spectators, player_session):
 
                     if player_id in player_session:
                         send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected. Waiting for reconnection (60s)...")
-                        player_session[player_id]["status"] = "disconnected"
-                        player_session[player_id]["last_seen"] = time.time()
-
-                        for i in range(60):
-                            session = player_session.get(player_id)
-                            if not check_alive(opponent, current):
-                                print("[INFO] Opponent also disconnected. Ending game.")
-                                return False
-                            if session and session.get("status") == "reconnected":
-                                print(f"[INFO] Player {player_id} reconnected.")
-
-                                current["conn"] = session["conn"]
-                                current["rfile"] = session["rfile"]
-                                current["wfile"] = session["wfile"]
-                                current["player_id"] = player_id
-
-                                player_session[player_id]["conn"] = session["conn"]
-                                player_session[player_id]["rfile"] = session["rfile"]
-                                player_session[player_id]["wfile"] = session["wfile"]
-                                player_session[player_id]["status"] = "connected"
-
-                                try:
-                                    send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " You have reconnected successfully. Resuming game...")
-                                except:
-                                    print(f"[WARN] Failed to notify reconnected player {player_id}")
-
-                                try:
-                                    send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent has reconnected. Game will resume.")
-                                except:
-                                    print("[WARN] Failed to notify opponent about reconnection.")
-
-                                print(f"[INFO] Player {player_id} reconnected within 60s.")
-                                break  
-
-                            time.sleep(0.5)
-                        else:
+
+                        if not wait_for_reconnect(current, player_session):
                             send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent did not reconnect in time. Ending game.")
                             send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, "WIN")
                             return False
+                        if not check_alive(opponent, current):
+                            print("[INFO] Opponent also disconnected. Ending game.")
+                            return False
+                        notify_reconnected(current, opponent)
                         continue
                     else:
                         send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent ID missing. Ending game.")
@@ -194,38 +352,43 @@ def run_single_game(p1, p2, spectators, player_session):
                 elif status == "timeout":
                     send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Timeout occurred. Your turn was skipped.")
                     send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent timed out. Their turn was skipped.")
+                    if journal:
+                        journal.skipped(game_id, turn)
                     turn = 1 - turn
                     continue
-                pkt_type, checksum, payload = decode_packet(line)
-                if pkt_type is None:
-                    payload = line.strip()
-
                 if payload.lower() == 'quit':
                     print(f"[INFO] Player {player_id} sent 'quit'. Treating as disconnect.")
                     raise ConnectionResetError("Player quit")  #
 
 
-                if payload.upper().startswith("FIRE"):
-                    broadcast_to_spectators(spectators, f"Player {turn + 1} fired at {line.split()[1]}")
-
                 parts = payload.split()
                 if len(parts) != 2 or parts[0].upper() != "FIRE":
                     send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Invalid command. Use 'FIRE <coordinate>' (e.g. FIRE B2).")
                     continue
+                broadcast_to_spectators(spectators, f"Player {turn + 1} fired at {parts[1]}")
 
+                size = opponent['board'].size
                 try:
                     row, col = parse_coordinate(parts[1])
                 except Exception:
-                    send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Invalid coordinate format. Use A1–J10.")
+                    send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, f" Invalid coordinate format. Use {coordinate_range(size)}.")
                     send_packet_message(current['wfile'], PACKET_TYPE_RESULT, "INVALID")
                     continue
 
-                if not (0 <= row < 10 and 0 <= col < 10):
-                    send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Coordinate out of bounds. Use A1–J10.")
+                if not (0 <= row < size and 0 <= col < size):
+                    send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, f" Coordinate out of bounds. Use {coordinate_range(size)}.")
                     send_packet_message(current['wfile'], PACKET_TYPE_RESULT, "INVALID")
                     continue
 
-                result, sunk = opponent['board'].fire_at(row, col)
+                with turn_span.child("fire"):
+                    result, sunk = opponent['board'].fire_at(row, col)
+                if 'bot' in current:
+                    current['bot'].observe(row, col, result, sunk)
+                metrics.TURN_SECONDS.observe(time.monotonic() - turn_started)
+                turn_span.set(outcome=result)
+                if journal:
+                    journal.fired(game_id, turn, row, col, result, sunk)
+                send_span = turn_span.child("send_board")
 
                 if result == 'hit':
                     broadcast_to_spectators(spectators, "It was a HIT!")
@@ -245,6 +408,7 @@ def run_single_game(p1, p2, spectators, player_session):
                         send_packet_message(current['wfile'], PACKET_TYPE_RESULT, " You won the game!")
                         send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, " You lost the game.")
                         broadcast_to_spectators(spectators, f"Player {turn + 1} won the game!")
+                        send_span.end()
                         return True
                     else:
                         if sunk:
@@ -257,42 +421,125 @@ def run_single_game(p1, p2, spectators, player_session):
                 elif result == 'already_shot':
                     send_packet_message(current['wfile'], PACKET_TYPE_RESULT, " You already shot there.")
 
-                send_board(current['wfile'], opponent['board'])
+                send_move_result(players, turn, row, col, spectators)
+                send_span.end()
                 turn = 1 - turn
 
             except Exception:
                 send_packet_message(current['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected unexpectedly")
                 send_packet_message(current['wfile'], PACKET_TYPE_RESULT, "WIN")
                 return False
+            finally:
+                # Every way out of a turn (a shot, a timeout, bad input, a disconnect) ends its span
+                turn_span.end()
     except Exception as e:
-        print("[CRITICAL] run_single_game failed:", e)
+        print("[CRITICAL] play_turns failed:", e)
         traceback.print_exc()
         return False
 
 
+def coordinate_range(size):
+    """E.g. "A1–J10" for a 10x10 board, for prompts and error messages."""
+    return f"A1–{format_coordinate(size - 1, size - 1)}"
+
+
+def board_rows(board, hidden=False):
+    """
+    render_board_rows() for a Board, kept in board.views: only the rows
+    with a cell in board.changes since the last call are rendered again.
+    The list is shared; callers must not change it.
+    """
+    grid = board.hidden_grid if hidden else board.display_grid
+    seen, rows = board.views.get(('rows', hidden), (0, None))
+    if rows is None:
+        rows = render_board_rows(grid, board.size)
+    else:
+        for r in {r for r, _ in board.changes[seen:]}:
+            rows[r + 1] = render_row(board.size, r, grid[r])
+    board.views[('rows', hidden)] = (len(board.changes), rows)
+    return rows
+
+
+def board_payload(view, board, hidden=False):
+    """
+    encode_board() for a Board, from packed cells kept in board.views and
+    updated cell by cell from board.changes (an empty board packs to zeros).
+    """
+    grid = board.hidden_grid if hidden else board.display_grid
+    seen, packed = board.views.get(('packed', hidden), (0, None))
+    if packed is None:
+        packed = bytearray((board.size * board.size + 3) // 4)
+    for r, c in board.changes[seen:]:
+        pack_cell(packed, r * board.size + c, grid[r][c])
+    board.views[('packed', hidden)] = (len(board.changes), packed)
+    return encode_packed_board(view, board.size, packed)
+
+
 def send_board(wfile, board):
     # Send the opponent's board view to the player (only hits and misses are visible)
+    if speaks_v2(wfile):
+        send_packet_message(wfile, PACKET_TYPE_BOARD, board_payload(VIEW_OPPONENT, board))
+        return
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Opponent's board:")
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, "GRID_OPPONENT")
-    send_packet_message(wfile, PACKET_TYPE_MESSAGE, "  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)))
-    for r in range(board.size):
-        row_label = chr(ord('A') + r)
-        row_str = " ".join(board.display_grid[r][c] for c in range(board.size))
-        send_packet_message(wfile, PACKET_TYPE_MESSAGE, f"{row_label:2} {row_str}")
+    for row in board_rows(board):
+        send_packet_message(wfile, PACKET_TYPE_MESSAGE, row)
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, " End of board")
 
 def send_own_board(wfile, board):
     # Send the player's full board including ship positions
+    if speaks_v2(wfile):
+        send_packet_message(wfile, PACKET_TYPE_BOARD, board_payload(VIEW_SELF, board, hidden=True))
+        return
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Your board:")
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, "GRID_SELF")
-    send_packet_message(wfile, PACKET_TYPE_MESSAGE, "  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)))
-    for r in range(board.size):
-        row_label = chr(ord('A') + r)
-        row_str = " ".join(board.hidden_grid[r][c] for c in range(board.size))
-        send_packet_message(wfile, PACKET_TYPE_MESSAGE, f"{row_label:2} {row_str}")
+    for row in board_rows(board, hidden=True):
+        send_packet_message(wfile, PACKET_TYPE_MESSAGE, row)
     send_packet_message(wfile, PACKET_TYPE_MESSAGE, " End of board")
 
-def setup_player_board(player, opponent):
+def sync_boards(player, opponent):
+    """
+    Send a player both boards in full. Text (v1) clients only get their own:
+    they are shown the opponent's board at every turn anyway.
+    """
+    send_own_board(player['wfile'], player['board'])
+    if speaks_v2(player['wfile']):
+        send_board(player['wfile'], opponent['board'])
+
+def send_turn_board(wfile, board):
+    # v2 clients keep the opponent board up to date from deltas; only v1 clients are sent it each turn
+    if not speaks_v2(wfile):
+        send_board(wfile, board)
+
+def send_move_result(players, turn, row, col, spectators):
+    """
+    Show the board that was just fired at. A v1 shooter gets the whole
+    opponent board again; v2 clients keep their own copies, so the shooter
+    and the target each get the one changed cell. v2 spectators get the
+    board as a snapshot frame (what the conflate policy skips ahead to).
+    """
+    current, opponent = players[turn], players[1 - turn]
+    board = opponent['board']
+    if speaks_v2(current['wfile']):
+        send_packet_message(current['wfile'], PACKET_TYPE_DELTA,
+                            encode_delta(VIEW_OPPONENT, [(row, col, board.display_grid[row][col])]))
+    else:
+        send_board(current['wfile'], board)
+    if speaks_v2(opponent['wfile']):
+        send_packet_message(opponent['wfile'], PACKET_TYPE_DELTA,
+                            encode_delta(VIEW_SELF, [(row, col, board.hidden_grid[row][col])]))
+    publish_board_snapshot(spectators, board, 1 - turn)
+
+def publish_board_snapshot(spectators, board, owner):
+    # Text spectators only follow the commentary, so their encoding of this frame is empty
+    payload = board_payload(f"player{owner + 1}", board)
+    spectators.publish_frame((b"", encode_frame(PACKET_TYPE_BOARD, payload)), snapshot=True)
+
+def setup_player_board(player, opponent, rules=DEFAULT_RULES):
+    if 'bot' in player:
+        # A computer player (bot.DensityBot) places its own fleet
+        player['board'] = player['bot'].new_round(rules)
+        return True
     try:
         wfile = player['wfile']
         rfile = player['rfile']
@@ -303,47 +550,38 @@ def setup_player_board(player, opponent):
         send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Setting up your board...")
         send_packet_message(wfile, PACKET_TYPE_MESSAGE, "Place ships manually (M) or randomly (R)? [M/R]  (timeout in 15s):")
 
-        status, choice_line = safe_readline_with_timeout(player, 15)
+        status, payload = safe_read_payload_with_timeout(player, 15)
         if status != "ok":
             send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected during setup (timeout or quit)")
             send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, "WIN")
             return False
         
 
-        board = Board()
-        pkt_type, checksum, payload = decode_packet(choice_line)
-        if pkt_type is None:
-            payload = choice_line.strip()
+        board = Board(rules['size'])
 
         choice = payload.strip().upper()
         if choice == 'M':
-            for ship_name, ship_size in SHIPS:
+            for ship_name, ship_size in rules['fleet']:
                 while True:
                     if not check_alive(player, opponent):
                         return False
                     send_packet_message(wfile, PACKET_TYPE_MESSAGE, f" Placing {ship_name} (size {ship_size})")
-                    send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Enter starting coordinate (e.g. A1):")
+                    send_packet_message(wfile, PACKET_TYPE_MESSAGE, f" Enter starting coordinate ({coordinate_range(board.size)}):")
 
-                    status, coord_line = safe_readline_with_timeout(player, 30)
+                    status, coord_payload = safe_read_payload_with_timeout(player, 30)
                     if status != "ok":
                         send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected during setup")
                         send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, "WIN")
                         return False
 
-                    pkt_type, checksum, coord_payload = decode_packet(coord_line)
-                    if pkt_type is None:
-                        coord_payload = coord_line.strip()
                     coord_str = coord_payload.strip()
                     send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Enter orientation (H for horizontal, V for vertical):")
 
-                    status, orient_line = safe_readline_with_timeout(player, 30)
+                    status, orient_payload = safe_read_payload_with_timeout(player, 30)
                     if status != "ok":
                         send_packet_message(opponent['wfile'], PACKET_TYPE_MESSAGE, " Opponent disconnected during setup")
                         send_packet_message(opponent['wfile'], PACKET_TYPE_RESULT, "WIN")
                         return False
-                    pkt_type, checksum, orient_payload = decode_packet(orient_line)
-                    if pkt_type is None:
-                        orient_payload = orient_line.strip()
                     orientation_str = orient_payload.strip().upper()
                     try:
                         row, col = parse_coordinate(coord_str)
@@ -352,19 +590,15 @@ def setup_player_board(player, opponent):
                             send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Invalid orientation. Please enter H or V.")
                             continue
 
-                        if board.can_place_ship(row, col, ship_size, orientation):
-                            positions = board.do_place_ship(row, col, ship_size, orientation)
-                            board.placed_ships.append({
-                                'name': ship_name,
-                                'positions': positions
-                            })
+                        if (0 <= row < board.size and 0 <= col < board.size
+                                and board.place_ship(ship_name, row, col, ship_size, orientation)):
                             break
                         else:
                             send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Invalid position. Try again.")
                     except Exception as e:
                         send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Error: Invalid input. Please try again.")
         else:
-            board.place_ships_randomly(SHIPS)
+            board.place_ships_randomly(rules['fleet'])
             send_packet_message(wfile, PACKET_TYPE_MESSAGE, " Ships placed randomly.")
 
         player['board'] = board
@@ -376,17 +610,17 @@ def setup_player_board(player, opponent):
         return False
 
 def ask_play_again(player):
+    if 'bot' in player:
+        return True  # a bot plays for as long as its opponent wants to
     try:
         send_packet_message(player['wfile'], PACKET_TYPE_MESSAGE, " Play again? (Y/N)")
-        status, line = safe_readline_with_timeout(player, 30)
+        status, payload = safe_read_payload_with_timeout(player, 30)
 
         if status == "timeout":
             send_packet_message(player['wfile'], PACKET_TYPE_MESSAGE, " Timeout. Assuming No.")
             return False
-
-        pkt_type, checksum, payload = decode_packet(line)
-        if pkt_type is None:
-            payload = line.strip()  # fallback for legacy
+        if status == "closed":
+            return False
 
         response = payload.strip().lower()
         if response == 'y':
@@ -0,0 +1,71 @@
+"""
+group_commit.py
+
+Batching writer shared by the game journal and the trace exporter.
+
+Callers on any thread only append to an in-memory batch; one background
+thread waits `interval` for more to arrive, then hands everything that has
+accumulated to commit(batch) in a single call. Writing and syncing once per
+batch instead of once per record is what keeps both off the game threads'
+critical path.
+"""
+
+import threading
+import time
+
+
+class GroupCommitWriter:
+    """
+    Appends items to a batch and commits batches from a daemon thread.
+    commit(batch) runs on that thread with `committing` held; an OSError
+    from it is reported as "[ERROR] <label> failed" and the batch dropped.
+    """
+
+    def __init__(self, commit, interval, name, label):
+        self.commit = commit
+        self.interval = interval
+        self.label = label
+        self.committing = threading.Lock()
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._hurry = threading.Event()
+        self._pending = []
+        self._writing = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def append(self, item):
+        with self._lock:
+            self._pending.append(item)
+            if len(self._pending) == 1:
+                self._has_work.notify()  # the writer only sleeps on an empty batch
+
+    def flush(self, timeout=1.0):
+        """Commit the current batch now and wait until everything appended so far is committed."""
+        deadline = time.time() + timeout
+        self._hurry.set()
+        while time.time() < deadline:
+            with self._lock:
+                if not self._pending and not self._writing:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._has_work.wait_for(lambda: self._pending)
+            # Group commit: give other threads a moment to add to this batch
+            self._hurry.wait(self.interval)
+            self._hurry.clear()
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._writing = True
+            try:
+                with self.committing:
+                    self.commit(batch)
+            except OSError as e:
+                print(f"[ERROR] {self.label} failed: {e}")
+            finally:
+                with self._lock:
+                    self._writing = False
@@ -0,0 +1,173 @@
+"""
+handshake.py
+
+Reads the "ID <player_id>" line of new (or promoted) connections off the
+accept thread.
+
+One background thread watches every socket that still owes its ID line with
+a selector. Each connection has a deadline; a client that is too slow, sends
+garbage or sends an over-long line is dropped without holding anyone else up.
+Bytes are taken from the socket only up to the end of the ID line, so the
+connection's makefile() readers see everything the client sent after it.
+"""
+
+import heapq
+import selectors
+import socket
+import threading
+import time
+
+HANDSHAKE_TIMEOUT = 10
+MAX_ID_LINE = 256
+
+
+class _Pending:
+    def __init__(self, conn, on_ready, on_fail, deadline, skip=None):
+        self.conn = conn
+        self.on_ready = on_ready
+        self.on_fail = on_fail
+        self.skip = skip
+        self.deadline = deadline
+        self.buffer = b""
+        self.done = False
+
+
+class HandshakeStage:
+    """
+    submit(conn, on_ready) hands a connected socket to the stage. Once a full
+    line arrives, on_ready(conn, id_line) runs on the stage thread (so it must
+    not block for long). If the line is missing, malformed or late, on_fail(conn)
+    runs instead; by default the connection is closed.
+
+    For a connection that was already talking, skip(data) is given the bytes
+    waiting in front of the line and returns how many of them belong to
+    packets sent before it (None: wait for the rest); those are discarded.
+    """
+
+    def __init__(self, timeout=HANDSHAKE_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self._deadlines = []    # (deadline, seq, _Pending), popped lazily
+        self._seq = 0
+        self._submitted = []
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self.completed = 0
+        self.failed = 0
+        threading.Thread(target=self._run, name="handshake", daemon=True).start()
+
+    def __len__(self):
+        return len(self.selector.get_map()) - 1
+
+    def submit(self, conn, on_ready, on_fail=None, timeout=None, skip=None):
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        pending = _Pending(conn, on_ready, on_fail, deadline, skip)
+        with self.lock:
+            self._submitted.append(pending)
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wake-up is already pending
+
+    # ------------------------------------------------------------------
+    # Stage thread
+    # ------------------------------------------------------------------
+
+    def _finish(self, pending, id_line):
+        pending.done = True
+        try:
+            self.selector.unregister(pending.conn)
+        except (KeyError, ValueError):
+            pass
+        if id_line is not None and id_line.startswith("ID ") and id_line.strip() != "ID":
+            self.completed += 1
+            callback, args = pending.on_ready, (pending.conn, id_line)
+        else:
+            self.failed += 1
+            callback, args = pending.on_fail or _close, (pending.conn,)
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[ERROR] Handshake callback failed: {e}")
+            _close(pending.conn)
+
+    def _read(self, pending):
+        """Consume available bytes up to (and including) the first newline."""
+        try:
+            data = pending.conn.recv(MAX_ID_LINE, socket.MSG_PEEK)
+            if not data:
+                self._finish(pending, None)  # closed before sending an ID
+                return
+            if pending.skip is not None and not pending.buffer:
+                count = pending.skip(data)
+                if count is None:
+                    return
+                if count:
+                    pending.conn.recv(count)
+                    data = data[count:]
+                    if not data:
+                        return
+            end = data.find(b"\n")
+            count = len(data) if end < 0 else end + 1
+            pending.buffer += pending.conn.recv(count)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._finish(pending, None)
+            return
+        if pending.buffer.endswith(b"\n"):
+            self._finish(pending, pending.buffer.decode(errors='replace'))
+        elif len(pending.buffer) >= MAX_ID_LINE:
+            print("[WARN] ID line too long; dropping connection.")
+            self._finish(pending, None)
+
+    def _adopt_submitted(self):
+        with self.lock:
+            submitted, self._submitted = self._submitted, []
+        for pending in submitted:
+            try:
+                self.selector.register(pending.conn, selectors.EVENT_READ, pending)
+            except (KeyError, ValueError, OSError):
+                self._finish(pending, None)
+                continue
+            self._seq += 1
+            heapq.heappush(self._deadlines, (pending.deadline, self._seq, pending))
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, pending = heapq.heappop(self._deadlines)
+            if not pending.done:
+                print("[WARN] Handshake timed out; dropping connection.")
+                self._finish(pending, None)
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._deadlines:
+                timeout = max(0.0, self._deadlines[0][0] - time.time())
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                if not key.data.done:
+                    self._read(key.data)
+            self._adopt_submitted()
+            self._expire(time.time())
+            # Finished entries stay in the heap until their deadline; drop them early if they pile up
+            if len(self._deadlines) > 2 * len(self) + 64:
+                self._deadlines = [entry for entry in self._deadlines if not entry[2].done]
+                heapq.heapify(self._deadlines)
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except OSError:
+        pass
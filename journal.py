@@ -0,0 +1,229 @@
+"""
+journal.py
+
+Append-only journal of games in progress, so a server crash or restart does
+not lose them.
+
+Records are JSON lines:
+  {"t": "start", "game": id, "players": [id1, id2], "turn": 0, "size": 10, "ships": [[ship, ...], [ship, ...]]}
+  {"t": "fire",  "game": id, "shooter": 0|1, "row": r, "col": c, "result": "hit", "sunk": null}
+  {"t": "skip",  "game": id, "shooter": 0|1}
+  {"t": "end",   "game": id}
+where each ship is {"name": ..., "positions": [[r, c], ...]} as placed. Records
+from before boards had a size (no "size") are 10x10.
+
+Writes use group commit (group_commit.GroupCommitWriter): game threads only
+append to an in-memory batch; one writer thread writes whatever has
+accumulated, then fsyncs once for the whole batch (across all games). A move therefore never waits for the disk;
+the price is that a crash can lose the last commit_interval of moves.
+
+The writer also keeps the records of games still running. When the file
+grows past max_bytes it is rewritten with just those records, so the
+journal stays proportional to the number of live games.
+"""
+
+import json
+import os
+import threading
+
+from battleship import Board, BOARD_SIZE
+from group_commit import GroupCommitWriter
+
+COMMIT_INTERVAL = 0.005
+MAX_BYTES = 16 * 1024 * 1024
+# Restored games whose players do not both come back within this window are dropped
+RECOVERY_TTL = 120
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+class GameJournal:
+    def __init__(self, path, commit_interval=COMMIT_INTERVAL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_bytes = max_bytes
+        self._live = {}     # game id -> [record line, ...] of unfinished games
+        self._unrecorded = set()  # ids of games against a bot (see game_started)
+        self._file = open(path, 'a', encoding='utf-8')
+        self.commits = 0
+        self.records = 0
+        self._writer = GroupCommitWriter(self._commit, commit_interval, "game-journal", "Journal write")
+
+    # ------------------------------------------------------------------
+    # Recording (called from game threads; never touches the disk)
+    # ------------------------------------------------------------------
+
+    def _append(self, record):
+        self._writer.append(record)
+
+    def game_started(self, game_id, p1, p2, turn=0):
+        if 'bot' in p1 or 'bot' in p2:
+            # A bot cannot come back after a restart, so there is nothing to resume
+            self._unrecorded.add(game_id)
+            return
+        ships = [
+            [{'name': ship['name'], 'positions': sorted(ship['positions'])} for ship in p['board'].placed_ships]
+            for p in (p1, p2)
+        ]
+        self._append({'t': 'start', 'game': game_id, 'players': [p1['player_id'], p2['player_id']],
+                      'turn': turn, 'size': p1['board'].size, 'ships': ships})
+
+    def fired(self, game_id, shooter, row, col, result, sunk):
+        if game_id in self._unrecorded:
+            return
+        self._append({'t': 'fire', 'game': game_id, 'shooter': shooter, 'row': row, 'col': col,
+                      'result': result, 'sunk': sunk})
+
+    def skipped(self, game_id, shooter):
+        if game_id in self._unrecorded:
+            return
+        self._append({'t': 'skip', 'game': game_id, 'shooter': shooter})
+
+    def game_ended(self, game_id):
+        if game_id in self._unrecorded:
+            self._unrecorded.discard(game_id)
+            return
+        self._append({'t': 'end', 'game': game_id})
+
+    def flush(self, timeout=1.0):
+        """Wait until everything appended so far is on disk."""
+        return self._writer.flush(timeout)
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+
+    def _commit(self, batch):
+        lines = []
+        for record in batch:
+            line = _encoder.encode(record) + '\n'
+            lines.append(line)
+            game_id = record['game']
+            if record['t'] == 'end':
+                self._live.pop(game_id, None)
+            else:
+                self._live.setdefault(game_id, []).append(line)
+        self._file.write(''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.commits += 1
+        self.records += len(batch)
+        if self._file.tell() > self.max_bytes:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the journal with only the records of unfinished games."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            for lines in self._live.values():
+                tmp.write(''.join(lines))
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def seed(self, games):
+        """Carry recovered games over into a freshly compacted journal."""
+        with self._writer.committing:
+            for game_id, game in games.items():
+                self._live[game_id] = [_encoder.encode(r) + '\n' for r in game['records']]
+            self._compact()
+
+
+def load_unfinished_games(path):
+    """
+    Read a journal and rebuild every game that has no 'end' record.
+    Returns {game_id: {'players': [id1, id2], 'boards': [Board, Board],
+                       'rules': {'size', 'fleet'} the game was started with,
+                       'turn': index of the player to move, 'records': [...]}}.
+    A torn last line from a crash mid-write is ignored.
+    """
+    games = {}
+    if not os.path.exists(path):
+        return games
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            game_id = record.get('game')
+            kind = record.get('t')
+            if kind == 'start':
+                boards = []
+                size = record.get('size', BOARD_SIZE)
+                for ships in record['ships']:
+                    board = Board(size)
+                    for ship in ships:
+                        board.add_ship(ship['name'], (tuple(pos) for pos in ship['positions']))
+                    boards.append(board)
+                fleet = [(ship['name'], len(ship['positions'])) for ship in record['ships'][0]]
+                games[game_id] = {'players': record['players'], 'boards': boards,
+                                  'rules': {'size': size, 'fleet': fleet},
+                                  'turn': record.get('turn', 0), 'records': [record]}
+            elif game_id in games:
+                game = games[game_id]
+                if kind == 'end':
+                    del games[game_id]
+                    continue
+                if kind == 'fire':
+                    game['boards'][1 - record['shooter']].fire_at(record['row'], record['col'])
+                game['turn'] = 1 - record['shooter']
+                game['records'].append(record)
+    return games
+
+
+class RestoredGames:
+    """
+    Games recovered at startup, waiting for both players to reconnect.
+    arrive() records a returning player and hands back the game once both
+    are present; release() ends the recovery window and returns the players
+    whose opponent never came back (and the games it dropped).
+    """
+
+    def __init__(self, games):
+        self._lock = threading.Lock()
+        self.by_player = {}
+        for game_id, game in games.items():
+            game['game_id'] = game_id
+            game['present'] = {}
+            for player_id in game['players']:
+                self.by_player[player_id] = game
+
+    def __contains__(self, player_id):
+        return player_id in self.by_player
+
+    def __len__(self):
+        return len(self.by_player)
+
+    def arrive(self, player_id, player):
+        """
+        Register a returning player (whatever the server uses to hold their
+        connection). Returns the game when both players are present, else None.
+        """
+        with self._lock:
+            game = self.by_player.get(player_id)
+            if game is None:
+                return None
+            game['present'][player_id] = player
+            if len(game['present']) < 2:
+                return None
+            for pid in game['players']:
+                self.by_player.pop(pid, None)
+            return game
+
+    def release(self):
+        """
+        Drop every game still waiting. Returns (players that did come back,
+        ids of the dropped games); the caller ends those games in the
+        journal, or they would be recovered again on every restart.
+        """
+        with self._lock:
+            stranded = []
+            dropped = []
+            for game in {id(g): g for g in self.by_player.values()}.values():
+                stranded.extend(game['present'].values())
+                dropped.append(game['game_id'])
+            self.by_player.clear()
+            return stranded, dropped
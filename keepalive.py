@@ -0,0 +1,133 @@
+"""
+keepalive.py
+
+Heartbeats for every connection the server holds (players, waiting players
+and spectators), replacing the PING the game loop used to write before
+every turn.
+
+Every KEEPALIVE_INTERVAL seconds the server sends each connection a
+"PING <seq>" control packet; clients answer "PONG <seq>". A Keepalive
+matches the answers to the time each ping was sent and keeps a smoothed
+round-trip time per connection (the same 7/8 filter TCP uses for SRTT).
+A connection that leaves KEEPALIVE_MISSES pings in a row unanswered is
+reported for eviction. Clients that never answered any ping (written
+before PONG existed) are not evicted; TCP keepalive (enable_tcp_keepalive)
+covers those.
+
+This module only does the bookkeeping; the threaded server drives it from
+one thread and the asyncio server from one task (see server.py and
+async_server.py).
+"""
+
+import socket
+import threading
+import time
+
+import metrics
+
+KEEPALIVE_INTERVAL = 5.0
+KEEPALIVE_MISSES = 3
+
+
+class Peer:
+    """Heartbeat state of one connection."""
+
+    __slots__ = ("name", "outstanding", "answered", "rtt", "srtt")
+
+    def __init__(self, name):
+        self.name = name
+        self.outstanding = 0    # pings sent since the last answer
+        self.answered = False   # the client knows PONG
+        self.rtt = None         # last sample, seconds
+        self.srtt = None        # smoothed
+
+
+class Keepalive:
+    """
+    Matches PONGs to PINGs for many connections:
+      - peers: {<connection key>: Peer}
+      - sent: {<seq>: monotonic time the ping went out}; one ping (and seq)
+        per interval is shared by all connections, so spectators can get it
+        through their game's fan-out
+    """
+
+    def __init__(self, interval=KEEPALIVE_INTERVAL, misses=KEEPALIVE_MISSES):
+        self.interval = interval
+        self.misses = misses
+        self.lock = threading.Lock()
+        self.peers = {}
+        self.sent = {}
+        self.seq = 0
+
+    def next_ping(self) -> str:
+        """Payload of this round's ping."""
+        now = time.monotonic()
+        with self.lock:
+            self.seq += 1
+            self.sent[self.seq] = now
+            # An answer later than every miss allows is no longer interesting
+            oldest = self.seq - self.misses - 1
+            for seq in [s for s in self.sent if s < oldest]:
+                del self.sent[seq]
+            return f"PING {self.seq}"
+
+    def pinged(self, key, name) -> bool:
+        """
+        Record that key is being pinged. Returns True if it has missed too
+        many pings in a row and should be evicted instead.
+        """
+        with self.lock:
+            peer = self.peers.get(key)
+            if peer is None:
+                peer = self.peers[key] = Peer(name)
+            if peer.answered and peer.outstanding >= self.misses:
+                del self.peers[key]
+                return True
+            peer.outstanding += 1
+            return False
+
+    def pong(self, key, payload: str):
+        """Handle "PONG <seq>" from key."""
+        now = time.monotonic()
+        try:
+            seq = int(payload.split()[1])
+        except (IndexError, ValueError):
+            return
+        with self.lock:
+            peer = self.peers.get(key)
+            sent = self.sent.get(seq)
+            if peer is None or sent is None:
+                return
+            peer.answered = True
+            peer.outstanding = 0
+            rtt = peer.rtt = now - sent
+            peer.srtt = rtt if peer.srtt is None else peer.srtt + (rtt - peer.srtt) / 8
+        metrics.RTT_SECONDS.observe(rtt)
+
+    def rtt(self, key):
+        """Smoothed round-trip time of key in seconds, or None before its first answer."""
+        peer = self.peers.get(key)
+        return peer.srtt if peer is not None else None
+
+    def retain(self, keys):
+        """Forget connections that are gone (not in keys)."""
+        with self.lock:
+            for key in [k for k in self.peers if k not in keys]:
+                del self.peers[key]
+
+    def evicted(self, name):
+        metrics.HEARTBEAT_EVICTIONS.inc()
+        print(f"[WARN] {name} missed {self.misses} heartbeats; disconnecting.")
+
+
+def enable_tcp_keepalive(sock, idle=KEEPALIVE_INTERVAL, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_MISSES):
+    """
+    Let the kernel probe an idle connection too: after `idle` seconds
+    without traffic, every `interval` seconds, giving up after `count`
+    probes. The timing options are Linux names; elsewhere only
+    SO_KEEPALIVE is set.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), max(1, int(value)))
@@ -0,0 +1,420 @@
+"""
+loadgen.py
+
+Headless load generator for a running server: many scripted clients that
+speak the real protocol (v1 text or v2 frames), each on its own asyncio
+connection. A client
+  - sends its ID line (and reads the PROTO reply on v2)
+  - answers the [M/R] prompt with R and fires at random unshot cells
+  - answers PINGs, SEND-ID (spectator promotion) and "Play again?"
+    (Y until it has played --rounds rounds, then N)
+  - with --reconnect, drops its connection on one of its turns in that
+    share of games and comes back with the same ID
+Whether a client plays or watches is up to the server, as for client.py:
+beyond 2 x --max-games, clients are spectators until promoted.
+
+Reports games/sec (finished games, bot games included; see
+games_finished), turn latency (FIRE sent until the shot's board, delta
+or result arrives), handshake latency (connect until the first packet
+after the ID line), reconnect latency and error counts. The run ends when
+every client has finished, when only clients waiting for an opponent or
+watching are left, or after --duration seconds.
+
+Usage:
+    python loadgen.py [--host 127.0.0.1] [--port 5000] [--clients 200] [--proto 1|2|mix]
+                      [--rounds 1] [--ramp 200] [--reconnect 0.1] [--processes 4] [--json PATH]
+
+Thousands of clients need as many file descriptors (ulimit -n); with
+--processes the clients are split across that many processes.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+
+from battleship import BOARD_SIZE, format_coordinate
+from utils import (
+    decode_packet,
+    encode_for,
+    frame_intact,
+    header_intact,
+    parse_proto_ack,
+    V2_HEADER,
+    V2_SEQ,
+    FLAG_SEQ,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    INTEGRITY_NONE,
+    INTEGRITY_CRC32,
+    PACKET_TYPE_COMMAND,
+    PACKET_TYPE_RESULT,
+    PACKET_TYPE_CONTROL,
+    PACKET_TYPE_BOARD,
+    PACKET_TYPE_DELTA,
+)
+
+# The run stops once no client has been connecting or playing for this long
+IDLE_GRACE = 3.0
+# Turns into a game after which a --reconnect client may drop its connection
+RECONNECT_TURNS = 10
+
+
+class Stats:
+    """What one process's clients saw; merged across processes for the report."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.turn_latency = []
+        self.handshake = []
+        self.reconnect = []
+
+    def as_dict(self):
+        return {'counts': dict(self.counts), 'turn_latency': self.turn_latency,
+                'handshake': self.handshake, 'reconnect': self.reconnect}
+
+    def merge(self, data):
+        self.counts.update(data['counts'])
+        self.turn_latency += data['turn_latency']
+        self.handshake += data['handshake']
+        self.reconnect += data['reconnect']
+
+
+class ScriptedClient:
+    """One connection's script. state is connecting, queued, spectating, playing or done."""
+
+    def __init__(self, player_id, proto, args, stats, rng):
+        self.player_id = player_id
+        self.proto = proto
+        self.integrity = args.integrity
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.state = 'connecting'
+        self.rounds_left = args.rounds
+        self.reader = self.writer = None
+        self.fired_at = None
+        self.drop_at = None  # turn of the current game on which to drop the connection
+        self.vs_bot = False  # the server seated a computer opponent, which reports no result of its own
+        self.turn = 0
+        self.new_game(args.board_size)
+
+    def new_game(self, size):
+        self.size = size
+        self.shots = [format_coordinate(r, c) for r in range(size) for c in range(size)]
+        self.rng.shuffle(self.shots)
+        self.turn = 0
+        self.drop_at = self.rng.randint(1, RECONNECT_TURNS) if self.rng.random() < self.args.reconnect else None
+
+    # ------------------------------------------------------------------
+    # Wire
+    # ------------------------------------------------------------------
+
+    async def connect(self):
+        """Open a connection and send the ID line; returns when the handshake finished."""
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        if self.proto == PROTOCOL_V2:
+            self.writer.write(f"ID {self.player_id} proto=2 integrity={self.integrity}\n".encode())
+            ack = await self.reader.readline()
+            if parse_proto_ack(ack.decode(errors='replace')) is None:
+                raise ConnectionError("server did not accept protocol v2")
+        else:
+            self.writer.write(f"ID {self.player_id}\n".encode())
+        await self.writer.drain()
+
+    def send(self, pkt_type, payload):
+        self.writer.write(encode_for(self.proto, pkt_type, payload, self.integrity))
+
+    async def read_packet(self):
+        """(type, payload), (None, "") for a corrupted packet, or None at end of stream."""
+        try:
+            if self.proto == PROTOCOL_V1:
+                line = await self.reader.readline()
+                if not line:
+                    return None
+                pkt_type, _, payload = decode_packet(line.decode(errors='replace'))
+                if pkt_type is None:
+                    self.stats.counts['checksum failures'] += 1
+                    return None, ""
+                return pkt_type, payload
+            header = bytearray(await self.reader.readexactly(V2_HEADER.size))
+            if not header_intact(header):
+                self.stats.counts['checksum failures'] += 1
+                while not header_intact(header):  # the next frame starts at some later byte
+                    del header[0]
+                    header += await self.reader.readexactly(1)
+            pkt_type, flags, length, _, _ = V2_HEADER.unpack(header)
+            prefix = await self.reader.readexactly(V2_SEQ.size) if flags & FLAG_SEQ else b""
+            data = await self.reader.readexactly(length)
+            if not frame_intact(header, prefix, data):
+                self.stats.counts['checksum failures'] += 1
+                return None, ""
+            return pkt_type, data.decode(errors='replace')
+        except asyncio.IncompleteReadError:
+            return None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    # ------------------------------------------------------------------
+    # Script
+    # ------------------------------------------------------------------
+
+    async def run(self):
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            await self.connect()
+            packet = await asyncio.wait_for(self.read_packet(), self.args.idle_timeout)
+            stats.handshake.append(time.perf_counter() - start)
+            while packet is not None:
+                if not await self.handle(*packet):
+                    return
+                packet = await asyncio.wait_for(self.read_packet(), self.args.idle_timeout)
+            stats.counts['disconnected by server'] += 1
+        except asyncio.TimeoutError:
+            stats.counts[f'stalled ({self.state})'] += 1
+        except (ConnectionError, OSError) as e:
+            stats.counts[f'{"connect" if self.state == "connecting" else "connection"} errors'] += 1
+            if self.args.verbose:
+                print(f"[WARN] {self.player_id}: {e!r}")
+        finally:
+            self.state = 'done'
+            self.close()
+
+    async def answer(self, pkt_type, payload):
+        if self.args.think:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.args.think))
+        self.send(pkt_type, payload)
+
+    async def handle(self, pkt_type, payload):
+        """React to one packet; False once the client is finished."""
+        stats = self.stats
+        if pkt_type == PACKET_TYPE_CONTROL and payload.startswith("PING"):
+            self.send(PACKET_TYPE_CONTROL, "PONG" + payload[4:])
+            return True
+        if payload == "SEND-ID":
+            stats.counts['promotions'] += 1
+            self.state = 'queued'
+            self.writer.write(f"ID {self.player_id}\n".encode())  # ID lines are text in both versions
+            return True
+
+        if self.fired_at is not None and (
+                (pkt_type == PACKET_TYPE_DELTA and payload.startswith("opponent"))
+                or payload == " End of board"
+                or (pkt_type == PACKET_TYPE_RESULT and "won the game" in payload)):
+            stats.turn_latency.append(time.perf_counter() - self.fired_at)
+            stats.counts['turns'] += 1
+            self.fired_at = None
+
+        if self.state == 'spectating':
+            if pkt_type == PACKET_TYPE_BOARD or payload.startswith("[Spectator]"):
+                stats.counts['spectator frames'] += 1
+            return True
+        if "Spectator mode" in payload:
+            stats.counts['spectators'] += 1
+            self.state = 'spectating'
+        elif "Waiting for a match" in payload or "Waiting for a new opponent" in payload:
+            self.state = 'queued'
+            self.vs_bot = False
+        elif "You will play the computer" in payload:
+            self.vs_bot = True
+        elif pkt_type == PACKET_TYPE_BOARD and payload.startswith("self"):
+            size = int(payload.split()[1])
+            if size != self.size and self.turn == 0:
+                self.new_game(size)
+        elif "[M/R]" in payload:
+            self.state = 'playing'
+            await self.answer(PACKET_TYPE_COMMAND, "R")
+        elif "Your turn!" in payload:
+            self.state = 'playing'
+            self.turn += 1
+            if self.turn == self.drop_at:
+                self.drop_at = None
+                return await self.reconnect()
+            if not self.shots:
+                stats.counts['out of shots'] += 1
+                return False
+            await self.answer(PACKET_TYPE_COMMAND, f"FIRE {self.shots.pop()}")
+            self.fired_at = time.perf_counter()
+        elif pkt_type == PACKET_TYPE_RESULT and "won the game" in payload:
+            stats.counts['games won'] += 1
+            if self.vs_bot:
+                stats.counts['games vs bot'] += 1
+        elif pkt_type == PACKET_TYPE_RESULT and "lost the game" in payload:
+            stats.counts['games lost'] += 1
+            if self.vs_bot:
+                stats.counts['games vs bot'] += 1
+        elif pkt_type == PACKET_TYPE_RESULT and payload == "WIN":
+            stats.counts['won by forfeit'] += 1
+        elif pkt_type == PACKET_TYPE_RESULT and payload == "INVALID":
+            stats.counts['invalid moves'] += 1
+        elif "Timeout occurred" in payload:
+            stats.counts['turn timeouts'] += 1
+        elif "Play again?" in payload:
+            self.rounds_left -= 1
+            self.new_game(self.size)
+            if self.rounds_left > 0:
+                await self.answer(PACKET_TYPE_COMMAND, "Y")
+            else:
+                self.send(PACKET_TYPE_COMMAND, "N")
+                stats.counts['sessions finished'] += 1
+                return False
+        elif "Session ended" in payload or "Both players declined" in payload:
+            stats.counts['sessions finished'] += 1
+            return False
+        return True
+
+    async def reconnect(self):
+        """Drop the connection in the middle of our turn and come back with the same ID."""
+        stats = self.stats
+        self.close()
+        await asyncio.sleep(self.args.reconnect_delay)
+        start = time.perf_counter()
+        await self.connect()
+        while True:
+            packet = await asyncio.wait_for(self.read_packet(), self.args.idle_timeout)
+            if packet is None:
+                stats.counts['reconnects failed'] += 1
+                return False
+            if "reconnected successfully" in packet[1]:
+                stats.reconnect.append(time.perf_counter() - start)
+                stats.counts['reconnects'] += 1
+                return True
+            if not await self.handle(*packet):
+                return False
+
+
+async def run_clients(args, first, count):
+    """Run clients first .. first + count - 1 at args.ramp connections/sec; returns their Stats."""
+    stats = Stats()
+    rng = random.Random(args.seed + first if args.seed is not None else None)
+    clients = []
+    tasks = []
+    start = time.monotonic()
+    stop = start + args.duration
+    idle_since = None
+    for index in range(first, first + count):
+        proto = {"1": PROTOCOL_V1, "2": PROTOCOL_V2}.get(args.proto, PROTOCOL_V1 + index % 2)
+        client = ScriptedClient(f"{args.id_prefix}{index}", proto, args, stats, random.Random(rng.random()))
+        clients.append(client)
+        tasks.append(asyncio.create_task(client.run()))
+        # --ramp is shared by all processes
+        await asyncio.sleep(args.processes / args.ramp)
+    while time.monotonic() < stop and not all(task.done() for task in tasks):
+        await asyncio.sleep(0.5)
+        if any(client.state in ('connecting', 'playing') for client in clients):
+            idle_since = None
+        elif idle_since is None:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since > IDLE_GRACE:
+            break  # the rest wait for opponents or watch; nothing more will happen
+    for client in clients:
+        if client.state != 'done':
+            stats.counts[f'left {client.state}'] += 1
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stats.counts['seconds'] = time.monotonic() - start
+    return stats
+
+
+def _run_process(args, first, count):
+    return asyncio.run(run_clients(args, first, count)).as_dict()
+
+
+def percentiles(values):
+    """(p50, p90, p99, max) in milliseconds, or None without samples."""
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1e3
+    return pick(0.5), pick(0.9), pick(0.99), values[-1] * 1e3
+
+
+def games_finished(counts):
+    """
+    Games that ended, each counted once: a game between two clients is seen
+    by both (one won, one lost), a game against a bot by one, and a forfeit
+    only by the player who stayed.
+    """
+    bot_games = counts['games vs bot']
+    return (counts['games won'] + counts['games lost'] - bot_games) / 2 + bot_games + counts['won by forfeit']
+
+
+def report(stats, args):
+    counts = stats.counts
+    seconds = counts.pop('seconds', 0) / args.processes or 1e-9
+    result = {
+        'clients': args.clients,
+        'seconds': seconds,
+        'games_per_sec': games_finished(counts) / seconds,
+        'turns_per_sec': counts['turns'] / seconds,
+        'turn_latency_ms': percentiles(stats.turn_latency),
+        'handshake_ms': percentiles(stats.handshake),
+        'reconnect_ms': percentiles(stats.reconnect),
+        'counts': dict(sorted(counts.items())),
+    }
+    print(f"{args.clients} clients ({args.proto}) against {args.host}:{args.port} for {seconds:.1f} s")
+    print(f"  games/sec {result['games_per_sec']:.2f}   turns/sec {result['turns_per_sec']:.1f}")
+    for label, key in (("turn latency", 'turn_latency_ms'), ("handshake", 'handshake_ms'),
+                       ("reconnect", 'reconnect_ms')):
+        if result[key] is not None:
+            print(f"  {label:<13} p50 {result[key][0]:8.2f}  p90 {result[key][1]:8.2f}  "
+                  f"p99 {result[key][2]:8.2f}  max {result[key][3]:8.2f} ms")
+    for name, value in result['counts'].items():
+        print(f"  {name:<26} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"[INFO] Results written to {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted clients that put load on a BEER Battleship server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--proto", choices=("1", "2", "mix"), default="2", help="protocol version (mix: alternate)")
+    parser.add_argument("--integrity", choices=(INTEGRITY_CRC32, INTEGRITY_NONE), default=INTEGRITY_CRC32,
+                        help="v2 integrity mode")
+    parser.add_argument("--rounds", type=int, default=1, help="rounds each client plays before answering N")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE, metavar="N",
+                        help="the server's --board-size (v2 clients also learn it from their board)")
+    parser.add_argument("--ramp", type=float, default=200.0, help="new connections per second")
+    parser.add_argument("--think", type=float, default=0.0, metavar="SECONDS",
+                        help="mean delay before answering a prompt")
+    parser.add_argument("--reconnect", type=float, default=0.0, metavar="P",
+                        help="share of games in which a client drops and reconnects with the same ID")
+    parser.add_argument("--reconnect-delay", type=float, default=0.2, metavar="SECONDS")
+    parser.add_argument("--duration", type=float, default=300.0, metavar="SECONDS", help="stop after this long")
+    parser.add_argument("--idle-timeout", type=float, default=120.0, metavar="SECONDS",
+                        help="give up on a client that receives nothing for this long")
+    parser.add_argument("--processes", type=int, default=1, help="split the clients across this many processes")
+    parser.add_argument("--id-prefix", default=f"load{os.getpid()}-", help="player IDs are <prefix><n>")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH as JSON")
+    parser.add_argument("--verbose", action="store_true", help="print every connection error")
+    args = parser.parse_args()
+    args.processes = max(1, min(args.processes, args.clients))
+
+    shares = [args.clients // args.processes + (n < args.clients % args.processes) for n in range(args.processes)]
+    firsts = [sum(shares[:n]) for n in range(args.processes)]
+    stats = Stats()
+    if args.processes == 1:
+        stats.merge(_run_process(args, 0, args.clients))
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            for data in pool.starmap(_run_process, [(args, first, count) for first, count in zip(firsts, shares)]):
+                stats.merge(data)
+    report(stats, args)
+
+
+if __name__ == "__main__":
+    main()
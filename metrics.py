@@ -0,0 +1,237 @@
+"""
+metrics.py
+
+In-process metrics for the server: counters, gauges and latency histograms,
+exposed in the Prometheus text format on an optional local HTTP port
+(--metrics-port).
+
+Recording is meant to stay on in the hot path: a counter increment or a
+histogram observation is one uncontended lock and an addition, and gauges
+that describe server state (active games, queue length, spectators) are
+callbacks read only when /metrics is scraped. Readers and writers count
+frames once per recv()/send() batch, not once per frame.
+
+The metrics the server records are defined at the bottom of this module;
+other modules import them from here:
+
+    import metrics
+    metrics.CONNECTIONS.inc()
+
+utils.py, which the clients import as well, does not import this module:
+it counts frames only once the server has called utils.count_with(metrics).
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers a fast bot's turn up to the 30 s turn limit
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"  # the endpoint is meant for local scraping only
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name + _format_labels(self.labels), self.value
+
+
+class Gauge:
+    """A value that goes up and down, or is read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Report function() instead of the stored value; it runs on the scraping thread."""
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                print(f"[WARN] Metric {self.name} could not be read: {e}")
+        yield self.name + _format_labels(self.labels), value
+
+
+class Histogram:
+    """Observations counted into fixed buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)    # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield self.name + "_bucket" + _format_labels(self.labels, ("le", _format_value(bound))), cumulative
+        yield self.name + "_sum" + _format_labels(self.labels), total
+        yield self.name + "_count" + _format_labels(self.labels), cumulative
+
+
+class Registry:
+    """
+    All metrics of the process, keyed by name and labels:
+      self.metrics = {(<name>, ((<label>, <value>), ...)): Counter | Gauge | Histogram}
+    Asking for an existing metric returns it, so modules can share one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, **labels):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        lines = []
+        described = set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per scrape would drown the server log
+
+
+def serve_http(port, host=DEFAULT_HOST, registry=REGISTRY):
+    """Serve GET /metrics on host:port from a daemon thread; returns the HTTP server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[INFO] Metrics available at http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+
+# What the server records. Protocol-labelled metrics are indexed by version (1 or 2).
+CONNECTIONS = REGISTRY.counter("battleship_connections_accepted_total", "TCP connections accepted")
+ACTIVE_GAMES = REGISTRY.gauge("battleship_active_games", "Games currently running")
+QUEUE_LENGTH = REGISTRY.gauge("battleship_queue_length", "Players waiting for a game")
+SPECTATORS = REGISTRY.gauge("battleship_spectators", "Connected spectators, in games and in the lobby")
+FRAMES_IN = {proto: REGISTRY.counter("battleship_frames_received_total", "Packets received", proto=str(proto))
+             for proto in (1, 2)}
+FRAMES_OUT = {proto: REGISTRY.counter("battleship_frames_sent_total", "Packets sent, spectator updates included",
+                                      proto=str(proto))
+              for proto in (1, 2)}
+CHECKSUM_FAILURES = {proto: REGISTRY.counter("battleship_checksum_failures_total",
+                                             "Received packets that failed their checksum or could not be decoded",
+                                             proto=str(proto))
+                     for proto in (1, 2)}
+RETRANSMITS = REGISTRY.counter("battleship_retransmitted_frames_total", "Frames resent after a NAK (arq)")
+TIMEOUTS = REGISTRY.counter("battleship_read_timeouts_total", "Prompts a player did not answer in time")
+RECONNECTS = REGISTRY.counter("battleship_reconnects_total", "Players who reconnected to their session")
+TURN_SECONDS = REGISTRY.histogram("battleship_turn_seconds",
+                                  "Time from a player's turn prompt to their shot being resolved")
+RTT_SECONDS = REGISTRY.histogram("battleship_rtt_seconds", "Keepalive round-trip times (PING to PONG)",
+                                 buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+HEARTBEAT_EVICTIONS = REGISTRY.counter("battleship_heartbeat_evictions_total",
+                                       "Connections closed after missing too many keepalive pings")
@@ -1,10 +1,37 @@
+import argparse
+import os
+import selectors
 import socket
 import threading
 from collections import deque
-from game_logic import run_two_player_session
+from battleship import DEFAULT_RULES, MAX_BOARD_SIZE, BOARD_SIZE, game_rules, parse_fleet
+from game_logic import adopt_reconnection, run_two_player_session
+from bot import DensityBot, BotConnection
+from waiting_queue import WaitingQueue
+from session_store import SessionStore
+import fanout
+from fanout import SpectatorHub
+import sharding
+import journal
+import metrics
+import tracing
+import keepalive as heartbeat
+from handshake import HandshakeStage
 import time
 import traceback
-from utils import encode_packet, decode_packet, send_packet_message
+from utils import (
+    encode_packet,
+    decode_packet,
+    send_packet_message,
+    parse_id_line,
+    proto_ack,
+    count_with,
+    PacketReader,
+    PacketWriter,
+    PROTOCOL_V2,
+    INTEGRITY_ARQ,
+    PACKET_TYPE_CONTROL,
+)
 '''
 PACKET_TYPE_MESSAGE = 1
 PACKET_TYPE_COMMAND = 2
@@ -14,205 +41,781 @@ PACKET_TYPE_CONTROL = 4
 
 HOST = '127.0.0.1'
 PORT = 5000
+MAX_CONCURRENT_GAMES = 8
+QUEUE_NOTIFY_INTERVAL = 0.5
 
 waiting_clients = deque()
-ready_queue = deque()
-spectators = []
+ready_queue = WaitingQueue()  # (conn, rfile, wfile, player_id) entries keyed by player_id
+spectators = []  # lobby: spectators not attached to any running game; guarded by game_manager.lock
 
-active_game_lock = threading.Lock()
+def _on_session_evicted(player_id, session):
+    # A disconnected player's old socket is dead weight; close it with the session
+    if session.get('status') == 'disconnected':
+        try:
+            session['conn'].close()
+        except OSError:
+            pass
+    if shard is not None:
+        shard.release(player_id)
+    print(f"[INFO] Session for {player_id} expired ({session.get('status')}).")
+
+
+player_session = SessionStore(on_evict=_on_session_evicted)
+shard = None  # sharding.ShardContext when running with --workers > 1
+game_journal = None  # journal.GameJournal when running with --journal
+restored_games = None  # journal.RestoredGames recovered from the journal at startup
+handshake_stage = None  # HandshakeStage reading ID lines; created in serve() (threads do not survive fork)
+promoting = set()  # spectator entries asked for their ID that have not answered yet
+promotion_lock = threading.Lock()
+# Taking over a running game's session, and collecting takeovers the game left behind, in one step
+takeover_lock = threading.Lock()
+keepalive = None  # keepalive.Keepalive when heartbeats are on (--keepalive-interval)
+tcp_keepalive = False  # --tcp-keepalive
+bot_wait = None  # --bot-wait: seconds a lone player waits before playing a bot
+
+
+class GameSessionManager:
+    """
+    Runs several independent two-player sessions side by side.
+    Each game gets its own thread, player pair and spectator list:
+      self.games = {
+          <game_id>: {
+              'players': (<player1_id>, <player2_id>),
+              'spectators': SpectatorHub of (conn, rfile, wfile) entries,
+              'rules': {'size', 'fleet'} the game is played with,
+          },
+      }
+    At most max_games sessions run at the same time. New games get
+    self.rules (--board-size / --fleet); a game recovered from the journal
+    keeps the rules it was started with.
+    """
+
+    def __init__(self, max_games=MAX_CONCURRENT_GAMES):
+        self.max_games = max_games
+        self.rules = DEFAULT_RULES
+        self.spectator_policy = fanout.DEFAULT_POLICY
+        self.spectator_buffer = fanout.DEFAULT_MAX_FRAMES
+        self.games = {}
+        self.lock = threading.Lock()
+        self._next_game_id = 1
+
+    def active_count(self):
+        with self.lock:
+            return len(self.games)
+
+    def free_slots(self):
+        with self.lock:
+            return max(0, self.max_games - len(self.games))
+
+    def spectator_count(self):
+        """Spectators of running games and in the lobby."""
+        with self.lock:
+            return len(spectators) + sum(len(game['spectators']) for game in self.games.values())
+
+    def has_capacity(self):
+        return self.free_slots() > 0
+
+    def add_spectator(self, entry):
+        """
+        Attach a spectator to the running game with the fewest spectators,
+        or keep it in the lobby if no game is running.
+        """
+        with self.lock:
+            if not self.games:
+                spectators.append(entry)
+                return
+            game = min(self.games.values(), key=lambda g: len(g['spectators']))
+            game['spectators'].append(entry)
+
+    def take_lobby_spectator(self):
+        """Remove and return the longest-waiting lobby spectator, or None."""
+        with self.lock:
+            return spectators.pop(0) if spectators else None
+
+    def start_game(self, p1, p2, resume=None):
+        """
+        Start a new session for the two (conn, rfile, wfile, player_id) entries.
+        Returns the new game id, or None if every slot is taken. A game
+        recovered from the journal (`resume`) always gets a slot: it held
+        one before the restart.
+        """
+        with self.lock:
+            if resume is None and len(self.games) >= self.max_games:
+                return None
+            game_id = self._next_game_id
+            self._next_game_id += 1
+            # Lobby spectators get to watch the new game
+            game_spectators = SpectatorHub(self.spectator_policy, self.spectator_buffer)
+            game_spectators.extend(spectators)
+            spectators.clear()
+            self.games[game_id] = {
+                'players': (p1[3], p2[3]),
+                'spectators': game_spectators,
+                'rules': resume['rules'] if resume is not None else self.rules,
+            }
+        threading.Thread(target=self._run_game, args=(game_id, p1, p2, resume), daemon=True).start()
+        return game_id
+
+    def _run_game(self, game_id, p1, p2, resume=None):
+        conn1, rfile1, wfile1, player1_id = p1
+        conn2, rfile2, wfile2, player2_id = p2
+        game_spectators = self.games[game_id]['spectators']
+        rules = self.games[game_id]['rules']
+        print(f"[INFO] Game #{game_id} started: {player1_id} vs {player2_id} "
+              f"({self.active_count()}/{self.max_games} games running)")
+        trace = tracing.TRACER.start_trace("game", game_id=game_id, players=[player1_id, player2_id])
+        # Sessions of long-queued players may have expired; players in a game need one
+        for conn, rfile, wfile, player_id in (p1, p2):
+            if isinstance(conn, BotConnection):
+                continue
+            if player_id in player_session:
+                player_session.touch(player_id)
+                tracing.record_arrival(trace, player_id, player_session[player_id])
+            else:
+                player_session[player_id] = new_session(conn, rfile, wfile)
+        player1 = {"conn": conn1, "rfile": rfile1, "wfile": wfile1, "player_id": player1_id}
+        player2 = {"conn": conn2, "rfile": rfile2, "wfile": wfile2, "player_id": player2_id}
+        for player in (player1, player2):
+            if isinstance(player['conn'], BotConnection):
+                player['bot'] = player['conn'].bot
+        if resume is not None:
+            player1['board'], player2['board'] = resume['boards']
+        survivor = None
+        try:
+            survivor = run_two_player_session(
+                player1,
+                player2,
+                game_spectators,
+                player_session,
+                game_journal,
+                resume,
+                trace,
+                rules
+            )
+        except Exception as e:
+            print(f"[ERROR] Game #{game_id} crashed: {e}")
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.games.pop(game_id, None)
+            # Spectators of this game go back to the lobby once their updates are flushed
+            returning = game_spectators.close()
+            with self.lock:
+                spectators.extend(returning)
+            trace.end()
+
+        # A player who reconnected while the game could not adopt it (setup, play again, game over)
+        for player in collect_reconnections((player1, player2)):
+            if player is not survivor:
+                requeue_player(player, "Your game has ended. Waiting for a new opponent...")
+        if survivor and 'bot' not in survivor:
+            requeue_player(survivor, "Waiting for a new opponent...")
+
+        promote_spectators()
+        notify_slot_freed()
+        print(f"[INFO] Game #{game_id} cleaned up. Slot released.")
+
+
+game_manager = GameSessionManager()
+
+
+def requeue_player(player, message):
+    try:
+        send_packet_message(player['wfile'], 1, message)
+    except Exception:
+        print(f"[WARN] Could not notify {player['player_id']}.")
+    enqueue_player((player['conn'], player['rfile'], player['wfile'], player['player_id']))
+
+
+def collect_reconnections(players):
+    """
+    Switch players over to connections registered as reconnections that
+    their game ended without adopting. Returns those players.
+    """
+    adopted = []
+    with takeover_lock:
+        for player in players:
+            session = player_session.get(player['player_id'])
+            if 'bot' not in player and session is not None and session['reconnected'].is_set():
+                adopt_reconnection(player, player_session)
+                adopted.append(player)
+    return adopted
+
+
+def enqueue_player(entry):
+    """
+    Add a (conn, rfile, wfile, player_id) entry to the back of the ready queue
+    and wake the matchmaker.
+    """
+    session = player_session.get(entry[3])
+    if session is not None:
+        session['queued_at'] = tracing.now()
+    waiting = ready_queue.push(entry[3], entry)
+    if shard is not None:
+        shard.advertise_waiting(waiting == 1)
+
+
+def notify_slot_freed():
+    ready_queue.notify()
 
-player_session = {}
 
 def queue_notifier():
+    """
+    Tell waiting clients their queue position, but only when it changed.
+    Runs on its own thread so slow sockets never hold up the matchmaker;
+    bursts of queue changes within QUEUE_NOTIFY_INTERVAL are sent as one batch.
+    """
     while True:
-        temp = []
-        time.sleep(3)
-        size = len(ready_queue)
-        for idx in range(size):
+        ready_queue.changed.wait()
+        time.sleep(QUEUE_NOTIFY_INTERVAL)
+        for player_id, (conn, rfile, wfile, _), position in ready_queue.collect_changes():
             try:
-                conn, rfile, wfile, _ = ready_queue.popleft()
-                send_packet_message(wfile, 1, f"MESSAGE Waiting in queue... you are #{idx + 1}")
-                temp.append((conn, rfile, wfile, _))
+                send_packet_message(wfile, 1, f"MESSAGE Waiting in queue... you are #{position}")
             except Exception as e:
                 print(f"[WARN] Failed to notify waiting client: {e}")
-        for item in reversed(temp):
-            ready_queue.appendleft(item)
+                ready_queue.remove(player_id)
 
 
 def client_listener(server_sock):
+    """
+    Only accepts: reading the ID line is left to the handshake stage, so a
+    client that never sends one cannot hold up the next accept.
+    """
     while True:
         conn, addr = server_sock.accept()
+        accepted = tracing.now()
+        metrics.CONNECTIONS.inc()
         print(f"[INFO] New client from {addr}")
-        rfile = conn.makefile('r')
-        wfile = conn.makefile('w')
-
-        id_line = rfile.readline()
-        if not id_line or not id_line.startswith("ID "):
-            print("[WARN] Invalid or missing ID line.")
+        handshake_stage.submit(
+            conn,
+            lambda conn, id_line, accepted=accepted: on_client_handshake(conn, id_line, accepted),
+            on_fail=on_handshake_failed,
+        )
+
+
+def on_handshake_failed(conn):
+    print("[WARN] Invalid or missing ID line.")
+    conn.close()
+
+
+def on_client_handshake(conn, id_line, accepted=None):
+    """
+    Called by the handshake stage once a new client has sent its ID line
+    (`accepted`: when the connection was accepted, for tracing).
+    """
+    player_id, proto, integrity = parse_id_line(id_line)
+    print(f"[INFO] Received player ID: {player_id}")
+
+    # Sharded mode: a player whose game lives on another worker is routed there
+    if shard is not None and player_id not in player_session:
+        owner = shard.owner(player_id)
+        if owner is None and not ready_queue:
+            owner = shard.lobby_owner()  # pair with a lone player on another worker
+        if owner is not None and shard.forward(conn, id_line, owner):
             conn.close()
-            continue
+            return
+
+    open_client(conn, player_id, proto, integrity, accepted)
 
-        player_id = id_line.strip().split(" ", 1)[1]
-        print(f"[INFO] Received player ID: {player_id}")
 
+def adopt_forwarded_client(conn, id_line):
+    """Handle a client socket handed over by another worker process."""
+    open_client(conn, *parse_id_line(id_line))
+
+
+def open_client(conn, player_id, proto, integrity, accepted=None):
+    """
+    Wrap the connection in readers/writers for the protocol version and
+    integrity mode the client asked for (acknowledging v2 first), then
+    register it.
+    """
+    # Writes are coalesced by PacketWriter, so Nagle would only add delay
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if tcp_keepalive:
+        heartbeat.enable_tcp_keepalive(conn)
+    if proto == PROTOCOL_V2:
         try:
-            # Reconnect logic
-            if player_id in player_session and player_session[player_id]['status'] == 'disconnected':
-                player_session[player_id]['conn'] = conn
-                player_session[player_id]['rfile'] = rfile
-                player_session[player_id]['wfile'] = wfile
-                player_session[player_id]['status'] = 'reconnected'
-                player_session[player_id]['last_seen'] = time.time()
-                print(f"[INFO] Player {player_id} reconnected.")
-                
-                # After reconect,go back directly to the game
-                continue
+            conn.sendall(f"{proto_ack(integrity)}\n".encode())
+        except OSError as e:
+            print(f"[WARN] Could not acknowledge protocol v2 for {player_id}: {e}")
+            conn.close()
+            return
+    wfile = PacketWriter(conn, proto, integrity)
+    rfile = PacketReader(conn, proto, writer=wfile)
+    if proto == PROTOCOL_V2 and integrity == INTEGRITY_ARQ:
+        rfile.watch_naks()  # NAKs must not wait for this player's turn to be read
+    if keepalive is not None:
+        rfile.on_pong = lambda payload: keepalive.pong(conn, payload)
+    register_client(conn, rfile, wfile, player_id, accepted)
+
+
+def new_session(conn, rfile, wfile, accepted=None):
+    return {
+        'conn': conn,
+        'rfile': rfile,
+        'wfile': wfile,
+        'status': 'connected',
+        'last_seen': time.time(),
+        'reconnected': threading.Event(),
+        # Lifecycle timestamps for the game's trace; see tracing.record_arrival
+        'accepted_at': accepted,
+        'registered_at': tracing.now(),
+    }
+
+
+def peer_gone(conn):
+    """Whether the client end of a socket has closed, without consuming anything it sent."""
+    try:
+        return conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
 
-            # If timeout or new session
-            player_session[player_id] = {
-                'conn': conn,
-                'rfile': rfile,
-                'wfile': wfile,
-                'status': 'connected',
-                'last_seen': time.time()
-            }
 
-            if len(ready_queue) < 2 and not active_game_lock.locked():
+def register_client(conn, rfile, wfile, player_id, accepted=None):
+    try:
+        # Reconnect logic: a player in a running game whose connection is gone (the
+        # game may not have noticed yet) takes it over. A live connection is kept.
+        with takeover_lock:
+            session = player_session.get(player_id)
+            in_use = False
+            if session and session.get('in_game'):
+                in_use = session['status'] != 'disconnected' and not peer_gone(session['conn'])
+                if not in_use:
+                    old_conn = session['conn']
+                    session['conn'] = conn
+                    session['rfile'] = rfile
+                    session['wfile'] = wfile
+                    session['status'] = 'reconnected'
+                    player_session.touch(player_id)
+                    if old_conn is not conn:
+                        try:
+                            old_conn.shutdown(socket.SHUT_RDWR)  # wake a game still reading the old socket
+                        except OSError:
+                            pass
+                    session['reconnected'].set()
+                    metrics.RECONNECTS.inc()
+                    print(f"[INFO] Player {player_id} reconnected.")
+
+                    # After reconect,go back directly to the game
+                    return
+        if in_use:
+            print(f"[WARN] Refused a second connection for {player_id}: already in a game.")
+            try:
+                send_packet_message(wfile, 1, f"MESSAGE ID {player_id} is already playing a game. Connect with another ID.")
+            except Exception:
+                pass
+            conn.close()
+            return
+
+        # If timeout or new session
+        player_session[player_id] = new_session(conn, rfile, wfile, accepted)
+        if shard is not None:
+            shard.claim(player_id)
+
+        # A player whose game was running when the server went down rejoins it
+        if restored_games is not None and player_id in restored_games:
+            send_packet_message(wfile, 1, "MESSAGE Restoring your game after a server restart. Waiting for your opponent...")
+            game = restored_games.arrive(player_id, (conn, rfile, wfile, player_id))
+            if game is not None:
+                p1, p2 = (game['present'][pid] for pid in game['players'])
+                print(f"[INFO] Resuming game {game['game_id']} from the journal.")
+                game_manager.start_game(p1, p2, resume=game)
+            return
+
+        if len(ready_queue) < 2 * game_manager.free_slots():
+            try:
+                send_packet_message(wfile, 1, "MESSAGE Connected as player. Waiting for a match...")
+                enqueue_player((conn, rfile, wfile, player_id))
+            except Exception as e:
+                print(f"[ERROR] Failed to connect player: {e}")
+                conn.close()
+        else:
+            try:
+                send_packet_message(wfile, 1, "MESSAGE Spectator mode. Waiting for a match...")
+                game_manager.add_spectator((conn, rfile, wfile))
+            except Exception as e:
+                print(f"[ERROR] Failed to connect spectator: {e}")
+                conn.close()
+
+    except Exception as e:
+        print(f"[ERROR] Unexpected error during client handling: {e}")
+        conn.close()
+
+
+def promote_spectators():
+    """
+    Promote lobby spectators to players while there are free game slots
+    that the ready queue cannot fill on its own. The spectator's ID reply is
+    awaited by the handshake stage, so this never blocks on a client.
+
+    Until the ID line is in, the spectator's reader lock is held so the
+    keepalive thread does not read past it; packets the client sent before
+    the line (PONGs) are decoded by the handshake stage on the way.
+    """
+    with promotion_lock:
+        while len(ready_queue) + len(promoting) < 2 * game_manager.free_slots():
+            entry = game_manager.take_lobby_spectator()
+            if entry is None:
+                break
+            new_conn, new_rfile, new_wfile = entry
+            new_rfile.lock.acquire()
+            try:
+                # A dead connection fails here
+                send_packet_message(new_wfile, 1, "You are being promoted to a player. Send your ID again.")
+                send_packet_message(new_wfile, 2, "SEND-ID")
+            except Exception as e:
+                print(f"[SKIP] Spectator connection dead, skipping: {e}")
+                new_rfile.lock.release()
+                continue
+            promoting.add(entry)
+            handshake_stage.submit(
+                new_conn,
+                lambda conn, id_line, entry=entry: finish_promotion(entry, id_line),
+                on_fail=lambda conn, entry=entry: promotion_failed(entry),
+                skip=new_rfile.take_frames,
+            )
+
+
+def finish_promotion(entry, id_line):
+    new_conn, new_rfile, new_wfile = entry
+    new_rfile.lock.release()
+    new_id = parse_id_line(id_line)[0]  # the connection keeps the protocol it already speaks
+    print(f"[INFO] Promoted spectator with ID: {new_id}")
+    player_session[new_id] = new_session(new_conn, new_rfile, new_wfile)
+    if shard is not None:
+        shard.claim(new_id)
+    # In one step, or promote_spectators could count this player twice and stop early
+    with promotion_lock:
+        promoting.discard(entry)
+        enqueue_player((new_conn, new_rfile, new_wfile, new_id))
+
+
+def promotion_failed(entry):
+    print("[WARN] Spectator failed to send ID.")
+    entry[1].lock.release()
+    entry[0].close()
+    with promotion_lock:
+        promoting.discard(entry)
+    # Offer the slot to the next spectator, off the handshake thread
+    threading.Thread(target=promote_spectators, daemon=True).start()
+
+
+def keepalive_targets():
+    """
+    Every connection to ping, as (name, (conn, rfile, wfile)) pairs, plus
+    the spectator hubs of running games (pinged through their fan-out).
+    Players waiting in the queue have a session too.
+    """
+    targets = [(player_id, (session['conn'], session['rfile'], session['wfile']))
+               for player_id, session in player_session.items() if session['status'] != 'disconnected']
+    with game_manager.lock:
+        targets.extend(("lobby spectator", entry) for entry in spectators)
+        hubs = [game['spectators'] for game in game_manager.games.values()]
+    return targets, hubs
+
+
+def watch_for_pongs(watched, seconds):
+    """
+    Spend the time until the next heartbeat reading connections as soon as
+    something arrives on them, so a PONG is matched (and its RTT measured)
+    when it comes in rather than on the loop's next pass. A connection the
+    game (or a promotion) is reading is left to it for the rest of the wait.
+    """
+    deadline = time.monotonic() + seconds
+    with selectors.DefaultSelector() as selector:
+        for _, (conn, rfile, _), _ in watched:
+            try:
+                selector.register(conn, selectors.EVENT_READ, rfile)
+            except (KeyError, ValueError, OSError):
+                pass  # closed since, or listed twice
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            for key, _ in selector.select(remaining):
+                rfile = key.data
+                if rfile.lock.locked() or not rfile.poll():
+                    selector.unregister(key.fileobj)
+
+
+def keepalive_loop():
+    """
+    Every keepalive.interval seconds, send one PING to every connection and
+    evict the ones that stopped answering. PONGs are matched wherever the
+    connection is read: by the game while it waits for the player, and by
+    poll() here otherwise (see watch_for_pongs). Game spectators get the
+    PING through their hub.
+    """
+    watched = []
+    while True:
+        watch_for_pongs(watched, keepalive.interval)
+        ping = keepalive.next_ping()
+        targets, hubs = keepalive_targets()
+        watched = [(name, entry, True) for name, entry in targets]
+        for hub in hubs:
+            hub.publish(PACKET_TYPE_CONTROL, ping)
+            watched.extend(("spectator", entry, False) for entry in hub)
+
+        alive = set()
+        for name, (conn, rfile, wfile), direct in watched:
+            if not rfile.poll():
+                continue  # closed; whoever owns the connection finds out on its own
+            alive.add(conn)
+            if keepalive.pinged(conn, name):
+                keepalive.evicted(name)
                 try:
-                    send_packet_message(wfile, 1, "MESSAGE Connected as player. Waiting for a match...")
-                    ready_queue.append((conn, rfile, wfile, player_id))
-                except Exception as e:
-                    print(f"[ERROR] Failed to connect player: {e}")
-                    conn.close()
-            else:
+                    conn.shutdown(socket.SHUT_RDWR)  # the game, queue or fan-out notices and cleans up
+                except OSError:
+                    pass
+            elif direct:
                 try:
-                    send_packet_message(wfile, 1, "MESSAGE Spectator mode. Waiting for a match...")
-                    spectators.append((conn, rfile, wfile))
-                except Exception as e:
-                    print(f"[ERROR] Failed to connect spectator: {e}")
-                    conn.close()
-
+                    # Never blocks: a peer whose socket buffer is full (or whose writer is
+                    # stuck sending to it) just misses this heartbeat. A turn still being
+                    # collected goes out with it, so the RTT is not inflated.
+                    wfile.send_nowait(PACKET_TYPE_CONTROL, ping)
+                except Exception:
+                    pass  # as above
+        keepalive.retain(alive)
+
+
+def open_journal(path):
+    """
+    Recover unfinished games from the journal at `path`, then keep recording
+    to it. Players of a recovered game have journal.RECOVERY_TTL seconds to
+    come back; whoever is left waiting after that joins the normal queue.
+    """
+    global game_journal, restored_games
+    games = journal.load_unfinished_games(path)
+    game_journal = journal.GameJournal(path)
+    game_journal.seed(games)
+    restored_games = journal.RestoredGames(games)
+    if games:
+        print(f"[INFO] Recovered {len(games)} unfinished game(s) from {path}")
+        if shard is not None:
+            for game in games.values():
+                for player_id in game['players']:
+                    shard.claim(player_id)
+    timer = threading.Timer(journal.RECOVERY_TTL, release_restored_players)
+    timer.daemon = True
+    timer.start()
+
+
+def release_restored_players():
+    stranded, dropped = restored_games.release()
+    for game_id in dropped:
+        game_journal.game_ended(game_id)
+    if dropped:
+        print(f"[INFO] Dropped {len(dropped)} recovered game(s) whose players did not both come back.")
+    for entry in stranded:
+        try:
+            send_packet_message(entry[2], 1, "MESSAGE Your opponent did not come back. Waiting for a new match...")
+            enqueue_player(entry)
         except Exception as e:
-            print(f"[ERROR] Unexpected error during client handling: {e}")
-            conn.close()
-
+            print(f"[WARN] Could not requeue restored player {entry[3]}: {e}")
 
 
 def game_matchmaker():
+    """
+    Pair players as soon as two are ready and a game slot is free. Sleeps on
+    the ready queue instead of polling, so an idle server costs no wakeups.
+    """
     while True:
-        if len(ready_queue) >= 2 and not active_game_lock.locked():
-            p1 = ready_queue.popleft()
-            p2 = ready_queue.popleft()
-
-            conn1, rfile1, wfile1, player1_id = p1
-            conn2, rfile2, wfile2, player2_id = p2
-
-            print("[INFO] Starting a new game...")
-            print(f"[DEBUG] p1: {p1}")
-            print(f"[DEBUG] p2: {p2}")
-
-            def start():
-                with active_game_lock:
-                    survivor = run_two_player_session(
-                        {"conn": conn1, "rfile": rfile1, "wfile": wfile1, "player_id": player1_id},
-                        {"conn": conn2, "rfile": rfile2, "wfile": wfile2, "player_id": player2_id},
-                        spectators,
-                        player_session
-                    )
-
-                    if survivor:
-                        try:
-                            send_packet_message(survivor['wfile'], 1, "Waiting for a new opponent...")
-                        except Exception:
-                            print("[WARN] Could not notify survivor.")
-                        ready_queue.append((
-                            survivor['conn'],
-                            survivor['rfile'],
-                            survivor['wfile'],
-                            survivor['player_id']
-                        ))
-
-                    # ✅ check if there are spectators waiting
-                    while len(ready_queue) < 2 and spectators:
-                        new_conn, new_rfile, new_wfile = spectators.pop(0)
-                        try:
-                            #check if the connection is still alive
-                            send_packet_message(new_wfile, 4, "PING")
-                        except Exception as e:
-                            print(f"[SKIP] Spectator connection dead, skipping: {e}")
-                            continue  
-
-                        try:
-                            send_packet_message(new_wfile, 1, "You are being promoted to a player. Send your ID again.")
-                            send_packet_message(new_wfile, 2, "SEND-ID")
-                            id_line = new_rfile.readline()
-                            if id_line.startswith("ID "):
-                                new_id = id_line.strip().split(" ", 1)[1]
-                                print(f"[INFO] Promoted spectator with ID: {new_id}")
-                                player_session[new_id] = {
-                                    'conn': new_conn,
-                                    'rfile': new_rfile,
-                                    'wfile': new_wfile,
-                                    'status': 'connected',
-                                    'last_seen': time.time()
-                                }
-                                ready_queue.append((new_conn, new_rfile, new_wfile, new_id))
-                            else:
-                                print("[WARN] Spectator failed to send ID.")
-                        except Exception as e:
-                            print(f"[ERROR] Failed to promote spectator: {e}")
-
-                    print("[INFO] Game session cleaned up.")
-                    print("[INFO] Game finished. Lock released.")
-
-            threading.Thread(target=start, daemon=True).start()
+        p1, p2 = ready_queue.wait_pop_pair(game_manager.has_capacity)
+        paired = tracing.now()
+        for entry in (p1, p2):
+            session = player_session.get(entry[3])
+            if session is not None:
+                session['paired_at'] = paired
+        waiting = len(ready_queue)
+        if shard is not None:
+            shard.advertise_waiting(waiting == 1)
+
+        print("[INFO] Starting a new game...")
+        print(f"[DEBUG] p1: {p1}")
+        print(f"[DEBUG] p2: {p2}")
+
+        if game_manager.start_game(p1, p2) is None:
+            # No free slot after all; put them back in order
+            ready_queue.push_front(p2[3], p2)
+            ready_queue.push_front(p1[3], p1)
+
+
+def bot_matchmaker():
+    """
+    Seat a computer opponent (bot.DensityBot) with a player who has been
+    waiting on their own for bot_wait seconds, once a game slot is free.
+    """
+    while True:
+        entry = ready_queue.wait_pop_lone(bot_wait, game_manager.has_capacity)
+        session = player_session.get(entry[3])
+        if session is not None:
+            session['paired_at'] = tracing.now()
+        if shard is not None:
+            shard.advertise_waiting(False)
+        bot = DensityBot()
+        link = BotConnection(bot)
+        try:
+            send_packet_message(entry[2], 1, f"MESSAGE No opponent found. You will play the computer ({bot.player_id}).")
+        except Exception as e:
+            print(f"[WARN] Could not notify {entry[3]} of their bot opponent: {e}")
+            continue
+        print(f"[INFO] {entry[3]} waited {bot_wait:g}s alone; seating {bot.player_id} against them.")
+        if game_manager.start_game(entry, (link, link, link, bot.player_id)) is None:
+            ready_queue.push_front(entry[3], entry)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BEER Battleship server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-games", type=int, default=MAX_CONCURRENT_GAMES,
+                        help="maximum number of games running at the same time")
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded",
+                        help="threaded: one thread per role; async: single asyncio event loop")
+    parser.add_argument("--spectator-policy", choices=fanout.SLOW_CONSUMER_POLICIES, default=fanout.DEFAULT_POLICY,
+                        help="what to do with a spectator that falls too far behind")
+    parser.add_argument("--spectator-buffer", type=int, default=fanout.DEFAULT_MAX_FRAMES,
+                        help="frames buffered per spectator before the slow-consumer policy applies")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--journal", metavar="PATH",
+                        help="record games to this file and resume unfinished ones after a restart")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on this local port (worker n of --workers uses PORT + n)")
+    parser.add_argument("--keepalive-interval", type=float, default=heartbeat.KEEPALIVE_INTERVAL, metavar="SECONDS",
+                        help="ping every connection this often (0 turns heartbeats off)")
+    parser.add_argument("--keepalive-misses", type=int, default=heartbeat.KEEPALIVE_MISSES,
+                        help="disconnect a client after this many unanswered pings in a row")
+    parser.add_argument("--tcp-keepalive", action="store_true",
+                        help="also enable TCP keepalive probes on client sockets")
+    parser.add_argument("--trace-file", metavar="PATH",
+                        help="write lifecycle spans of sampled games to this file as JSON lines")
+    parser.add_argument("--trace-sample", type=float, default=tracing.DEFAULT_SAMPLE_RATE, metavar="RATE",
+                        help="fraction of games to trace (default %(default)s)")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE, metavar="N",
+                        help=f"play new games on N x N boards (up to {MAX_BOARD_SIZE}; rows past Z are AA, AB, ...)")
+    parser.add_argument("--fleet", default="test", metavar="SPEC",
+                        help='fleet for new games: "test", "classic", or a list such as "Carrier:5,Destroyer:2:3" '
+                             '(name:length[:count])')
+    parser.add_argument("--bot-wait", type=float, metavar="SECONDS",
+                        help="seat a computer opponent with a player who has waited alone this long (off by default)")
+    args = parser.parse_args(argv)
+    try:
+        args.rules = game_rules(args.board_size, parse_fleet(args.fleet))
+    except ValueError as e:
+        parser.error(f"--board-size/--fleet: {e}")
+    return args
+
+
+def start_metrics(port):
+    """Report the threaded server's state through the metrics gauges and serve them on port."""
+    metrics.ACTIVE_GAMES.set_function(game_manager.active_count)
+    metrics.QUEUE_LENGTH.set_function(lambda: len(ready_queue))
+    metrics.SPECTATORS.set_function(game_manager.spectator_count)
+    metrics.serve_http(port)
+
+
+def configure_keepalive(args):
+    global keepalive, tcp_keepalive
+    if args.keepalive_interval > 0:
+        keepalive = heartbeat.Keepalive(args.keepalive_interval, max(1, args.keepalive_misses))
+    tcp_keepalive = args.tcp_keepalive
+
+
+def serve(server_sock):
+    global handshake_stage
+    handshake_stage = HandshakeStage()
+    player_session.start_sweeper()
+    if keepalive is not None:
+        threading.Thread(target=keepalive_loop, name="keepalive", daemon=True).start()
+    threading.Thread(target=client_listener, args=(server_sock,), daemon=True).start()
+    threading.Thread(target=queue_notifier, daemon=True).start()
+    threading.Thread(target=game_matchmaker, daemon=True).start()
+    if bot_wait is not None:
+        threading.Thread(target=bot_matchmaker, name="bot-matchmaker", daemon=True).start()
 
+    while True:
         time.sleep(1)
 
 
-
-def start_game_session_with_unlock(p1_raw, p2_raw, spectators):
+def flush_on_exit():
+    """Write out the trace spans still waiting in a batch; they would be lost with the process."""
+    if not tracing.TRACER.flush():
+        print("[WARN] Not every trace span was written before exit")
+
+
+def run_worker(worker_shard, args):
+    """Entry point of one --workers process: its own listener, matchmaker and games."""
+    global shard, bot_wait
+    shard = worker_shard
+    bot_wait = args.bot_wait
+    game_manager.max_games = max(1, args.max_games)
+    game_manager.spectator_policy = args.spectator_policy
+    game_manager.spectator_buffer = max(1, args.spectator_buffer)
+    game_manager.rules = args.rules
+    # Workers must not share one journal file
+    journal_path = f"{args.journal}.{shard.index}" if args.journal else None
+    metrics_port = args.metrics_port + shard.index if args.metrics_port else None
+    if args.trace_file:
+        tracing.configure(f"{args.trace_file}.{shard.index}", args.trace_sample)
     try:
-        start_game_session(p1_raw, p2_raw, spectators)
+        if args.mode == "async":
+            import async_server
+            async_server.main(args.host, args.port, game_manager.max_games, shard=shard, journal_path=journal_path,
+                              metrics_port=metrics_port, keepalive_interval=args.keepalive_interval,
+                              keepalive_misses=args.keepalive_misses, tcp_keepalive=args.tcp_keepalive,
+                              rules=args.rules, bot_wait=args.bot_wait)
+            return
+        configure_keepalive(args)
+        if journal_path:
+            open_journal(journal_path)
+        if metrics_port:
+            start_metrics(metrics_port)
+        shard.start_handoff_listener(adopt_forwarded_client)
+        print(f"[INFO] Worker {shard.index} (pid {os.getpid()}) listening on {args.host}:{args.port}")
+        with sharding.bind_reuseport(args.host, args.port) as server_sock:
+            serve(server_sock)
     finally:
-        active_game_lock.release()
-        print("[INFO] Game finished. Lock released.")
-
-def start_game_session(p1_raw, p2_raw, spectators):
-    conn1, rfile1, wfile1, player_id1 = p1_raw
-    conn2, rfile2, wfile2, player_id2 = p2_raw
-    p1 = {"conn": conn1, "rfile": rfile1, "wfile": wfile1, "player_id": player_id1}
-    p2 = {"conn": conn2, "rfile": rfile2, "wfile": wfile2, "player_id": player_id2}
-
-
+        flush_on_exit()
+
+
+def main(argv=None):
+    global bot_wait
+    args = parse_args(argv)
+    count_with(metrics)
+    bot_wait = args.bot_wait
+    game_manager.max_games = max(1, args.max_games)
+    game_manager.spectator_policy = args.spectator_policy
+    game_manager.spectator_buffer = max(1, args.spectator_buffer)
+    game_manager.rules = args.rules
+    if args.workers > 1:
+        sharding.run_workers(args.workers, args.port, run_worker, args)
+        return
+    if args.trace_file:
+        tracing.configure(args.trace_file, args.trace_sample)
     try:
-        survivor = run_two_player_session(p1, p2, spectators, player_session)
-    except Exception as e:
-        print(f"[ERROR] Game session crashed: {e}")
-        traceback.print_exc()
-        survivor = None
+        if args.mode == "async":
+            import async_server
+            async_server.main(args.host, args.port, game_manager.max_games, journal_path=args.journal,
+                              metrics_port=args.metrics_port, keepalive_interval=args.keepalive_interval,
+                              keepalive_misses=args.keepalive_misses, tcp_keepalive=args.tcp_keepalive,
+                              rules=args.rules, bot_wait=args.bot_wait)
+            return
+        configure_keepalive(args)
+        if args.journal:
+            open_journal(args.journal)
+        if args.metrics_port:
+            start_metrics(args.metrics_port)
+        print(f"[INFO] Server listening on {args.host}:{args.port} (max {game_manager.max_games} concurrent games)")
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
+            server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_sock.bind((args.host, args.port))
+            server_sock.listen()
+            serve(server_sock)
     finally:
-        print("[INFO] Game session cleaned up.")
-        if survivor:
-            try:
-                ready_queue.appendleft((survivor['conn'], survivor['rfile'], survivor['wfile'], survivor['player_id']))
-                print("[INFO] Survivor returned to ready queue.")
-            except Exception as e:
-                print(f"[WARN] Failed to requeue survivor: {e}")
-
-def main():
-    print(f"[INFO] Server listening on {HOST}:{PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
-        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_sock.bind((HOST, PORT))
-        server_sock.listen()
-
-        threading.Thread(target=client_listener, args=(server_sock,), daemon=True).start()
-        threading.Thread(target=queue_notifier, daemon=True).start()
-        threading.Thread(target=game_matchmaker, daemon=True).start()
-
-        while True:
-            time.sleep(1)
+        flush_on_exit()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+"""
+session_store.py
+
+Player sessions with expiry, replacing the plain player_session dict.
+
+Each session (the same dict the server always used: conn, rfile, wfile,
+status, last_seen, ...) gets a deadline:
+  - connected players expire after IDLE_TTL without activity
+  - disconnected players expire when their reconnect window closes
+Sessions of players in a running game ('in_game') are never evicted; their
+deadline is simply pushed back.
+
+Deadlines live in a heap with lazy invalidation, so a sweep only touches
+entries that are actually due: O(expired * log n), not a scan of every
+session.
+"""
+
+import heapq
+import threading
+import time
+
+IDLE_TTL = 30 * 60
+RECONNECT_TTL = 60
+
+
+class SessionStore:
+    """
+    Thread-safe, dict-like mapping of player_id -> session dict.
+      - _sessions: player_id -> session
+      - _deadline: player_id -> (deadline, version) currently armed
+      - _heap: (deadline, version, player_id); entries whose version no
+        longer matches _deadline are stale and skipped
+    """
+
+    def __init__(self, idle_ttl=IDLE_TTL, reconnect_ttl=RECONNECT_TTL, on_evict=None):
+        self.idle_ttl = idle_ttl
+        self.reconnect_ttl = reconnect_ttl
+        self.on_evict = on_evict
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._deadline = {}
+        self._heap = []
+        self._version = 0
+        self.evictions = 0
+
+    # ------------------------------------------------------------------
+    # dict-style access
+    # ------------------------------------------------------------------
+
+    def __contains__(self, player_id):
+        return player_id in self._sessions
+
+    def __getitem__(self, player_id):
+        return self._sessions[player_id]
+
+    def __setitem__(self, player_id, session):
+        self.put(player_id, session)
+
+    def __delitem__(self, player_id):
+        self.pop(player_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, player_id, default=None):
+        return self._sessions.get(player_id, default)
+
+    def keys(self):
+        with self._lock:
+            return list(self._sessions)
+
+    def items(self):
+        with self._lock:
+            return list(self._sessions.items())
+
+    def pop(self, player_id, default=None):
+        with self._lock:
+            self._deadline.pop(player_id, None)
+            return self._sessions.pop(player_id, default)
+
+    # ------------------------------------------------------------------
+    # Expiry
+    # ------------------------------------------------------------------
+
+    def _ttl_for(self, session):
+        return self.reconnect_ttl if session.get('status') == 'disconnected' else self.idle_ttl
+
+    def _arm(self, player_id, ttl, now=None):
+        now = time.time() if now is None else now
+        self._version += 1
+        entry = (now + ttl, self._version)
+        self._deadline[player_id] = entry
+        heapq.heappush(self._heap, (entry[0], entry[1], player_id))
+        # Stale heap entries pile up when sessions are touched often; rebuild now and then
+        if len(self._heap) > 2 * len(self._deadline) + 64:
+            self._heap = [(d, v, pid) for pid, (d, v) in self._deadline.items()]
+            heapq.heapify(self._heap)
+
+    def put(self, player_id, session):
+        """Insert or replace a session; its TTL follows its status."""
+        with self._lock:
+            session.setdefault('last_seen', time.time())
+            self._sessions[player_id] = session
+            self._arm(player_id, self._ttl_for(session))
+
+    def touch(self, player_id):
+        """Record activity: refresh last_seen and push the deadline back."""
+        with self._lock:
+            session = self._sessions.get(player_id)
+            if session is None:
+                return
+            session['last_seen'] = time.time()
+            self._arm(player_id, self._ttl_for(session))
+
+    def mark_disconnected(self, player_id):
+        """Flag a session as disconnected; it expires when the reconnect window closes."""
+        with self._lock:
+            session = self._sessions.get(player_id)
+            if session is None:
+                return
+            session['status'] = 'disconnected'
+            session['last_seen'] = time.time()
+            self._arm(player_id, self.reconnect_ttl)
+
+    def sweep(self, now=None):
+        """Evict every session whose deadline has passed. Returns the evicted IDs."""
+        now = time.time() if now is None else now
+        evicted = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, version, player_id = heapq.heappop(self._heap)
+                if self._deadline.get(player_id) != (deadline, version):
+                    continue  # re-armed or removed since this entry was pushed
+                session = self._sessions[player_id]
+                if session.get('in_game'):
+                    self._arm(player_id, self._ttl_for(session), now)
+                    continue
+                del self._sessions[player_id]
+                del self._deadline[player_id]
+                self.evictions += 1
+                evicted.append((player_id, session))
+        for player_id, session in evicted:
+            if self.on_evict:
+                try:
+                    self.on_evict(player_id, session)
+                except Exception as e:
+                    print(f"[WARN] Session eviction hook failed for {player_id}: {e}")
+        return [player_id for player_id, _ in evicted]
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def start_sweeper(self, max_interval=5.0):
+        """Run sweep() on a background thread, waking at the next deadline."""
+        def loop():
+            while True:
+                self.sweep()
+                deadline = self.next_deadline()
+                delay = max_interval if deadline is None else min(max_interval, max(0.05, deadline - time.time()))
+                time.sleep(delay)
+
+        thread = threading.Thread(target=loop, name="session-sweeper", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._sessions), 'evictions': self.evictions}
@@ -0,0 +1,170 @@
+"""
+sharding.py
+
+Pre-fork mode: several worker processes accept on the same port through
+SO_REUSEPORT, each running its own matchmaker and games. The kernel spreads
+new connections across workers, so a reconnecting player can land on a
+worker that does not hold their game. To route them back:
+
+  - a shared directory (multiprocessing.Manager dict) maps player_id -> worker index
+  - the same directory records which worker has a lone player waiting for
+    an opponent, so new players are sent there instead of waiting alone
+  - every worker listens on a Unix socket; a worker that receives a player
+    owned by someone else passes the accepted socket over with SCM_RIGHTS
+    (socket.send_fds) together with the ID line it already read.
+"""
+
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+
+# Directory key holding the index of a worker with a lone waiting player
+LOBBY_KEY = "__lobby__"
+# Seconds a worker gets to exit on its own after Ctrl-C before it is terminated
+WORKER_EXIT_GRACE = 2.0
+
+
+def bind_reuseport(host, port):
+    """Create a listening TCP socket that other workers can bind as well."""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform; run with --workers 1")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen()
+    return sock
+
+
+def handoff_path(port, index):
+    return os.path.join(tempfile.gettempdir(), f"beer-{port}-worker-{index}.sock")
+
+
+class ShardContext:
+    """
+    Per-worker view of the sharded server:
+      - index: this worker's number
+      - directory: shared {player_id: worker index} dict
+    """
+
+    def __init__(self, index, port, directory):
+        self.index = index
+        self.port = port
+        self.directory = directory
+
+    def claim(self, player_id):
+        """Record that this worker now holds player_id's session."""
+        try:
+            self.directory[player_id] = self.index
+        except Exception as e:
+            print(f"[WARN] Worker {self.index}: directory update failed: {e}")
+
+    def release(self, player_id):
+        try:
+            if self.directory.get(player_id) == self.index:
+                del self.directory[player_id]
+        except Exception:
+            pass
+
+    def owner(self, player_id):
+        """Index of the worker holding player_id, or None if unknown or ours."""
+        try:
+            owner = self.directory.get(player_id)
+        except Exception:
+            return None
+        return None if owner == self.index else owner
+
+    def advertise_waiting(self, waiting):
+        """Publish (or withdraw) that this worker has a lone player waiting."""
+        try:
+            if waiting:
+                self.directory[LOBBY_KEY] = self.index
+            elif self.directory.get(LOBBY_KEY) == self.index:
+                del self.directory[LOBBY_KEY]
+        except Exception:
+            pass
+
+    def lobby_owner(self):
+        """Index of another worker with a lone waiting player, or None."""
+        return self.owner(LOBBY_KEY)
+
+    def forward(self, sock, id_line, owner):
+        """
+        Hand an accepted client socket to the owning worker. The caller keeps
+        ownership of (and should close) its own copy of the socket afterwards.
+        Returns False if the owner could not be reached.
+        """
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as ctrl:
+                ctrl.connect(handoff_path(self.port, owner))
+                socket.send_fds(ctrl, [id_line.encode()], [sock.fileno()])
+            print(f"[INFO] Worker {self.index}: routed {id_line.strip()} to worker {owner}")
+            return True
+        except OSError as e:
+            print(f"[WARN] Worker {self.index}: handoff to worker {owner} failed: {e}")
+            return False
+
+    def start_handoff_listener(self, on_handoff):
+        """
+        Accept sockets forwarded by other workers and pass each one to
+        on_handoff(conn, id_line) on a background thread.
+        """
+        path = handoff_path(self.port, self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+
+        def loop():
+            while True:
+                ctrl, _ = listener.accept()
+                with ctrl:
+                    try:
+                        msg, fds, _, _ = socket.recv_fds(ctrl, 1024, 1)
+                    except OSError as e:
+                        print(f"[WARN] Worker {self.index}: bad handoff: {e}")
+                        continue
+                if not fds:
+                    continue
+                conn = socket.socket(fileno=fds[0])
+                try:
+                    on_handoff(conn, msg.decode(errors='replace'))
+                except Exception as e:
+                    print(f"[ERROR] Worker {self.index}: failed to adopt handed-off client: {e}")
+                    conn.close()
+
+        threading.Thread(target=loop, daemon=True).start()
+        return listener
+
+
+def run_workers(count, port, worker_main, *args):
+    """
+    Start `count` worker processes running worker_main(shard, *args) and
+    wait for them. Each worker gets its own ShardContext sharing one directory.
+    """
+    ctx = multiprocessing.get_context("fork")
+    manager = ctx.Manager()
+    directory = manager.dict()
+    workers = []
+    for index in range(count):
+        shard = ShardContext(index, port, directory)
+        proc = ctx.Process(target=worker_main, args=(shard,) + args, name=f"beer-worker-{index}", daemon=True)
+        proc.start()
+        workers.append(proc)
+    print(f"[INFO] Started {count} workers on port {port}")
+    try:
+        for proc in workers:
+            proc.join()
+    except KeyboardInterrupt:
+        print("\n[INFO] Stopping workers.")
+        # The workers got the same Ctrl-C; let them flush what they buffer before forcing them
+        for proc in workers:
+            proc.join(WORKER_EXIT_GRACE)
+        for proc in workers:
+            if proc.is_alive():
+                proc.terminate()
+    finally:
+        manager.shutdown()
@@ -0,0 +1,220 @@
+"""
+simulate.py
+
+Plays many games of one shooting strategy at once, to tune fleets, board
+sizes and timeouts. Boards are NumPy arrays with one row per game, so a
+step applies the strategy to every game still running.
+
+Strategies:
+  random  fire at cells in random order
+  hunt    random cells until a hit, then the neighbours of hits on ships not yet sunk
+  parity  as hunt, but hunting only on one colour of a checkerboard
+
+Fleets are placed like place_ships_randomly: ship by ship in fleet order,
+uniformly among the placements still legal on each board (the ones
+plan_fleet enumerates). A board that runs out of room starts over, and
+after a few tries plan_fleet places it instead.
+
+Prints the distribution of shots needed to sink the whole fleet, and how
+many turns a game between two players of that strategy lasts.
+
+Usage:
+    python simulate.py [--games 100000] [--strategy hunt] [--board-size 10] [--fleet classic]
+
+Needs NumPy (pip install numpy); nothing else in the project does.
+"""
+
+import argparse
+import random
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from battleship import BOARD_SIZE, CLASSIC_SHIPS, _placements, game_rules, parse_fleet, plan_fleet
+
+STRATEGIES = ("random", "hunt", "parity")
+
+# Games simulated together; memory is a few hundred bytes per cell of the batch
+DEFAULT_BATCH = 20_000
+# Larger boards get fewer games per batch: no more cells than DEFAULT_BATCH on 10x10
+BATCH_CELLS = DEFAULT_BATCH * BOARD_SIZE * BOARD_SIZE
+
+# place_fleets handles boards x placements x ship length up to this many at once
+PLACEMENT_ELEMENTS = 20_000_000
+
+# Batch placement attempts for a board before plan_fleet places it
+PLACEMENT_RETRIES = 5
+
+
+def place_fleets(games, size, fleet, rng):
+    """
+    Random placements of `fleet` on `games` boards at once. Returns an int16
+    array (games, size * size) holding the index into `fleet` of the ship
+    on each cell, or -1 for water.
+    """
+    # Its arrays are (boards, placements[, length]); on large boards, only some boards at a time
+    widest = max(len(_placements(size, length)[1]) * length for _, length in fleet)
+    chunk = max(1, PLACEMENT_ELEMENTS // widest)
+    if games > chunk:
+        return np.concatenate([place_fleets(min(chunk, games - start), size, fleet, rng)
+                               for start in range(0, games, chunk)])
+    ship_id = np.full((games, size * size), -1, dtype=np.int16)
+    pending = np.arange(games)
+    for _ in range(PLACEMENT_RETRIES):
+        if not len(pending):
+            return ship_id
+        cells = np.full((len(pending), size * size), -1, dtype=np.int16)
+        placed = np.ones(len(pending), dtype=bool)
+        rows = np.arange(len(pending))
+        for index, (_, length) in enumerate(fleet):
+            candidates = np.array(_placements(size, length)[1], dtype=np.intp)  # (K, length)
+            legal = (cells[:, candidates] < 0).all(axis=2)  # (boards, K)
+            keys = rng.random(legal.shape)
+            keys[~legal] = -1.0
+            choice = keys.argmax(axis=1)  # uniform among the legal ones
+            placed &= legal[rows, choice]
+            cells[rows[:, None], candidates[choice]] = index
+        ship_id[pending[placed]] = cells[placed]
+        pending = pending[~placed]
+    for game in pending:
+        seed = int(rng.integers(1 << 63))
+        for index, (_, row, col, length, orientation) in enumerate(plan_fleet(size, fleet, rng=random.Random(seed))):
+            step = 1 if orientation == 0 else size
+            start = row * size + col
+            ship_id[game, start:start + step * length:step] = index
+    return ship_id
+
+
+def shots_random(ship_id, rng):
+    """Shots to win firing in random order: the latest position of any ship cell in the order."""
+    order_keys = rng.random(ship_id.shape)
+    rank = order_keys.argsort(axis=1).argsort(axis=1)
+    return np.where(ship_id >= 0, rank, -1).max(axis=1) + 1
+
+
+def _neighbours(size):
+    """(cells, 4) table of each cell's up/down/left/right neighbours; off-board ones are the spare cell size * size."""
+    cells = size * size
+    index = np.arange(cells)
+    row, col = index // size, index % size
+    return np.stack([np.where(row > 0, index - size, cells), np.where(row < size - 1, index + size, cells),
+                     np.where(col > 0, index - 1, cells), np.where(col < size - 1, index + 1, cells)], axis=1)
+
+
+def shots_hunt(ship_id, size, fleet, rng, parity=False):
+    """
+    Shots to win for hunt/target, every game advancing one shot per step.
+    A hit stays open until fire_at would report its ship sunk, and each
+    open hit adds 1 to the score of its neighbours, so they are fired at
+    before any hunting cell (cells next to two hits first). Otherwise each
+    game hunts in its own random order, fixed up front, which is the same
+    as drawing an unshot cell at random every time.
+    """
+    games, cells = ship_id.shape
+    lengths = np.array([length for _, length in fleet], dtype=np.int16)
+    remaining = np.tile(lengths, (games, 1))
+    neighbours = _neighbours(size)
+    # Per cell: hunting priority (below 1) plus open hits next to it; -inf once fired at.
+    # The extra last column stands in for off-board neighbours.
+    score = np.empty((games, cells + 1), dtype=np.float32)
+    score[:, :cells] = rng.random((games, cells), dtype=np.float32) * np.float32(0.5)
+    if parity:
+        score[:, :cells] += np.float32(0.5) * (np.add.outer(np.arange(size), np.arange(size)) % 2 == 0).ravel()
+    score[:, cells] = -np.inf
+    result = np.zeros(games, dtype=np.int32)
+    active = np.arange(games)
+    rows = np.arange(games)
+    for step in range(1, cells + 1):
+        cell = score.argmax(axis=1)
+        score[rows, cell] = -np.inf
+        ship = ship_id[rows, cell]
+        hit = ship >= 0
+        hit_rows, hit_ship, hit_cell = rows[hit], ship[hit], cell[hit]
+        remaining[hit_rows, hit_ship] -= 1
+        score[hit_rows[:, None], neighbours[hit_cell]] += 1
+        sunk = remaining[hit_rows, hit_ship] == 0
+        if sunk.any():
+            # Its hits are no longer open: take back what they added to their neighbours
+            sunk_rows, sunk_ship = hit_rows[sunk], hit_ship[sunk]
+            which, ship_cells = np.nonzero(ship_id[sunk_rows] == sunk_ship[:, None])
+            np.subtract.at(score, (sunk_rows[which][:, None], neighbours[ship_cells]), 1)
+            finished = sunk_rows[remaining[sunk_rows].sum(axis=1) == 0]
+            result[active[finished]] = step
+        # Finished games keep firing (at water) until enough of them are worth dropping
+        done = result[active] > 0
+        if done.all():
+            break
+        if done.sum() * 4 >= len(active):
+            keep = ~done
+            active, ship_id, remaining, score = active[keep], ship_id[keep], remaining[keep], score[keep]
+            rows = np.arange(len(active))
+    return result
+
+
+def simulate(games, size=BOARD_SIZE, fleet=CLASSIC_SHIPS, strategy="hunt", batch=DEFAULT_BATCH, seed=None):
+    """Shots needed to sink the fleet in each of `games` games, as an int array."""
+    rng = np.random.default_rng(seed)
+    batch = max(1, min(batch, BATCH_CELLS // (size * size)))
+    results = []
+    for start in range(0, games, batch):
+        ship_id = place_fleets(min(batch, games - start), size, fleet, rng)
+        if strategy == "random":
+            results.append(shots_random(ship_id, rng))
+        else:
+            results.append(shots_hunt(ship_id, size, fleet, rng, parity=strategy == "parity"))
+    return np.concatenate(results)
+
+
+def game_turns(shots):
+    """
+    Turns in games between two players of the same strategy: player 1
+    fires at the board of game 2n and moves first, player 2 at game 2n+1.
+    """
+    first, second = shots[0:len(shots) - 1:2], shots[1::2]
+    return np.where(first <= second, 2 * first - 1, 2 * second)
+
+
+def describe(label, values):
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    print(f"{label:<14} mean {values.mean():7.1f}  p50 {p50:5.0f}  p90 {p90:5.0f}  p99 {p99:5.0f}  "
+          f"min {values.min():4d}  max {values.max():4d}")
+
+
+def histogram(values, bins=12, width=50):
+    counts, edges = np.histogram(values, bins=min(bins, int(values.max() - values.min()) + 1))
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        print(f"  {low:6.0f}-{high:<6.0f} {'#' * int(round(width * count / counts.max())):<{width}} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many Battleship games with NumPy")
+    parser.add_argument("--games", type=int, default=100_000)
+    parser.add_argument("--strategy", choices=STRATEGIES, default="hunt")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE, metavar="N")
+    parser.add_argument("--fleet", default="classic", metavar="SPEC", help="as for server.py --fleet")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="games simulated together (fewer on boards over 10x10)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("[ERROR] simulate.py needs NumPy: pip install numpy")
+    try:
+        fleet = game_rules(args.board_size, parse_fleet(args.fleet))['fleet']
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    shots = simulate(args.games, args.board_size, fleet, args.strategy, args.batch, args.seed)
+    seconds = time.perf_counter() - start
+    print(f"{args.games} games, {args.strategy}, {args.board_size}x{args.board_size}, "
+          f"{len(fleet)} ships: {seconds:.2f} s ({args.games / seconds * 60:,.0f} games/min)")
+    describe("shots to win", shots)
+    if len(shots) >= 2:
+        describe("game turns", game_turns(shots))
+    histogram(shots)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+tracing.py
+
+Lifecycle spans for games, to break latency down by stage under load:
+  handshake     accept -> ID line read (one per player)
+  queue_wait    ready queue -> paired by the matchmaker (one per player)
+  pairing       paired -> game thread running
+  setup_board   one per player
+  turn          one per turn, with children
+                  prompt      boards and "Your turn!" written
+                  read_input  waiting for the player's command
+                  fire        Board.fire_at
+                  send_board  results, deltas and boards for the shot
+Every span of a game shares its trace ID and carries the game ID; turn
+spans also carry the turn number and the shooter.
+
+Sampling is decided once per game (--trace-sample), so a sampled game is
+traced completely and the rest cost one random() call. Spans are written
+as JSON lines to --trace-file by a group_commit.GroupCommitWriter, so game
+threads only append to a list; the server flushes it when it shuts down.
+Field names follow the OpenTelemetry span model (trace_id, span_id,
+parent_span_id, start_time_unix_nano, ...):
+
+  {"trace_id": "4bf9...", "span_id": "00f0...", "parent_span_id": "a3ce...", "name": "read_input",
+   "start_time_unix_nano": 1700000000000000000, "end_time_unix_nano": 1700000000012000000,
+   "attributes": {"game_id": 3, "turn": 7, "player": 1}, "status": "ok"}
+
+Usage:
+    trace = tracing.TRACER.start_trace("game", game_id=3)
+    with trace.child("turn", turn=1) as turn:
+        with turn.child("read_input"):
+            ...
+    trace.end()
+
+`python tracing.py FILE` prints p50/p99 per stage of an exported file.
+"""
+
+import json
+import os
+import random
+import time
+
+from group_commit import GroupCommitWriter
+
+EXPORT_INTERVAL = 0.5
+DEFAULT_SAMPLE_RATE = 0.1
+
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def now():
+    """Span timestamps: wall clock in nanoseconds, as OpenTelemetry uses."""
+    return time.time_ns()
+
+
+class Span:
+    """One timed stage. Use as a context manager, or call end()."""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start", "attributes")
+
+    def __init__(self, tracer, trace_id, name, parent_id=None, start=None, attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = now() if start is None else start
+        self.attributes = attributes or {}
+
+    def child(self, name, **attributes):
+        """Start a span inside this one; it inherits this span's attributes."""
+        return Span(self.tracer, self.trace_id, name, self.span_id, attributes={**self.attributes, **attributes})
+
+    def record(self, name, start, end, **attributes):
+        """A child stage that was timed elsewhere (e.g. before the game existed)."""
+        span = Span(self.tracer, self.trace_id, name, self.span_id, start, {**self.attributes, **attributes})
+        span.end(end)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, end=None, status="ok"):
+        self.tracer.export(self, now() if end is None else end, status)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(status="ok" if exc_type is None else "error")
+        return False
+
+
+class _NoSpan:
+    """Stands in for a span of a game that is not sampled: every call does nothing."""
+
+    trace_id = None
+
+    def child(self, name, **attributes):
+        return self
+
+    def record(self, name, start, end, **attributes):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, end=None, status="ok"):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """
+    Starts sampled traces and exports their finished spans to `path`.
+    Without a path (the default) every trace is NO_SPAN.
+    """
+
+    def __init__(self, path=None, sample_rate=DEFAULT_SAMPLE_RATE, export_interval=EXPORT_INTERVAL):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.export_interval = export_interval
+        self.exported = 0
+        self._file = None
+        self._writer = None
+        if path:
+            self._file = open(path, 'a', encoding='utf-8')
+            self._writer = GroupCommitWriter(self._write, export_interval, "trace-export", "Trace export")
+
+    @property
+    def enabled(self):
+        return self._file is not None and self.sample_rate > 0
+
+    def start_trace(self, name, start=None, **attributes):
+        """Root span of a new trace, or NO_SPAN if this one is not sampled."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return NO_SPAN
+        return Span(self, os.urandom(16).hex(), name, start=start, attributes=attributes)
+
+    def export(self, span, end, status):
+        self._writer.append((span.trace_id, span.span_id, span.parent_id, span.name,
+                             span.start, end, span.attributes, status))
+
+    def flush(self, timeout=2.0):
+        """Write every span ended so far; True once they are all written."""
+        return self._writer is None or self._writer.flush(timeout)
+
+    def _write(self, batch):
+        self._file.write(''.join(_encoder.encode({
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_span_id': parent_id,
+            'name': name,
+            'start_time_unix_nano': start,
+            'end_time_unix_nano': end,
+            'attributes': attributes,
+            'status': status,
+        }) + '\n' for trace_id, span_id, parent_id, name, start, end, attributes, status in batch))
+        self._file.flush()
+        self.exported += len(batch)
+
+
+TRACER = Tracer()
+
+
+def record_arrival(trace, player_id, session):
+    """
+    Spans for how a player got into a game, from the tracing.now() times
+    the server keeps on their session: 'accepted_at', 'registered_at',
+    'queued_at' and 'paired_at' (missing ones are skipped).
+    """
+    accepted, registered = session.get('accepted_at'), session.get('registered_at')
+    if accepted is not None and registered is not None:
+        trace.record("handshake", accepted, registered, player=player_id)
+    queued, paired = session.get('queued_at'), session.get('paired_at')
+    if queued is not None and paired is not None:
+        trace.record("queue_wait", queued, paired, player=player_id)
+        trace.record("pairing", paired, now(), player=player_id)
+
+
+def configure(path, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Start exporting to path (called once at startup, from --trace-file)."""
+    global TRACER
+    TRACER = Tracer(path, sample_rate)
+    print(f"[INFO] Tracing {sample_rate:.0%} of games to {path}")
+    return TRACER
+
+
+def summarize(path):
+    """Per-stage latency of an exported file: count, p50, p99 and max in ms."""
+    durations = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            span = json.loads(line)
+            ms = (span['end_time_unix_nano'] - span['start_time_unix_nano']) / 1e6
+            durations.setdefault(span['name'], []).append(ms)
+    print(f"{'span':<12} {'count':>7} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for name, values in sorted(durations.items()):
+        values.sort()
+        p50 = values[len(values) // 2]
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        print(f"{name:<12} {len(values):>7} {p50:>10.2f} {p99:>10.2f} {values[-1]:>10.2f}")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py TRACE_FILE")
+        sys.exit(1)
+    summarize(sys.argv[1])
@@ -1,11 +1,22 @@
 
+import base64
+import selectors
+import socket
+import struct
+import threading
+import time
+import weakref
 import zlib
+from collections import deque
+from contextlib import contextmanager
 
 
 PACKET_TYPE_MESSAGE = 1
 PACKET_TYPE_COMMAND = 2
 PACKET_TYPE_RESULT = 3
 PACKET_TYPE_CONTROL = 4
+PACKET_TYPE_BOARD = 5   # whole board, compact (protocol v2 only)
+PACKET_TYPE_DELTA = 6   # cells changed by the last shot (protocol v2 only)
 
 
 def encode_packet(pkt_type: int, payload: str) -> str:
@@ -22,19 +33,961 @@ def decode_packet(raw: str):
         payload = parts[2]
         expected_checksum = f"{zlib.crc32(payload.encode()) & 0xffffffff:08x}"
         if expected_checksum != checksum: 
+            counters.CHECKSUM_FAILURES[PROTOCOL_V1].inc()
             return None, None, None  # failed checksum
         return pkt_type, checksum, payload
     except Exception:
+        counters.CHECKSUM_FAILURES[PROTOCOL_V1].inc()
         return None, None, None
     
 def send_packet_message(wfile, pkt_type: int, payload: str):
     """
-    Encode and send a structured message through the given wfile.
+    Encode and send a structured message through the given wfile
+    (a PacketWriter, or a plain text file for protocol v1).
     """
     try:
+        if isinstance(wfile, PacketWriter):
+            wfile.send_packet(pkt_type, payload)
+            return
         msg = encode_packet(pkt_type, payload)
         wfile.write(msg + '\n')
         wfile.flush()
     except Exception as e:
         print(f"[WARN] Failed to send message: {e}")
         raise
+
+
+# ----------------------------------------------------------------------
+# Protocol v2: length-prefixed binary frames
+# ----------------------------------------------------------------------
+#
+# Negotiated per connection: a client that sends "ID <player_id> proto=2"
+# gets the plain-text line "PROTO 2" back, and from then on both sides send
+#
+#   +------+-------+----------------+--------------+----------+-----------------+
+#   | type | flags | payload length | header check |  CRC32   | payload (UTF-8) |
+#   |  u8  |  u8   |   u16 (BE)     |   u16 (BE)   | u32 (BE) |                 |
+#   +------+-------+----------------+--------------+----------+-----------------+
+#
+# The header check is the low 16 bits of the CRC32 of type, flags and length,
+# so a corrupted length is caught before it is trusted; the reader then looks
+# for the next header one byte at a time. The CRC32 covers those three fields
+# too, plus the sequence number (arq) and the payload.
+#
+# Payloads may contain newlines. ID lines (the handshake and SEND-ID
+# replies) stay plain text in both versions. A client that asks for nothing
+# keeps speaking v1 ("<type>|<crc hex>|<payload>\n").
+#
+# Integrity modes (v2 only), asked for with "integrity=<mode>" on the ID line
+# and confirmed in the reply ("PROTO 2 integrity=<mode>"; a bare "PROTO 2"
+# means crc32):
+#   none   no payload checksum (FLAG_NO_CRC, CRC field 0): TCP already checks
+#          the data. The header check is still there to keep the framing.
+#   crc32  the default; a corrupted frame is dropped
+#   arq    FLAG_SEQ: a u16 sequence number follows the header and is covered
+#          by the CRC. A receiver that sees a corrupted frame (or header) or a
+#          gap sends a NAK packet with the sequence number it expects, and the
+#          sender resends everything from there (go-back-N) out of its last
+#          RETRANSMIT_WINDOW frames. Unsequenced frames (e.g. spectator
+#          fan-out, which is shared by all spectators) are plain crc32.
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+V2_HEADER = struct.Struct("!BBHHI")
+V2_FRAMING = struct.Struct("!BBH")  # the fields the header check covers
+V2_CHECKS = struct.Struct("!HI")    # header check, CRC32
+_FRAMING = V2_FRAMING.size
+V2_SEQ = struct.Struct("!H")
+V2_MAX_PAYLOAD = 0xFFFF
+
+PACKET_TYPE_NAK = 7     # payload: sequence number to resend from (arq only)
+FLAG_SEQ = 0x01
+FLAG_NO_CRC = 0x02
+
+INTEGRITY_NONE = "none"
+INTEGRITY_CRC32 = "crc32"
+INTEGRITY_ARQ = "arq"
+INTEGRITY_MODES = (INTEGRITY_NONE, INTEGRITY_CRC32, INTEGRITY_ARQ)
+DEFAULT_INTEGRITY = INTEGRITY_CRC32
+RETRANSMIT_WINDOW = 1024
+# A receiver waiting for a resend NAKs again if frames keep arriving past the gap for this long
+NAK_RETRY = 0.2
+
+
+class _NoCounter:
+    def inc(self, amount=1):
+        pass
+
+
+class _NoMetrics:
+    """
+    The counters this module records into until the server installs
+    metrics.py with count_with(). Clients and tools that import utils thus
+    neither load the metrics registry nor count their own traffic.
+    """
+
+    _none = _NoCounter()
+    FRAMES_IN = FRAMES_OUT = CHECKSUM_FAILURES = {PROTOCOL_V1: _none, PROTOCOL_V2: _none}
+    RETRANSMITS = _none
+
+
+counters = _NoMetrics
+
+
+def count_with(registry):
+    """Record frames, checksum failures and retransmits in registry (the server's metrics module)."""
+    global counters
+    counters = registry
+
+
+def encode_frame(pkt_type: int, payload: str, flags: int = 0,
+                 integrity: str = INTEGRITY_CRC32, seq: int = 0) -> bytes:
+    data = payload.encode()
+    if integrity == INTEGRITY_NONE:
+        flags |= FLAG_NO_CRC
+    elif integrity == INTEGRITY_ARQ:
+        flags |= FLAG_SEQ
+    framing = V2_FRAMING.pack(pkt_type, flags, len(data))
+    check = zlib.crc32(framing)
+    if integrity == INTEGRITY_NONE:
+        return framing + V2_CHECKS.pack(check & 0xFFFF, 0) + data
+    prefix = V2_SEQ.pack(seq) if integrity == INTEGRITY_ARQ else b""
+    crc = zlib.crc32(data, zlib.crc32(prefix, check))
+    return framing + V2_CHECKS.pack(check & 0xFFFF, crc) + prefix + data
+
+
+def header_intact(header) -> bool:
+    """Check the framing fields of a v2 header before its length is used."""
+    return zlib.crc32(header[:_FRAMING]) & 0xFFFF == V2_CHECKS.unpack_from(header, _FRAMING)[0]
+
+
+def frame_intact(header, prefix, payload) -> bool:
+    """Check a received v2 frame; prefix is its sequence number bytes (empty if unsequenced)."""
+    if header[1] & FLAG_NO_CRC:
+        return True
+    crc = zlib.crc32(prefix, zlib.crc32(header[:_FRAMING]))
+    return zlib.crc32(payload, crc) == V2_CHECKS.unpack_from(header, _FRAMING)[1]
+
+
+def encode_for(proto: int, pkt_type: int, payload: str, integrity: str = INTEGRITY_CRC32) -> bytes:
+    """
+    Encode one packet as it goes on the wire for the given protocol version.
+    Sequenced (arq) frames come from a RetransmitBuffer instead; here arq
+    means a plain crc32 frame.
+    """
+    if proto == PROTOCOL_V2:
+        return encode_frame(pkt_type, payload,
+                            integrity=INTEGRITY_NONE if integrity == INTEGRITY_NONE else INTEGRITY_CRC32)
+    return (encode_packet(pkt_type, payload) + '\n').encode()
+
+
+def parse_id_line(id_line: str):
+    """
+    Split "ID <player_id> [proto=N] [integrity=MODE]" into
+    (player_id, protocol version, integrity mode).
+    """
+    player_id = id_line.strip().split(" ", 1)[1]
+    options = {}
+    while True:
+        head, sep, option = player_id.rpartition(" ")
+        key, eq, value = option.partition("=")
+        if not sep or not eq or key not in ("proto", "integrity"):
+            break
+        options[key] = value
+        player_id = head
+    proto = PROTOCOL_V2 if options.get("proto") == str(PROTOCOL_V2) else PROTOCOL_V1
+    integrity = options.get("integrity", DEFAULT_INTEGRITY)
+    if proto != PROTOCOL_V2 or integrity not in INTEGRITY_MODES:
+        integrity = DEFAULT_INTEGRITY
+    return player_id, proto, integrity
+
+
+def proto_ack(integrity: str) -> str:
+    """The server's reply to a v2 ID line."""
+    if integrity == DEFAULT_INTEGRITY:
+        return f"PROTO {PROTOCOL_V2}"
+    return f"PROTO {PROTOCOL_V2} integrity={integrity}"
+
+
+def parse_proto_ack(reply: str):
+    """Integrity mode confirmed by a "PROTO 2 ..." reply, or None if the server only speaks v1."""
+    words = reply.split()
+    if words[:2] != ["PROTO", str(PROTOCOL_V2)]:
+        return None
+    for word in words[2:]:
+        key, _, value = word.partition("=")
+        if key == "integrity" and value in INTEGRITY_MODES:
+            return value
+    return DEFAULT_INTEGRITY
+
+
+class RetransmitBuffer:
+    """Sending half of arq: numbers frames and keeps the last `window` for resends."""
+
+    def __init__(self, window=RETRANSMIT_WINDOW):
+        self.next_seq = 0
+        self.sent = deque(maxlen=window)    # (seq, frame)
+
+    def frame(self, pkt_type: int, payload: str) -> bytes:
+        seq = self.next_seq
+        self.next_seq = (seq + 1) & 0xFFFF
+        frame = encode_frame(pkt_type, payload, integrity=INTEGRITY_ARQ, seq=seq)
+        self.sent.append((seq, frame))
+        return frame
+
+    def since(self, seq: int):
+        """Every kept frame from seq onwards, or None if seq has left the window."""
+        frames = list(self.sent)
+        for i, (sent_seq, _) in enumerate(frames):
+            if sent_seq == seq:
+                return [frame for _, frame in frames[i:]]
+        if seq == self.next_seq:
+            return []   # nothing was missed after all
+        return None
+
+
+class SequenceChecker:
+    """
+    Receiving half of arq. check() says whether a sequenced frame is the next
+    one to deliver, and returns the sequence number to NAK, if any: frames
+    after a gap are dropped until the resend arrives.
+    """
+
+    def __init__(self):
+        self.expected = 0
+        self.last_nak = None
+        self.naks = 0
+
+    def check(self, seq: int, intact: bool):
+        """Return (deliver, nak_seq or None)."""
+        if intact:
+            ahead = (seq - self.expected) & 0xFFFF
+            if ahead == 0:
+                self.expected = (seq + 1) & 0xFFFF
+                self.last_nak = None
+                return True, None
+            if ahead >= 0x8000:
+                return False, None  # a duplicate from a resend; already delivered
+        return False, self.lost()
+
+    def lost(self):
+        """
+        A frame was corrupted, possibly in its header so that its sequence
+        number is unknown: the sequence number to NAK, or None if a NAK was
+        just sent.
+        """
+        now = time.monotonic()
+        if self.last_nak is not None and now - self.last_nak < NAK_RETRY:
+            return None  # the resend is on its way
+        self.last_nak = now
+        self.naks += 1
+        return self.expected
+
+    def overdue(self):
+        """
+        The sequence number to NAK again if a resend has not arrived within
+        NAK_RETRY (it may have been corrupted too), else None. check() only
+        runs when a frame arrives, so a reader that waits calls this.
+        """
+        if self.last_nak is None or time.monotonic() - self.last_nak < NAK_RETRY:
+            return None
+        self.last_nak = time.monotonic()
+        self.naks += 1
+        return self.expected
+
+
+# Corked writers hold frames back until a logical boundary (flush()), until
+# FLUSH_BYTES are waiting, or for at most FLUSH_DELAY seconds.
+FLUSH_BYTES = 16 * 1024
+FLUSH_DELAY = 0.005
+
+
+class PacketWriter:
+    """
+    Sends packets on a socket in the connection's protocol version;
+    send_packet_message() dispatches here.
+
+    Normally every packet is sent straight away. Between cork() and uncork()
+    packets are collected and go out together, in one send(), when the game
+    reaches a boundary and calls flush() (a prompt is about to be read, a turn
+    ended), when FLUSH_BYTES have piled up, or after FLUSH_DELAY at the latest.
+    """
+
+    def __init__(self, sock, proto=PROTOCOL_V2, integrity=DEFAULT_INTEGRITY):
+        self.sock = sock
+        self.proto = proto
+        self.integrity = integrity
+        self.lock = threading.Lock()  # frames from different threads must not interleave
+        self._out = []
+        self._size = 0
+        self._corked = 0
+        self._error = None  # a failed delayed flush, raised on the next write
+        self._partial = False  # _out[0] is the unsent end of a frame a non-blocking send started
+        self._sent = RetransmitBuffer() if integrity == INTEGRITY_ARQ and proto == PROTOCOL_V2 else None
+        self.sends = 0
+        self.resends = 0
+
+    def send_packet(self, pkt_type: int, payload: str):
+        if self._sent is None:
+            self.write(encode_for(self.proto, pkt_type, payload, self.integrity))
+            return
+        with self.lock:  # sequence numbers must reach the wire in the order they are given out
+            self._queue_locked(self._sent.frame(pkt_type, payload))
+
+    def send_line(self, text: str):
+        """Plain-text line (ID replies), outside the framing."""
+        self.write((text + '\n').encode())
+
+    def send_nak(self, seq: int):
+        """Ask the peer to resend from seq (arq); goes out at once, even when corked."""
+        with self.lock:
+            self._out.append(encode_frame(PACKET_TYPE_NAK, str(seq)))
+            self._flush_locked()
+
+    def retransmit(self, seq: int, wait: bool = True) -> bool:
+        """
+        Answer a NAK: resend every frame from seq. Frames still held back
+        are part of that, so they are dropped from the buffer first. With
+        wait=False (a shared thread answering) nothing blocks: False means
+        another thread was sending and nothing was done; otherwise what the
+        socket did not take is left for flush_nowait() or the next write.
+        """
+        if wait:
+            self.lock.acquire()
+        elif not self.lock.acquire(blocking=False):
+            return False
+        try:
+            frames = self._sent.since(seq) if self._sent is not None else None
+            if frames is None:
+                raise ConnectionError(f"cannot resend frame {seq}: no longer buffered")
+            self.resends += len(frames)
+            counters.RETRANSMITS.inc(len(frames))
+            # Frames still held back are part of the resend; the end of one already started is not
+            self._out[:] = self._out[:1] + frames if self._partial else frames
+            if wait:
+                self._flush_locked()
+            else:
+                self._send_nowait_locked()
+            return True
+        finally:
+            self.lock.release()
+
+    def write(self, data: bytes):
+        with self.lock:
+            self._queue_locked(data)
+
+    def send_nowait(self, pkt_type: int, payload: str) -> bool:
+        """
+        Queue a packet and send everything queued, without blocking (keepalive
+        pings). False if another thread is busy sending, so the packet was
+        dropped, or the socket could not take it all; the rest then goes out
+        with the connection's next write.
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self._error is not None:
+                raise self._error
+            self._out.append(self._sent.frame(pkt_type, payload) if self._sent is not None
+                             else encode_for(self.proto, pkt_type, payload, self.integrity))
+            return self._send_nowait_locked()
+        finally:
+            self.lock.release()
+
+    def flush_nowait(self) -> bool:
+        """flush() without blocking on the socket or on another thread; True if nothing is left queued."""
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            return self._error is None and self._send_nowait_locked()
+        finally:
+            self.lock.release()
+
+    def _send_nowait_locked(self):
+        if not self._out:
+            return True
+        data = self._out[0] if len(self._out) == 1 else b"".join(self._out)
+        try:
+            sent = self.sock.send(data, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            sent = 0
+        except OSError as e:
+            self._error = e
+            raise
+        if sent:
+            self.sends += 1
+        if sent == len(data):
+            counters.FRAMES_OUT[self.proto].inc(len(self._out) - self._partial)
+            self._out.clear()
+            self._size = 0
+            self._partial = False
+            return True
+        if not sent:
+            return False  # nothing started; _out and _partial stay as they were
+        # Frames not started yet are counted when they go out; a started one is counted now
+        done = 0
+        for i, frame in enumerate(self._out):
+            done += len(frame)
+            if done > sent:
+                break
+        started = sent > done - len(frame)
+        counters.FRAMES_OUT[self.proto].inc(i + started - self._partial)
+        self._out[:] = [data[sent:done]] + self._out[i + 1:]
+        self._size = len(data) - sent
+        self._partial = started
+        return False
+
+    def _queue_locked(self, data: bytes):
+        if self._error is not None:
+            raise self._error
+        self._out.append(data)
+        self._size += len(data)
+        if self._corked and self._size < FLUSH_BYTES:
+            if len(self._out) == 1:
+                _flusher.schedule(self)
+            return
+        self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            if self._error is not None:
+                raise self._error
+            self._flush_locked()
+
+    def cork(self):
+        with self.lock:
+            self._corked += 1
+
+    def uncork(self):
+        with self.lock:
+            self._corked -= 1
+            if not self._corked:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._out:
+            return
+        data = self._out[0] if len(self._out) == 1 else b"".join(self._out)
+        counters.FRAMES_OUT[self.proto].inc(len(self._out) - self._partial)
+        self._out.clear()
+        self._size = 0
+        self._partial = False
+        self.sends += 1
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            self._error = e
+            raise
+
+    def close(self):
+        pass  # the socket belongs to the connection, not the writer
+
+
+class _DelayedFlusher:
+    """
+    One background thread that flushes corked writers FLUSH_DELAY after their
+    first buffered frame, so a boundary the game forgot about costs at most
+    a few milliseconds. It never blocks on a socket (see flush_nowait), so a
+    peer that stopped reading delays no one else. Started on first use (it
+    must not exist before a fork).
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = deque()    # (deadline, writer), in deadline order
+        self.thread = None
+
+    def schedule(self, writer):
+        with self.cond:
+            self.queue.append((time.monotonic() + FLUSH_DELAY, writer))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="packet-flusher", daemon=True)
+                self.thread.start()
+            if len(self.queue) == 1:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue)
+                deadline, writer = self.queue[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                self.queue.popleft()
+            try:
+                # One peer that stopped reading must not hold up every other writer: what its
+                # socket cannot take now goes out with the game's next flush
+                writer.flush_nowait()
+            except OSError:
+                pass  # remembered by the writer; the game sees it on its next send
+
+
+_flusher = _DelayedFlusher()
+
+
+class _NakWatcher:
+    """
+    One background thread that polls the readers given to it (see
+    PacketReader.watch_naks) every NAK_RETRY. The game only reads a player
+    while waiting for their move, so without this an arq peer's NAK would
+    wait for that player's next turn to be answered. Connections drop out
+    when they close. Started on first use (it must not exist before a fork).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readers = weakref.WeakSet()
+        self.thread = None
+
+    def watch(self, reader):
+        with self.lock:
+            self.readers.add(reader)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="nak-watcher", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(NAK_RETRY)
+            with self.lock:
+                readers = list(self.readers)
+            for reader in readers:
+                if not reader.poll():
+                    with self.lock:
+                        self.readers.discard(reader)
+
+
+_nak_watcher = _NakWatcher()
+
+
+@contextmanager
+def corked(*wfiles):
+    """Coalesce everything sent on these writers until the block ends (or they are flushed)."""
+    writers = [w for w in wfiles if isinstance(w, PacketWriter)]
+    for w in writers:
+        w.cork()
+    try:
+        yield
+    finally:
+        for w in writers:
+            try:
+                w.uncork()
+            except OSError:
+                pass  # the connection is gone; whoever reads from it next will notice
+
+
+# Receive buffers start at READ_BUFFER bytes and may grow to MAX_READ_BUFFER,
+# enough for the largest v2 frame; a longer v1 line ends the connection.
+READ_BUFFER = 16 * 1024
+MAX_READ_BUFFER = 128 * 1024
+_MIN_RECV = 4096
+
+
+class PacketReader:
+    """
+    Incremental decoder for either protocol version, straight from the socket.
+
+    Bytes are recv_into() one reusable bytearray. v2 frames are located and
+    CRC-checked through memoryview slices of it, so the only per-frame
+    allocations are the payload string and its tuple; v1 lines are split out
+    of the received bytes in one pass and checked without re-encoding. Each
+    recv() decodes every complete frame it brought in: read_packets() returns
+    that batch and read_packet() hands it out one frame at a time.
+
+    Sequenced (arq) frames are delivered in order only: a corrupted frame or
+    a gap is answered with a NAK through `writer` (the connection's
+    PacketWriter), and NAKs from the peer are answered by resending from it
+    whenever the connection is read (watch_naks() makes sure it is).
+    """
+
+    def __init__(self, sock, proto=PROTOCOL_V2, writer=None):
+        self.sock = sock
+        self.proto = proto
+        self.writer = writer
+        self.sequence = SequenceChecker()
+        self.lock = threading.Lock()  # held by whoever is reading; see poll()
+        self.on_pong = None  # called with the payload of each keepalive PONG
+        self._polling = False  # poll() is reading, on a thread shared by many connections
+        self._unanswered = None  # a NAK poll() could not answer without blocking
+        self._unflushed = False  # poll() queued a resend the socket has not taken all of yet
+        self._buf = bytearray(READ_BUFFER)
+        self._view = memoryview(self._buf)
+        self._start = 0     # first byte not yet decoded
+        self._end = 0       # end of the received bytes
+        self._lost_sync = False  # a v2 header was corrupted; looking for the next one
+        self._ready = deque()
+        self._decode = self._decode_v2 if proto == PROTOCOL_V2 else self._decode_v1
+
+    def buffered(self) -> bool:
+        """True if a whole frame is already buffered (select() would not see it)."""
+        if not self._ready:
+            self._decode(self._ready)
+        return bool(self._ready)
+
+    def read_packet(self):
+        """
+        Return (pkt_type, payload) for the next frame, or None at end of
+        stream. A v2 frame whose checksum does not match comes back as
+        (None, ""); a v1 line that is not a valid packet as (None, <stripped line>).
+        """
+        if not self._ready:
+            batch = self.read_packets()
+            if batch is None:
+                return None
+            self._ready.extend(batch)
+        return self._ready.popleft()
+
+    def receive(self) -> bool:
+        """One recv() for callers that select() first, decoding what it brought; False at end of stream."""
+        if not self._fill():
+            return False
+        self._decode(self._ready)
+        return True
+
+    def poll(self) -> bool:
+        """
+        Receive what has already arrived, without blocking and only if no
+        other thread is reading, so keepalive PONGs are handled while the
+        game is not waiting on this connection. False at end of stream.
+        """
+        if not self.lock.acquire(blocking=False):
+            return True  # the reader will see them
+        self._polling = True
+        try:
+            if self._unanswered is not None:
+                self._resend(self._unanswered)
+            elif self._unflushed:
+                self._unflushed = not self.writer.flush_nowait()
+            with selectors.DefaultSelector() as selector:  # select() cannot take fds >= FD_SETSIZE
+                selector.register(self.sock, selectors.EVENT_READ)
+                ready = selector.select(0)
+            return self.receive() if ready else True
+        except (OSError, ValueError):
+            return False
+        finally:
+            self._polling = False
+            self.lock.release()
+
+    def watch_naks(self):
+        """
+        Have a background thread poll() this (arq) connection every
+        NAK_RETRY, so the peer's NAKs are answered even while the game is
+        waiting on someone else rather than reading this connection.
+        """
+        _nak_watcher.watch(self)
+
+    def read_packets(self):
+        """Every frame available, receiving (blocking) only if none is; None at end of stream."""
+        batch = list(self._ready)
+        self._ready.clear()
+        self._decode(batch)
+        while not batch:
+            if not self._fill():
+                return None
+            self._decode(batch)
+        return batch
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buf) > READ_BUFFER:  # back to normal after an unusually large frame
+                self._buf = bytearray(READ_BUFFER)
+                self._view = memoryview(self._buf)
+        elif len(self._buf) - self._end < _MIN_RECV:
+            self._make_room()
+        count = self.sock.recv_into(self._view[self._end:])
+        self._end += count
+        return count > 0
+
+    def _make_room(self):
+        """Move the partial frame to the front, growing the buffer if it is full."""
+        pending = self._end - self._start
+        size = len(self._buf)
+        if pending + _MIN_RECV > size:
+            if size >= MAX_READ_BUFFER:
+                raise ConnectionError(f"frame larger than {MAX_READ_BUFFER} bytes")
+            size = min(size * 2, MAX_READ_BUFFER)
+        if size != len(self._buf):
+            buf = bytearray(size)
+            buf[:pending] = self._view[self._start:self._end]
+            self._buf, self._view = buf, memoryview(buf)
+        else:
+            self._view[:pending] = self._view[self._start:self._end]  # memmove; the ranges may overlap
+        self._start, self._end = 0, pending
+
+    def _decode_v2(self, out):
+        buf, view = self._buf, self._view
+        end = self._end
+        header = V2_HEADER.size
+        unpack_header, crc32 = V2_HEADER.unpack_from, zlib.crc32
+        frames = failures = 0
+        while end - self._start >= header:
+            pos = self._start
+            pkt_type, flags, length, check, crc = unpack_header(buf, pos)
+            framing = crc32(view[pos:pos + _FRAMING])
+            if framing & 0xFFFF != check:
+                # The length cannot be trusted: look for the next frame from the next byte
+                self._start = pos + 1
+                if self._lost_sync:
+                    continue
+                self._lost_sync = True
+                frames += 1
+                failures += 1
+                if self.writer is not None and self.writer.integrity == INTEGRITY_ARQ:
+                    nak = self.sequence.lost()
+                    if nak is not None:
+                        self.writer.send_nak(nak)
+                else:
+                    out.append((None, ""))
+                continue
+            self._lost_sync = False
+            body = pos + header + (V2_SEQ.size if flags & FLAG_SEQ else 0)
+            stop = body + length
+            if stop > end:
+                break
+            self._start = stop
+            frames += 1
+            payload = view[body:stop]
+            intact = flags & FLAG_NO_CRC or crc32(payload, crc32(view[pos + header:body], framing)) == crc
+            if not intact:
+                failures += 1
+            if flags & FLAG_SEQ:
+                deliver, nak = self.sequence.check(V2_SEQ.unpack_from(buf, pos + header)[0], intact)
+                if nak is not None and self.writer is not None:
+                    self.writer.send_nak(nak)
+                if not deliver:
+                    continue
+            elif not intact:
+                out.append((None, ""))
+                continue
+            if pkt_type == PACKET_TYPE_NAK:
+                self._answer_nak(payload)
+                continue
+            if pkt_type == PACKET_TYPE_CONTROL and payload[:4] == b"PONG":
+                self._pong(bytes(payload))
+                continue
+            out.append((pkt_type, str(payload, 'utf-8', 'replace')))
+        if frames:  # counted once per batch; see metrics.py
+            counters.FRAMES_IN[PROTOCOL_V2].inc(frames)
+            if failures:
+                counters.CHECKSUM_FAILURES[PROTOCOL_V2].inc(failures)
+
+    def nak_overdue(self):
+        """Repeat a NAK whose resend is overdue (arq); call while waiting for data."""
+        seq = self.sequence.overdue()
+        if seq is not None and self.writer is not None:
+            self.writer.send_nak(seq)
+
+    def take_frames(self, data):
+        """
+        For the handshake stage reading a promoted spectator's ID line: decode
+        the whole packets in front of it in `data` (bytes peeked from the
+        socket, typically PONGs to pings sent before SEND-ID) and return how
+        many bytes they take up, or None while one is still incomplete. The
+        caller then discards that many bytes from the socket.
+        """
+        pos = 0
+        if self.proto == PROTOCOL_V2:
+            # Frames start with their type (< 0x20); a text line with a letter
+            while pos < len(data) and data[pos] < 0x20:
+                if len(data) - pos < V2_HEADER.size:
+                    return None
+                if not header_intact(data[pos:pos + V2_HEADER.size]):
+                    pos += 1  # decoded below, which looks for the next header the same way
+                    continue
+                _, flags, length, _, _ = V2_HEADER.unpack_from(data, pos)
+                size = V2_HEADER.size + (V2_SEQ.size if flags & FLAG_SEQ else 0) + length
+                if len(data) - pos < size:
+                    return None
+                pos += size
+        else:
+            while pos < len(data) and not data.startswith(b"ID", pos):
+                end = data.find(b"\n", pos)
+                if end < 0:
+                    return None
+                pos = end + 1
+        if pos:
+            if len(self._buf) - self._end < pos:
+                self._make_room()  # pos is at most one peek, well under _MIN_RECV
+            self._buf[self._end:self._end + pos] = data[:pos]
+            self._end += pos
+            self._decode(self._ready)
+        return pos
+
+    def _pong(self, payload):
+        # Keepalive answers never reach the game, whether or not anyone is timing them
+        if self.on_pong is not None:
+            self.on_pong(payload.decode('utf-8', 'replace'))
+
+    def _answer_nak(self, payload):
+        try:
+            seq = int(payload.tobytes())
+        except ValueError:
+            return
+        if self.writer is not None:
+            self._resend(seq)
+
+    def _resend(self, seq):
+        if not self._polling:
+            self.writer.retransmit(seq)
+            return
+        # A polling thread must not block on this peer; the next poll() carries on
+        if self.writer.retransmit(seq, wait=False):
+            self._unanswered = None
+            self._unflushed = not self.writer.flush_nowait()
+        else:
+            self._unanswered = seq
+
+    def _decode_v1(self, out):
+        last = self._buf.rfind(b"\n", self._start, self._end)
+        if last < 0:
+            return
+        # One copy per recv(); the lines are then split and checked by C code
+        lines = self._view[self._start:last].tobytes().split(b"\n")
+        self._start = last + 1
+        crc32 = zlib.crc32
+        failures = 0
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            # "<type>|<8 hex digits>|<payload>"
+            first = line.find(b"|")
+            if 0 < first < len(line) - 9 and line[first + 9] == 124:
+                payload = line[first + 10:]
+                try:
+                    valid = crc32(payload) == int(line[first + 1:first + 9], 16)
+                    # Packet types are single digits; skip the slice for those
+                    pkt_type = line[0] - 48 if first == 1 and 48 <= line[0] <= 57 else int(line[:first])
+                except ValueError:
+                    valid = False
+                if valid:
+                    if pkt_type == PACKET_TYPE_CONTROL and payload.startswith(b"PONG"):
+                        self._pong(payload)
+                        continue
+                    out.append((pkt_type, payload.decode('utf-8', 'replace')))
+                    continue
+            failures += 1
+            out.append((None, line.decode('utf-8', 'replace').strip()))
+        counters.FRAMES_IN[PROTOCOL_V1].inc(len(lines))
+        if failures:
+            counters.CHECKSUM_FAILURES[PROTOCOL_V1].inc(failures)
+
+    def close(self):
+        pass
+
+
+def recv_packet(rfile):
+    """
+    Read one packet from a PacketReader, or from a text file of v1 lines.
+    Returns (pkt_type, payload) or None at end of stream. A v1 line that is
+    not a valid packet comes back as (None, <stripped line>) for legacy input.
+    """
+    if isinstance(rfile, PacketReader):
+        return rfile.read_packet()
+    line = rfile.readline()
+    if not line:
+        return None
+    counters.FRAMES_IN[PROTOCOL_V1].inc()
+    pkt_type, checksum, payload = decode_packet(line)
+    if pkt_type is None:
+        return None, line.strip()
+    return pkt_type, payload
+
+
+def send_id_line(wfile, player_id: str):
+    """Send an "ID" line; it is plain text in both protocol versions."""
+    if isinstance(wfile, PacketWriter):
+        wfile.send_line(f"ID {player_id}")
+    else:
+        wfile.write(f"ID {player_id}\n")
+        wfile.flush()
+
+
+def recv_line(sock) -> str:
+    """
+    Read one plain-text line (e.g. the "PROTO 2" acknowledgement) straight
+    from a socket, one byte at a time so nothing after it is consumed.
+    """
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(1)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode(errors='replace')
+
+
+# ----------------------------------------------------------------------
+# Compact boards (protocol v2)
+# ----------------------------------------------------------------------
+#
+# PACKET_TYPE_BOARD payload: "<view> <size> <cells>", where <cells> is the
+# grid packed at 2 bits per cell (row-major, '.', 'S', 'X', 'o' = 0..3) and
+# base64-encoded: 36 characters for a 10x10 board, 3336 for the largest
+# (battleship.MAX_BOARD_SIZE, 100x100).
+# PACKET_TYPE_DELTA payload: "<view> <row>,<col>,<cell>[;...]" with the
+# new contents of each changed cell.
+# <view> is "self" (your board), "opponent" (what you know of theirs), or
+# "player1" / "player2" for spectators.
+
+VIEW_SELF = "self"
+VIEW_OPPONENT = "opponent"
+CELL_SYMBOLS = ".SXo"
+_CELL_CODES = {symbol: code for code, symbol in enumerate(CELL_SYMBOLS)}
+
+
+def encode_board(view: str, grid, size: int) -> str:
+    packed = bytearray((size * size + 3) // 4)
+    i = 0
+    for row in grid:
+        for cell in row:
+            packed[i >> 2] |= _CELL_CODES.get(cell, 0) << ((i & 3) * 2)
+            i += 1
+    return encode_packed_board(view, size, packed)
+
+
+def pack_cell(packed: bytearray, i: int, cell: str):
+    """Set cell i (row * size + col) of a packed board, as encode_board packs it."""
+    shift = (i & 3) * 2
+    packed[i >> 2] = (packed[i >> 2] & ~(3 << shift)) | (_CELL_CODES.get(cell, 0) << shift)
+
+
+def encode_packed_board(view: str, size: int, packed) -> str:
+    """A PACKET_TYPE_BOARD payload from cells already packed (see pack_cell)."""
+    return f"{view} {size} {base64.b64encode(packed).decode()}"
+
+
+def decode_board(payload: str):
+    """Return (view, grid) for a PACKET_TYPE_BOARD payload."""
+    view, size, cells = payload.split(" ", 2)
+    size = int(size)
+    packed = base64.b64decode(cells)
+    grid = []
+    for r in range(size):
+        row = []
+        for c in range(size):
+            i = r * size + c
+            row.append(CELL_SYMBOLS[(packed[i >> 2] >> ((i & 3) * 2)) & 3])
+        grid.append(row)
+    return view, grid
+
+
+def encode_delta(view: str, cells) -> str:
+    """cells: iterable of (row, col, symbol)."""
+    return f"{view} " + ";".join(f"{r},{c},{symbol}" for r, c, symbol in cells)
+
+
+def apply_delta(grids, payload: str):
+    """Apply a PACKET_TYPE_DELTA payload to grids[view]; returns the view."""
+    view, cells = payload.split(" ", 1)
+    grid = grids[view]
+    for cell in cells.split(";"):
+        r, c, symbol = cell.split(",")
+        grid[int(r)][int(c)] = symbol
+    return view
+
+
+def speaks_v2(wfile) -> bool:
+    return getattr(wfile, 'proto', PROTOCOL_V1) == PROTOCOL_V2
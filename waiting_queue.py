@@ -0,0 +1,241 @@
+"""
+waiting_queue.py
+
+Thread-safe queue of players waiting for a match.
+
+Every entry gets an integer ticket when it joins. Tickets in the queue are
+contiguous, so a client's position is its ticket minus the ticket at the
+front, minus the number of clients that left from the middle in between
+(kept in a small sorted list). With no mid-queue departures this is O(1).
+
+The queue also remembers which region changed since the last round of
+notifications, so the notifier only looks at (and writes to) clients whose
+position actually moved.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+
+class WaitingQueue:
+    """
+    FIFO of (key, item) pairs, keyed by player ID. Internals:
+      - _order: deque of (ticket, key); entries that left from the middle
+        stay here until they reach the front (lazy deletion)
+      - _tickets / _items: key -> ticket / item for entries still waiting
+      - _joined: key -> time.monotonic() when the entry joined
+      - _popped: key -> join time of the last two entries popped, which is
+        all a matchmaker ever puts back with push_front()
+      - _removed: sorted tickets of mid-queue departures still inside _order
+      - _dirty_from: smallest ticket whose position may have changed since
+        the last collect_changes(), or None
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._order = deque()
+        self._tickets = {}
+        self._items = {}
+        self._joined = {}
+        self._popped = {}
+        self._removed = []
+        self._next_ticket = 0
+        self._dirty_from = None
+        self._last_notified = {}
+        self.changed = threading.Event()
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, key):
+        return key in self._tickets
+
+    # ------------------------------------------------------------------
+    # Mutations (all under the lock)
+    # ------------------------------------------------------------------
+
+    def _mark_dirty(self, ticket):
+        if self._dirty_from is None or ticket < self._dirty_from:
+            self._dirty_from = ticket
+        self.changed.set()
+
+    def _discard(self, key):
+        ticket = self._tickets.pop(key, None)
+        if ticket is None:
+            return
+        self._items.pop(key)
+        self._joined.pop(key)
+        self._last_notified.pop(key, None)
+        bisect.insort(self._removed, ticket)
+        self._mark_dirty(ticket + 1)
+        self._trim_front()
+
+    def _trim_front(self):
+        # Drop lazily deleted entries that have reached the front
+        while self._order:
+            ticket, key = self._order[0]
+            if self._tickets.get(key) == ticket:
+                break
+            self._order.popleft()
+            idx = bisect.bisect_left(self._removed, ticket)
+            if idx < len(self._removed) and self._removed[idx] == ticket:
+                del self._removed[idx]
+
+    def push(self, key, item):
+        """Add item to the back of the queue (replacing an older entry for key)."""
+        with self._cond:
+            self._discard(key)
+            self._popped.pop(key, None)
+            ticket = self._order[-1][0] + 1 if self._order else self._next_ticket
+            self._next_ticket = ticket + 1
+            self._order.append((ticket, key))
+            self._tickets[key] = ticket
+            self._items[key] = item
+            self._joined[key] = time.monotonic()
+            self._mark_dirty(ticket)
+            self._cond.notify_all()
+            return len(self._tickets)
+
+    def push_front(self, key, item):
+        """
+        Put item back at the front of the queue, ahead of everyone else. An
+        entry just popped keeps the time it first joined, so a put-back
+        player does not start waiting (e.g. for a bot) all over again.
+        """
+        with self._cond:
+            joined = self._popped.pop(key, None) or self._joined.get(key) or time.monotonic()
+            self._discard(key)
+            ticket = self._order[0][0] - 1 if self._order else self._next_ticket
+            self._order.appendleft((ticket, key))
+            self._tickets[key] = ticket
+            self._items[key] = item
+            self._joined[key] = joined
+            self._mark_dirty(ticket)
+            self._cond.notify_all()
+            return len(self._tickets)
+
+    def remove(self, key):
+        """Remove key from wherever it is in the queue. Returns its item or None."""
+        with self._cond:
+            item = self._items.get(key)
+            self._discard(key)
+            return item
+
+    def _pop(self):
+        ticket, key = self._order.popleft()
+        del self._tickets[key]
+        self._popped[key] = self._joined.pop(key)
+        if len(self._popped) > 2:
+            del self._popped[next(iter(self._popped))]
+        self._last_notified.pop(key, None)
+        item = self._items.pop(key)
+        self._trim_front()
+        if self._order:
+            self._mark_dirty(self._order[0][0])
+        return item
+
+    def pop(self):
+        """Pop the front item, or return None if the queue is empty."""
+        with self._cond:
+            if not self._tickets:
+                return None
+            return self._pop()
+
+    def pop_pair(self):
+        """Pop the two front items, or return None if fewer than two are waiting."""
+        with self._cond:
+            if len(self._tickets) < 2:
+                return None
+            return self._pop(), self._pop()
+
+    def wait_pop_pair(self, can_start=lambda: True):
+        """
+        Block until two players are waiting and can_start() is true, then pop
+        and return both. Callers must call notify() when can_start() may have
+        become true for reasons outside the queue (e.g. a game slot freed).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._tickets) >= 2 and can_start())
+            return self._pop(), self._pop()
+
+    def wait_pop_lone(self, min_wait, can_start=lambda: True):
+        """
+        Block until one player has been waiting on their own for min_wait
+        seconds and can_start() is true, then pop and return them. While
+        two or more wait, they are left for wait_pop_pair().
+        """
+        with self._cond:
+            while True:
+                left = self._lone_wait(min_wait)
+                if left == 0 and can_start():
+                    return self._pop()
+                self._cond.wait(left or None)
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _position(self, ticket):
+        front = self._order[0][0]
+        skipped = bisect.bisect_left(self._removed, ticket) - bisect.bisect_left(self._removed, front)
+        return ticket - front - skipped + 1
+
+    def position(self, key):
+        """1-based position of key in the queue, or None if it is not waiting."""
+        with self._lock:
+            ticket = self._tickets.get(key)
+            if ticket is None:
+                return None
+            return self._position(ticket)
+
+    def _lone_wait(self, min_wait):
+        if len(self._tickets) != 1:
+            return None
+        waited = time.monotonic() - self._joined[self._order[0][1]]
+        return max(0.0, min_wait - waited)
+
+    def lone_wait(self, min_wait):
+        """
+        Seconds until the only waiting player has waited min_wait seconds
+        (0 once they have), or None unless exactly one player is waiting.
+        """
+        with self._lock:
+            return self._lone_wait(min_wait)
+
+    def snapshot(self):
+        """List of waiting items, front first."""
+        with self._lock:
+            return [self._items[key] for ticket, key in self._order if self._tickets.get(key) == ticket]
+
+    def collect_changes(self):
+        """
+        Return [(key, item, position), ...] for every waiting client whose
+        position differs from the one returned for it last time. Only the
+        part of the queue behind the earliest change is examined.
+        """
+        with self._lock:
+            self.changed.clear()
+            if self._dirty_from is None or not self._order:
+                self._dirty_from = None
+                return []
+            start_ticket = max(self._dirty_from, self._order[0][0])
+            self._dirty_from = None
+            position = self._position(start_ticket)
+            changes = []
+            start = start_ticket - self._order[0][0]
+            for ticket, key in islice(self._order, start, None):
+                if self._tickets.get(key) != ticket:
+                    continue
+                if self._last_notified.get(key) != position:
+                    self._last_notified[key] = position
+                    changes.append((key, self._items[key], position))
+                position += 1
+            return changes